@@ -5,29 +5,41 @@ This file is part of the Anki IPA add-on for Anki.
 Main Module, hooks add-on methods into Anki.
 Copyright: (c) m-rtin <https://github.com/m-rtin>
 License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+
+Only the hooks are set up when Anki starts. Everything needed for transcriptions (requests, bs4,
+the cache, ...) is imported by the main module when the IPA button or the browser entry is used
+for the first time.
 """
 
 import os
-import urllib
+import time
 import logging
 
+_import_start = time.perf_counter()
 
 from anki.hooks import addHook, wrap
 from aqt import mw
+from aqt.browser import Browser
 from aqt.editor import Editor
-from aqt.utils import showInfo
 
-from . import consts, parse_ipa_transcription, utils, batch_adding
+from . import consts
 from .config import setup_synced_config
 from typing import List, Callable
 
-filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "app.log")
-logging.basicConfig(filename=filename, level=logging.DEBUG)
+# Maximum time importing the add-on may add to Anki's startup
+IMPORT_TIME_BUDGET = 0.05  # seconds
 
 ADDON_PATH = os.path.dirname(__file__)
 ICON_PATH = os.path.join(ADDON_PATH, "icons", "button.png")
 CONFIG = mw.addonManager.getConfig(__name__)
 
+logger = logging.getLogger(__name__)
+if CONFIG.get("DEBUG_LOG", False):
+    handler = logging.FileHandler(os.path.join(os.path.dirname(os.path.realpath(__file__)), "app.log"))
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
 select_elm = ("""<select onchange='pycmd("IPALang:" +"""
               """ this.selectedOptions[0].text)' """
               """style='vertical-align: top;'>{}</select>""")
@@ -38,41 +50,8 @@ def paste_ipa(editor: Editor) -> None:
 
     :param editor: Anki editor window
     """
-    lang_alias = editor.ipa_lang_alias
-    note = editor.note
-
-    # Get content of text field
-    try:
-        field_text = note[CONFIG["WORD_FIELD"]]
-    except KeyError:
-        showInfo(f"Field '{CONFIG['WORD_FIELD']}' doesn't exist.")
-        return
-    logging.debug(f"Field text: {field_text}")
-
-    field_text = field_text.lower()
-
-    # get word list from text field
-    words = utils.get_words_from_field(field_text)
-    logging.debug(f"Word list: {words}")
-
-    # parse IPA transcription for every word in word list
-    try:
-        ipa = parse_ipa_transcription.transcript(words=words, language=lang_alias, strip_syllable_separator=CONFIG["STRIP_SYLLABLE_SEPARATOR"])
-    except (urllib.error.HTTPError, IndexError):
-        showInfo("IPA not found.")
-        return
-    logging.debug(f"IPA transcription string: {ipa}")
-
-    # paste IPA transcription of every word in IPA transcription field
-    try:
-        note[CONFIG["IPA_FIELD"]] = ipa
-    except KeyError:
-        showInfo(f"Field '{CONFIG['IPA_FIELD']}' doesn't exist.")
-        return
-
-    # update editor
-    editor.loadNote()
-    editor.web.setFocus()
+    from . import main
+    main.paste_ipa(editor)
 
 
 def get_deck_name(main_window: mw) -> str:
@@ -172,6 +151,15 @@ def init_ipa(editor: Editor, *args, **kwargs) -> None:
     """
     previous_lang = get_default_lang(mw)
     editor.ipa_lang_alias = consts.LANGUAGES_MAP.get(previous_lang, "")
+    editor.ipa_prefetcher = None
+    if CONFIG.get("PREFETCH", False):
+        from .prefetch import Prefetcher
+        editor.ipa_prefetcher = Prefetcher(
+            editor,
+            word_field=CONFIG["WORD_FIELD"],
+            strip_syllable_separator=CONFIG["STRIP_SYLLABLE_SEPARATOR"],
+            delay=CONFIG.get("PREFETCH_DELAY_MS", 800),
+        )
 
 
 def on_bridge_cmd(editor: Editor, command: str, _old: Callable) -> None:
@@ -184,12 +172,48 @@ def on_bridge_cmd(editor: Editor, command: str, _old: Callable) -> None:
     # old commands are executed like before
     if not command.startswith("IPALang"):
         _old(editor, command)
+        # edits of the word field warm the cache for the IPA button
+        if getattr(editor, "ipa_prefetcher", None):
+            editor.ipa_prefetcher.on_bridge_cmd(command)
     # new language gets selected in the combobox
     else:
         _, lang = command.split(":")
         on_ipa_language_select(editor, lang)
 
 
+def on_batch_edit(browser: Browser) -> None:
+    """ Open the batch dialog, the transcription modules are imported on first use.
+
+    :param browser: Anki browser
+    """
+    from . import main
+    main.batch_adding.on_batch_edit(browser)
+
+
+def on_run_job(browser: Browser) -> None:
+    """ Choose a saved batch job and run it again.
+
+    :param browser: Anki browser
+    """
+    from . import main
+    main.batch_adding.on_run_job(browser)
+
+
+def setup_menu(browser: Browser) -> None:
+    """ Add menu entry to Anki Browser.
+
+    :param browser: Anki browser
+    """
+    menu = browser.form.menuEdit
+    menu.addSeparator()
+    a = menu.addAction('Add IPA ...')
+
+    # call on_batch_edit if entry is clicked
+    a.triggered.connect(lambda _, b=browser: on_batch_edit(b))
+    a = menu.addAction('Run IPA Job ...')
+    a.triggered.connect(lambda _, b=browser: on_run_job(b))
+
+
 addHook("profileLoaded", setup_synced_config)
 # Overwrite Editor methods
 addHook("setupEditorButtons", on_setup_buttons)
@@ -197,4 +221,9 @@ Editor.onBridgeCmd = wrap(Editor.onBridgeCmd, on_bridge_cmd, "around")
 Editor.__init__ = wrap(Editor.__init__, init_ipa)
 
 # Batch editing
-addHook("browser.setupMenus", batch_adding.setup_menu)
+addHook("browser.setupMenus", setup_menu)
+
+import_time = time.perf_counter() - _import_start
+if import_time > IMPORT_TIME_BUDGET:
+    logger.warning(f"Importing the add-on took {import_time * 1000:.0f} ms, "
+                   f"the budget is {IMPORT_TIME_BUDGET * 1000:.0f} ms")
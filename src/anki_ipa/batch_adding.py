@@ -6,32 +6,138 @@ Add IPA transcription in Anki browser.
 Copyright: (c) 2019 m-rtin <https://github.com/m-rtin>
 License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
 """
-import urllib
+import os
 
 from aqt.browser import Browser
-from aqt.utils import tooltip, askUser
+from aqt.operations import CollectionOp
+from aqt.utils import tooltip, askUser, showInfo
 import aqt.qt as qt
 import anki
+from anki.errors import NotFoundError
+from anki.utils import ids2str
 
 from aqt import mw
 CONFIG = mw.addonManager.getConfig(__name__)
 
-from typing import List, Dict
-from . import consts, parse_ipa_transcription, utils
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+from . import consts, parse_ipa_transcription
+from .batch_jobs import Job, JobJournal
+from .batch_transcriber import BatchTranscriber, NoteSnapshot
+from .fingerprints import FingerprintIndex, NoteFields, target_fingerprints
+from .stats import stats, BATCH, WRITE_BACK
+
+NO_FIELD = "(none)"
+# Statistics of the last batch as JSON
+STATS_PATH = os.path.join(os.path.dirname(__file__), "user_files", "stats.json")
+# Journals of the batch jobs and fingerprints are kept per profile, as note IDs only refer to a profile's collection
+PROFILES_PATH = os.path.join(os.path.dirname(__file__), "user_files", "profiles")
+JOURNAL_FILENAME = "batch_jobs.sqlite"
+FINGERPRINTS_FILENAME = "fingerprints.sqlite"
+
+_journal: Optional[JobJournal] = None
+_fingerprints: Optional[FingerprintIndex] = None
+
+
+def get_journal() -> JobJournal:
+    """Open the journal of the batch jobs of the current profile on first use."""
+    global _journal
+    path = os.path.join(PROFILES_PATH, mw.pm.name, JOURNAL_FILENAME)
+    if _journal is None or _journal.path != path:
+        if _journal is not None:
+            _journal.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _journal = JobJournal(path)
+    return _journal
+
+
+def get_fingerprints() -> FingerprintIndex:
+    """Open the fingerprint index of the transcribed notes of the current profile on first use."""
+    global _fingerprints
+    path = os.path.join(PROFILES_PATH, mw.pm.name, FINGERPRINTS_FILENAME)
+    if _fingerprints is None or _fingerprints.path != path:
+        if _fingerprints is not None:
+            _fingerprints.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _fingerprints = FingerprintIndex(path, negative_ttl=CONFIG.get("NEGATIVE_CACHE_TTL_DAYS", 7) * 24 * 60 * 60)
+    return _fingerprints
+
+
+def iter_note_fields(col: anki.collection.Collection, note_ids: List[int], fields: List[str],
+                     page_size: int = 1000) -> Iterator[Tuple[int, List[str]]]:
+    """ Load the texts of some fields of many notes page by page, without creating Note objects.
+
+    :param col: Anki collection
+    :param note_ids: IDs of the notes
+    :param fields: names of the fields
+    :param page_size: number of notes loaded with one query
+    :return: iterator over note IDs and the texts of the fields, missing fields get an empty text
+    """
+    field_ords = {}
+    for i in range(0, len(note_ids), page_size):
+        page = note_ids[i:i + page_size]
+        for note_id, mid, flds in col.db.execute(f"select id, mid, flds from notes where id in {ids2str(page)}"):
+            if mid not in field_ords:
+                field_map = col.models.field_map(col.models.get(mid))
+                field_ords[mid] = [field_map.get(field, (None, None))[0] for field in fields]
+            texts = flds.split("\x1f")
+            yield note_id, [texts[field_ord] if field_ord is not None else "" for field_ord in field_ords[mid]]
+
+
+def existing_note_ids(col: anki.collection.Collection, note_ids: List[int], page_size: int = 1000) -> set:
+    """ Find out which notes still exist, e.g. of an interrupted job.
+
+    :param col: Anki collection
+    :param note_ids: IDs of the notes
+    :param page_size: number of notes checked with one query
+    :return: IDs of the notes which haven't been deleted
+    """
+    existing = set()
+    for i in range(0, len(note_ids), page_size):
+        existing.update(col.db.list(f"select id from notes where id in {ids2str(note_ids[i:i + page_size])}"))
+    return existing
+
+
+def iter_note_snapshots(col: anki.collection.Collection, note_ids: List[int], field: str,
+                        page_size: int = 1000) -> Iterator[NoteSnapshot]:
+    """ Load the text of a field of many notes page by page, without creating Note objects.
+
+    :param col: Anki collection
+    :param note_ids: IDs of the notes
+    :param field: name of the field
+    :param page_size: number of notes loaded with one query
+    :return: iterator over the snapshots, notes without the field get an empty text
+    """
+    for note_id, (text,) in iter_note_fields(col, note_ids, [field], page_size):
+        yield NoteSnapshot(note_id, text)
+
 
 class AddIpaTranscriptDialog(qt.QDialog):
     """QDialog to add IPA transcription to multiple notes in Anki browser."""
 
-    def __init__(self, browser: Browser, selected_notes: List[int]) -> None:
+    def __init__(self, browser: Browser, selected_notes: List[int], job: Optional[Job] = None) -> None:
         """ Initialize AddIpaTranscriptDialog and setup UI.
 
         :param browser: Anki browser
         :param selected_notes: IDs of selected notes in Anki browser
+        :param job: saved or interrupted job whose settings are used
         """
         qt.QDialog.__init__(self, parent=browser)
         self.thread = qt.QThread()
         self.browser = browser
         self.selected_notes = selected_notes
+        self.journal = get_journal()
+        self.job = job
+        self.fingerprints = get_fingerprints()
+        # note ID -> fingerprints by target field of the notes being transcribed
+        self.note_fingerprints: Dict[int, Dict[str, str]] = {}
+        # IDs of the notes the job hadn't transcribed when it was started
+        self.outstanding: List[int] = []
+        self.unchanged_count = 0
+        self.reported = False
+        # collection operations whose notes haven't been marked as done in the journal yet
+        self.pending_writes = 0
+        # all notes have been looked up, the job is finished once the pending writes are done
+        self.job_completed = False
         self._setup_comboboxes()
         self._setup_form()
         self._setup_buttons()
@@ -60,6 +166,26 @@ class AddIpaTranscriptDialog(qt.QDialog):
             idx_ipa=self.field_combobox.findText(CONFIG["IPA_FIELD"])
             if idx_ipa > 0:
                 self.field_combobox.setCurrentIndex(idx_ipa)
+        # optional field for a variant read from the same page (e.g. american for british)
+        self.variant_combobox = qt.QComboBox()
+        self.variant_combobox.addItem(NO_FIELD)
+        self.variant_combobox.addItems(fields)
+        if CONFIG.get("VARIANT_IPA_FIELD"):
+            idx_variant=self.variant_combobox.findText(CONFIG["VARIANT_IPA_FIELD"])
+            if idx_variant > 0:
+                self.variant_combobox.setCurrentIndex(idx_variant)
+        if self.job:
+            self._select_job_settings(self.job)
+
+    def _select_job_settings(self, job: Job) -> None:
+        """Select language and fields of a job."""
+        lang, field = next(iter(job.targets.items()))
+        self.lang_combobox.setCurrentIndex(max(self.lang_combobox.findText(lang), 0))
+        self.base_combobox.setCurrentIndex(max(self.base_combobox.findText(job.base_field), 0))
+        self.field_combobox.setCurrentIndex(max(self.field_combobox.findText(field), 0))
+        variant_fields = list(job.targets.values())[1:]
+        self.variant_combobox.setCurrentIndex(
+            max(self.variant_combobox.findText(variant_fields[0]), 0) if variant_fields else 0)
 
     def _setup_form(self) -> None:
         """Setup form for user interaction."""
@@ -69,14 +195,48 @@ class AddIpaTranscriptDialog(qt.QDialog):
         form_layout.addRow(qt.QLabel("Language:"), self.lang_combobox)
         form_layout.addRow(qt.QLabel("Field of word:"), self.base_combobox)
         form_layout.addRow(qt.QLabel("Field of IPA transcription:"), self.field_combobox)
+        self.variant_label = qt.QLabel()
+        form_layout.addRow(self.variant_label, self.variant_combobox)
+        # saved jobs find their notes with the browser's search, running them again only adds new notes
+        self.job_name_edit = qt.QLineEdit()
+        self.job_name_edit.setPlaceholderText("optional, saves the current search as job")
+        if self.job and self.job.name:
+            self.job_name_edit.setText(self.job.name)
+        form_layout.addRow(qt.QLabel("Job name:"), self.job_name_edit)
+        self.incremental_checkbox = qt.QCheckBox("Skip notes whose word field hasn't changed")
+        self.incremental_checkbox.setChecked(CONFIG.get("INCREMENTAL", False))
+        form_layout.addRow(self.incremental_checkbox)
 
         self.form_group_box.setLayout(form_layout)
+        self.lang_combobox.currentTextChanged.connect(self.on_language_changed)
+        self.on_language_changed(self.lang_combobox.currentText())
+
+    def on_language_changed(self, lang: str) -> None:
+        """ Show the variant field only for languages with variants on the same page.
+
+        :param lang: selected language
+        """
+        variants = parse_ipa_transcription.variants_of(lang)
+        if variants:
+            self.variant_label.setText(f"Field of {variants[0]} IPA transcription:")
+        self.variant_label.setVisible(bool(variants))
+        self.variant_combobox.setVisible(bool(variants))
+
+    def _get_targets(self) -> Dict[str, str]:
+        """Map each language to transcribe to its target field."""
+        lang = self.lang_combobox.currentText()
+        targets = {lang: self.field_combobox.currentText()}
+        variants = parse_ipa_transcription.variants_of(lang)
+        if variants and self.variant_combobox.currentText() != NO_FIELD:
+            targets[variants[0]] = self.variant_combobox.currentText()
+        return targets
 
     def _setup_progressbar(self) -> None:
         """Setup progressbar which indicates how many IPA transcriptions already have been added."""
         self.progress = qt.QProgressBar(self)
         self.progress.setMinimum(0)
         self.progress.setMaximum(len(self.selected_notes))
+        self.dedup_label = qt.QLabel(self)
 
     def _setup_buttons(self) -> None:
         """Setup add button."""
@@ -93,6 +253,7 @@ class AddIpaTranscriptDialog(qt.QDialog):
         main_layout = qt.QVBoxLayout()
         main_layout.addWidget(self.form_group_box)
         main_layout.addWidget(self.progress)
+        main_layout.addWidget(self.dedup_label)
         main_layout.addLayout(self.bottom_hbox)
         self.setLayout(main_layout)
         self.setWindowTitle("Add IPA transcriptions")
@@ -113,24 +274,79 @@ class AddIpaTranscriptDialog(qt.QDialog):
         """
         self.progress.setValue(value)
 
+    @qt.pyqtSlot(int, int)
+    def on_words_collected(self, word_count: int, distinct_word_count: int) -> None:
+        """ Show how many lookups are saved by looking up each distinct word once.
+
+        :param word_count: number of words in the base fields of the notes collected so far
+        :param distinct_word_count: number of distinct words of each page of notes, summed up
+        """
+        saved = 1 - distinct_word_count / word_count if word_count else 0
+        text = f"{distinct_word_count} distinct of {word_count} words ({saved:.0%} fewer lookups)"
+        if self.unchanged_count:
+            text += f", {self.unchanged_count} unchanged notes skipped"
+        self.dedup_label.setText(text)
+        # without the unchanged notes
+        self.progress.setMaximum(len(self.outstanding) - self.unchanged_count)
+
     def on_confirm(self) -> None:
         """Get IPA transcriptions for the selected notes.
 
-        We get the IPA transcriptions by calling Worker in a different thread.
-        Once it finishes we write the results into the right target fields of all the selected notes.
-        We can't do this within the thread because SQLite doesn't support multi-threading.
+        We get the IPA transcriptions by calling Worker in a different thread, it loads the base
+        field of the notes page by page while it goes. Whenever it has finished a chunk of notes we
+        write the results into the right target fields with a collection operation.
         """
-        question = f"This will overwrite the current content of the IPA transcription field. Proceed?"
+        incremental = self.incremental_checkbox.isChecked()
+        if incremental:
+            question = "This will overwrite the IPA transcription field of new and changed notes. Proceed?"
+        else:
+            question = f"This will overwrite the current content of the IPA transcription field. Proceed?"
         if not askUser(question, parent=self):
             return
 
-        notes = self._create_note_dictionary()
+        base_field = self.base_combobox.currentText()
+        name = self.job_name_edit.text().strip() or None
+        search = self.job.search if self.job and self.job.name == name else None
+        if name and search is None:
+            search = self.browser.current_search()
+        if not self.job or self.job.name != name or self.job.base_field != base_field \
+                or self.job.targets != self._get_targets():
+            if self.job:
+                # the settings of the resumed or saved job have been changed
+                self.journal.discard(self.job.id)
+            self.job = self.journal.create(base_field, self._get_targets(), name=name, search=search)
+        # transcriptions fetched before the job was interrupted
+        unwritten = self.journal.unwritten(self.job.id)
+        if unwritten:
+            self.add_ipa_transcription(unwritten)
+        outstanding = self.journal.start(self.job.id, self.selected_notes)
+        # notes deleted since the job was interrupted or saved
+        existing = existing_note_ids(self.browser.mw.col, outstanding)
+        self.journal.mark_done(self.job.id, [note_id for note_id in outstanding if note_id not in existing])
+        outstanding = [note_id for note_id in outstanding if note_id in existing]
+        if not outstanding:
+            tooltip("All notes of this job have IPA transcriptions already.", parent=self.browser)
+            self.job_completed = True
+            self._finish_job()
+            self.close()
+            return
+        self.outstanding = outstanding
+        self.progress.setMaximum(len(outstanding))
+
+        notes = self._iter_notes(outstanding, base_field, self.job.targets, incremental)
 
-        self.worker = Worker(notes, self.lang_combobox.currentText(), self.base_combobox.currentText())
+        self.worker = Worker(notes, self.job.targets,
+                             strip_syllable_separator=CONFIG["STRIP_SYLLABLE_SEPARATOR"],
+                             max_workers=CONFIG.get("BATCH_WORKERS", 8),
+                             chunk_size=CONFIG.get("BATCH_CHUNK_SIZE", 500),
+                             deadline=CONFIG.get("BATCH_DEADLINE_MINUTES", 0) * 60 or None,
+                             journal=self.journal, job_id=self.job.id)
 
         # connect methods
         self.worker.progress_changed.connect(self.on_progress_changed)
+        self.worker.words_collected.connect(self.on_words_collected)
         self.worker.result.connect(self.add_ipa_transcription)
+        self.worker.not_found.connect(self.on_not_found)
         self.worker.finished.connect(self.thread.quit)
 
         # thread management
@@ -140,40 +356,135 @@ class AddIpaTranscriptDialog(qt.QDialog):
         self.thread.finished.connect(self.close)
         self.thread.start()
 
-    def _create_note_dictionary(self) -> Dict[int, anki.notes.Note]:
-        """Map each note id to the corresponding Anki note object."""
-        notes = {
-            note: self.browser.mw.col.get_note(note)
-            for note in self.selected_notes
-        }
-        return notes
+    def _iter_notes(self, note_ids: List[int], base_field: str, targets: Dict[str, str],
+                    incremental: bool) -> Iterator[NoteSnapshot]:
+        """ Load the notes in the worker thread and remember the fingerprints of their word fields.
+
+        :param note_ids: IDs of the notes
+        :param base_field: field which contains the words
+        :param targets: languages and their target fields
+        :param incremental: skip the notes whose target fields are current
+        """
+        col = self.browser.mw.col
+        if incremental:
+            target_fields = list(targets.values())
+            notes = (NoteFields(note_id, texts[0], dict(zip(target_fields, texts[1:])))
+                     for note_id, texts in iter_note_fields(col, note_ids, [base_field] + target_fields))
+            changed = self.fingerprints.changed(notes, targets, CONFIG["STRIP_SYLLABLE_SEPARATOR"],
+                                                on_unchanged=self._add_unchanged)
+        else:
+            changed = ((NoteFields(note.note_id, note.field_text, {}),
+                        target_fingerprints(note.field_text, targets, CONFIG["STRIP_SYLLABLE_SEPARATOR"]))
+                       for note in iter_note_snapshots(col, note_ids, base_field))
+        for note, fingerprints in changed:
+            self.note_fingerprints[note.note_id] = fingerprints
+            yield NoteSnapshot(note.note_id, note.text)
+
+    def _add_unchanged(self, note_ids: List[int]) -> None:
+        # their transcriptions are current, there is nothing left to do for them
+        self.journal.mark_done(self.job.id, note_ids)
+        self.unchanged_count += len(note_ids)
+
+    @qt.pyqtSlot(list)
+    def on_not_found(self, note_ids: List[int]) -> None:
+        """ Remember that no transcriptions were found for the current word fields of some notes.
+
+        :param note_ids: IDs of the notes
+        """
+        self.fingerprints.set_many({note_id: self.note_fingerprints.pop(note_id) for note_id in note_ids
+                                    if note_id in self.note_fingerprints}, found=False)
+
+    def _store_fingerprints(self, result_dict: Dict[int, Dict[str, str]]) -> None:
+        """Store the fingerprints of notes whose transcriptions have been written."""
+        written, not_found = {}, {}
+        for note_id, ipa_transcriptions in result_dict.items():
+            for field, value in self.note_fingerprints.pop(note_id, {}).items():
+                (written if field in ipa_transcriptions else not_found).setdefault(note_id, {})[field] = value
+        self.fingerprints.set_many(written)
+        self.fingerprints.set_many(not_found, found=False)
 
     @qt.pyqtSlot(dict)
-    def add_ipa_transcription(self, result_dict: Dict[int, str]) -> None:
-        """ Add IPA transcriptions to the target fields of all selected notes.
+    def add_ipa_transcription(self, result_dict: Dict[int, Dict[str, str]]) -> None:
+        """ Add IPA transcriptions of a chunk of notes to their target fields.
+
+        All notes of the chunk are saved with a single undoable operation, afterwards the browser
+        only redraws the changed rows.
 
-        :param result_dict: dictionary of Anki notes and their IPA transcriptions
+        :param result_dict: dictionary of Anki notes and their target fields with IPA transcriptions
         """
-        mw = self.browser.mw
-        mw.checkpoint("add ipa transcription")
-        mw.progress.start()
-        self.browser.model.beginReset()
-
-        for note_id, ipa_transcription in result_dict.items():
-            note = mw.col.get_note(note_id)
-            target_field = self.field_combobox.currentText()
-            note[target_field] = ipa_transcription
-            note.flush()
-
-        self.browser.model.endReset()
-        # mw.requireReset()
-        mw.CollectionOp()
-        mw.progress.finish()
-        mw.reset()
+        col = self.browser.mw.col
+        notes = []
+        for note_id, ipa_transcriptions in result_dict.items():
+            try:
+                note = col.get_note(note_id)
+            except NotFoundError:
+                # deleted while the job was running or interrupted
+                continue
+            for target_field, ipa_transcription in ipa_transcriptions.items():
+                note[target_field] = ipa_transcription
+            notes.append(note)
+
+        def update_notes(col: anki.collection.Collection):
+            with stats.timer(WRITE_BACK):
+                return col.update_notes(notes)
+
+        def on_success(_) -> None:
+            self.journal.mark_done(job_id, result_dict)
+            self._store_fingerprints({note.id: result_dict[note.id] for note in notes})
+            self.pending_writes -= 1
+            self._finish_job()
+
+        job_id = self.job.id
+        self.pending_writes += 1
+        CollectionOp(parent=self.browser, op=update_notes).success(on_success).run_in_background()
+
+    def _finish_job(self) -> None:
+        """Mark the job as finished once all notes have been looked up and their transcriptions written."""
+        if self.job_completed and not self.pending_writes:
+            self.journal.finish(self.job.id)
+
+    def report(self) -> None:
+        """Show the statistics of the batch, the skipped notes can be shown in the browser."""
+        # the dialog is closed again when the thread's finished signal arrives
+        if self.reported:
+            return
+        self.reported = True
+        transcriber = self.worker.transcriber
+        if self.worker.completed:
+            # failed lookups aren't retried when the job is resumed, only stopped or timed out jobs are
+            self.journal.mark_done(self.job.id, list(transcriber.skipped))
+            self.job_completed = True
+            self._finish_job()
+        try:
+            os.makedirs(os.path.dirname(STATS_PATH), exist_ok=True)
+            stats.write(STATS_PATH)
+        except OSError as e:
+            tooltip(f"Statistics could not be saved: {e}")
+
+        message = f"{transcriber.note_count} notes\n{stats.summary()}"
+        if self.unchanged_count:
+            message = f"{self.unchanged_count} unchanged notes skipped\n{message}"
+        skipped = dict(transcriber.skipped)
+        if not self.worker.completed:
+            # the notes after the page the worker was stopped on haven't been read at all
+            for note_id in self.journal.outstanding(self.job.id, self.outstanding):
+                skipped.setdefault(note_id, transcriber.token.reason or "cancelled")
+        if not skipped:
+            showInfo(message, parent=self.browser, title="IPA transcriptions added")
+            return
+        reasons = {}
+        for reason in skipped.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        summary = ", ".join(f"{count} {reason}" for reason, count in reasons.items())
+        question = f"{message}\n\n{len(skipped)} notes have been skipped ({summary}). Show them in the browser?"
+        if askUser(question, parent=self.browser):
+            self.browser.search_for(f"nid:{','.join(map(str, skipped))}")
 
     def closeEvent(self, event: qt.QCloseEvent) -> None:
         """ Stop worker and thread when window is closed by user.
 
+        Lookups in progress are aborted, so the worker finishes right away.
+
         :param event: user wants to close window
         """
         if hasattr(self, 'worker'):
@@ -181,6 +492,8 @@ class AddIpaTranscriptDialog(qt.QDialog):
         self.thread.quit()
         event.accept()
         self.thread.wait()
+        if hasattr(self, 'worker'):
+            self.report()
 
 
 class Worker(qt.QObject):
@@ -188,41 +501,80 @@ class Worker(qt.QObject):
 
     finished = qt.pyqtSignal()
     progress_changed = qt.pyqtSignal(int)
+    words_collected = qt.pyqtSignal(int, int)
     result = qt.pyqtSignal(dict)
+    not_found = qt.pyqtSignal(list)
 
-    def __init__(self, notes: Dict[int, anki.notes.Note], lang: str, base_field: str) -> None:
+    def __init__(self, notes: Iterable[NoteSnapshot], targets: Dict[str, str], strip_syllable_separator: bool = True,
+                 max_workers: int = 8, chunk_size: int = 500, deadline: Optional[float] = None,
+                 journal: Optional[JobJournal] = None, job_id: Optional[int] = None) -> None:
         """ Initialize Worker.
 
-        :param notes: Anki notes we want to use
-        :param lang: language of base field content
-        :param base_field: field for which we want to get IPA transcriptions
+        :param notes: IDs and base field texts of the Anki notes we want to use, read lazily
+        :param targets: languages of base field content and the fields their IPA transcriptions are written to
+        :param strip_syllable_separator: whether syllable separators are removed
+        :param max_workers: number of groups of words that are looked up concurrently
+        :param chunk_size: number of notes whose transcriptions are emitted together
+        :param deadline: seconds after which the remaining notes are skipped, None for no deadline
+        :param journal: journal the transcriptions are recorded in before they are emitted
+        :param job_id: ID of the job in the journal
         """
         super().__init__()
-        self.notes = notes
-        self.lang = lang
-        self.base_field = base_field
-        self._isRunning = True
+        self.targets = targets
+        self.transcriber = BatchTranscriber(notes, list(targets), strip_syllable_separator, max_workers=max_workers,
+                                            chunk_size=chunk_size, deadline=deadline)
+        self.journal = journal
+        self.job_id = job_id
+        # all notes have been looked up, neither stopped nor past the deadline
+        self.completed = False
+
+    def _emit_chunk(self, chunk: Dict[int, Dict[str, str]]) -> None:
+        """Journal and emit the transcriptions of a chunk of notes by target field."""
+        result = {
+            note_id: {self.targets[lang]: ipa for lang, ipa in transcriptions.items()}
+            for note_id, transcriptions in chunk.items()
+        }
+        if self.journal:
+            self.journal.record(self.job_id, result)
+        self.result.emit(result)
+
+    def _record_not_found(self, note_ids: List[int]) -> None:
+        if self.journal:
+            self.journal.mark_done(self.job_id, note_ids)
+        self.not_found.emit(note_ids)
+
+    def _emit_words_collected(self) -> None:
+        self.words_collected.emit(self.transcriber.word_count, self.transcriber.distinct_word_count)
 
     @qt.pyqtSlot()
     def run(self) -> None:
-        """Get IPA transcription for each note and save it into a dictionary."""
-        new_dict = dict()
-        for index, key in enumerate(self.notes.keys()):
-            try:
-                words = utils.get_words_from_field(field_text=self.notes[key][self.base_field])
-                new_dict[key] = parse_ipa_transcription.transcript(words=words, language=self.lang)
-            # IPA transcription not found
-            except (urllib.error.HTTPError, IndexError):
-                continue
-
-            self.progress_changed.emit(index)
+        """Get IPA transcription for each note and emit them in chunks.
 
-        self.result.emit(new_dict)
-        self.finished.emit()
+        Each distinct word of the selected notes is looked up once, groups of words are looked up
+        concurrently by a bounded thread pool. The number of simultaneous requests to a single
+        Wiktionary host is limited by the shared HTTP sessions.
+        Progress is reported in the order the transcriptions complete.
+        """
+        stats.reset()
+        try:
+            with stats.timer(BATCH):
+                self.transcriber.run(
+                    on_progress=self.progress_changed.emit,
+                    on_chunk=self._emit_chunk,
+                    on_collected=self._emit_words_collected,
+                    on_not_found=self._record_not_found,
+                )
+            self.completed = not self.transcriber.token.cancelled
+        finally:
+            stats.count("notes", self.transcriber.note_count)
+            stats.count("distinct words", self.transcriber.distinct_word_count)
+            stats.count("skipped notes", len(self.transcriber.skipped))
+            # the dialog waits for finished, even if the run has failed
+            self.finished.emit()
 
     def stop(self) -> None:
-        """Stop worker."""
-        self._isRunning = False
+        """Stop worker, called from the GUI thread. The remaining notes are skipped."""
+        self.transcriber.cancel()
 
 
 def on_batch_edit(browser: Browser) -> None:
@@ -230,6 +582,25 @@ def on_batch_edit(browser: Browser) -> None:
 
     :param browser: Anki browser
     """
+    journal = get_journal()
+    job = journal.unfinished()
+    if job:
+        done, total = journal.progress(job.id)
+        name = f" '{job.name}'" if job.name else ""
+        if askUser(f"The IPA job{name} was interrupted after {done} of {total} notes. Resume it?", parent=browser):
+            note_ids = journal.notes(job.id)
+            # notes deleted since the job was interrupted, the dialog reads the fields of the first note
+            existing = existing_note_ids(browser.mw.col, note_ids)
+            journal.mark_done(job.id, [note_id for note_id in note_ids if note_id not in existing])
+            note_ids = [note_id for note_id in note_ids if note_id in existing]
+            if not note_ids:
+                journal.finish(job.id)
+                tooltip("All notes of this job have been deleted.")
+                return
+            AddIpaTranscriptDialog(browser, note_ids, job).exec_()
+            return
+        journal.discard(job.id)
+
     selected_notes = browser.selectedNotes()
     if not selected_notes:
         tooltip("No cards selected.")
@@ -238,14 +609,22 @@ def on_batch_edit(browser: Browser) -> None:
     dialog.exec_()
 
 
-def setup_menu(browser: Browser) -> None:
-    """ Add menu entry to Anki Browser.
+def on_run_job(browser: Browser) -> None:
+    """ Run a saved job again with the notes its search finds now, notes it has done already are skipped.
 
     :param browser: Anki browser
     """
-    menu = browser.form.menuEdit
-    menu.addSeparator()
-    a = menu.addAction('Add IPA ...')
-
-    # call on_batch_edit if entry is clicked
-    a.triggered.connect(lambda _, b=browser: on_batch_edit(b))
+    jobs = {job.name: job for job in get_journal().saved()}
+    if not jobs:
+        tooltip("No saved IPA jobs, give a job name in the Add IPA dialog to save one.")
+        return
+    name, ok = qt.QInputDialog.getItem(browser, "Run IPA job", "Job:", list(jobs), 0, False)
+    if not ok:
+        return
+    job = jobs[name]
+    note_ids = list(browser.mw.col.find_notes(job.search))
+    if not note_ids:
+        tooltip(f"The search of job '{name}' doesn't find any notes.")
+        return
+    browser.search_for(job.search)
+    AddIpaTranscriptDialog(browser, note_ids, job).exec_()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Journal of batch jobs, so interrupted jobs can be resumed
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# States of the notes of a job
+OUTSTANDING = 0
+FETCHED = 1  # transcriptions are in the journal, but not written to the note yet
+DONE = 2
+
+
+class Job(NamedTuple):
+    """Settings of a batch job, saved jobs have a name and the browser search of their notes."""
+    id: int
+    name: Optional[str]
+    search: Optional[str]
+    base_field: str
+    targets: Dict[str, str]  # language -> target field
+    finished: Optional[float]
+
+
+class JobJournal:
+    """ Durable record of the notes each batch job has finished, stored in a single SQLite file.
+
+    Transcriptions are journaled as soon as they have been fetched and until they have been
+    written to their notes, so neither fetches nor writes are lost when Anki is closed or crashes.
+    """
+
+    def __init__(self, path: str) -> None:
+        """ Open (or create) the journal file.
+
+        :param path: path of the SQLite file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, name TEXT UNIQUE, search TEXT, base_field TEXT NOT NULL, "
+            "targets TEXT NOT NULL, created REAL NOT NULL, finished REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_notes ("
+            "job_id INTEGER NOT NULL, note_id INTEGER NOT NULL, state INTEGER NOT NULL, transcriptions TEXT, "
+            "PRIMARY KEY (job_id, note_id))"
+        )
+        self._prune()
+
+    def _job(self, row: tuple) -> Job:
+        job_id, name, search, base_field, targets, finished = row
+        return Job(job_id, name, search, base_field, json.loads(targets), finished)
+
+    def _select(self, where: str, params: tuple = ()) -> List[Job]:
+        rows = self._conn.execute(
+            f"SELECT id, name, search, base_field, targets, finished FROM jobs WHERE {where} ORDER BY id", params
+        ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def create(self, base_field: str, targets: Dict[str, str], name: Optional[str] = None,
+               search: Optional[str] = None) -> Job:
+        """ Create a job, a saved job with the same name gets the new settings.
+
+        :param base_field: field which contains the words
+        :param targets: languages and the fields their transcriptions are written to
+        :param name: name of a saved job, None for a job which is only kept until it has finished
+        :param search: browser search which finds the notes of a saved job
+        :return: the job
+        """
+        with self._lock:
+            existing = self._select("name = ?", (name,)) if name else []
+            if existing:
+                self._conn.execute("UPDATE jobs SET search = ?, base_field = ?, targets = ? WHERE id = ?",
+                                   (search, base_field, json.dumps(targets), existing[0].id))
+                job_id = existing[0].id
+            else:
+                job_id = self._conn.execute(
+                    "INSERT INTO jobs (name, search, base_field, targets, created) VALUES (?, ?, ?, ?, ?)",
+                    (name, search, base_field, json.dumps(targets), time.time()),
+                ).lastrowid
+            return self._select("id = ?", (job_id,))[0]
+
+    def saved(self) -> List[Job]:
+        """Jobs with a name, which can be run again."""
+        with self._lock:
+            return self._select("name IS NOT NULL")
+
+    def unfinished(self) -> Optional[Job]:
+        """The latest job which has been interrupted or whose transcriptions haven't all been written."""
+        with self._lock:
+            jobs = self._select(
+                "finished IS NULL AND id IN (SELECT job_id FROM job_notes) "
+                "OR id IN (SELECT job_id FROM job_notes WHERE state = ?)", (FETCHED,)
+            )
+        return jobs[-1] if jobs else None
+
+    def start(self, job_id: int, note_ids: Iterable[int]) -> List[int]:
+        """ Start or resume a job with some notes.
+
+        :param job_id: ID of the job
+        :param note_ids: IDs of the notes, notes new to the job are added
+        :return: IDs of the notes which haven't been transcribed by the job yet, in the given order
+        """
+        note_ids = list(note_ids)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("UPDATE jobs SET finished = NULL WHERE id = ?", (job_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO job_notes (job_id, note_id, state) VALUES (?, ?, ?)",
+                [(job_id, note_id, OUTSTANDING) for note_id in note_ids],
+            )
+            self._conn.execute("COMMIT")
+            return self._outstanding(job_id, note_ids)
+
+    def _outstanding(self, job_id: int, note_ids: List[int]) -> List[int]:
+        outstanding = {note_id for (note_id,) in self._conn.execute(
+            "SELECT note_id FROM job_notes WHERE job_id = ? AND state = ?", (job_id, OUTSTANDING))}
+        return [note_id for note_id in note_ids if note_id in outstanding]
+
+    def outstanding(self, job_id: int, note_ids: Iterable[int]) -> List[int]:
+        """ Notes of a job which haven't been transcribed yet, e.g. because the job was stopped.
+
+        :param job_id: ID of the job
+        :param note_ids: IDs of the notes
+        :return: IDs of the outstanding notes, in the given order
+        """
+        with self._lock:
+            return self._outstanding(job_id, list(note_ids))
+
+    def notes(self, job_id: int) -> List[int]:
+        """IDs of all notes of a job."""
+        with self._lock:
+            return [note_id for (note_id,) in self._conn.execute(
+                "SELECT note_id FROM job_notes WHERE job_id = ? ORDER BY note_id", (job_id,))]
+
+    def progress(self, job_id: int) -> Tuple[int, int]:
+        """Number of transcribed notes and of all notes of a job."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(state != ?), 0), COUNT(*) FROM job_notes WHERE job_id = ?",
+                (OUTSTANDING, job_id),
+            ).fetchone()
+
+    def record(self, job_id: int, transcriptions: Dict[int, Dict[str, str]]) -> None:
+        """ Journal fetched transcriptions before they are written to their notes.
+
+        :param job_id: ID of the job
+        :param transcriptions: note IDs and their transcriptions by target field
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE job_notes SET state = ?, transcriptions = ? WHERE job_id = ? AND note_id = ?",
+                [(FETCHED, json.dumps(fields, ensure_ascii=False), job_id, note_id)
+                 for note_id, fields in transcriptions.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    def mark_done(self, job_id: int, note_ids: Iterable[int]) -> None:
+        """ Mark notes as finished, either their transcriptions have been written or none were found.
+
+        :param job_id: ID of the job
+        :param note_ids: IDs of the notes
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE job_notes SET state = ?, transcriptions = NULL WHERE job_id = ? AND note_id = ?",
+                [(DONE, job_id, note_id) for note_id in note_ids],
+            )
+            self._conn.execute("COMMIT")
+
+    def unwritten(self, job_id: int) -> Dict[int, Dict[str, str]]:
+        """Transcriptions which have been fetched but not written to their notes."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT note_id, transcriptions FROM job_notes WHERE job_id = ? AND state = ?", (job_id, FETCHED)
+            ).fetchall()
+        return {note_id: json.loads(fields) for note_id, fields in rows}
+
+    def finish(self, job_id: int) -> None:
+        """ Mark a job as finished once all its notes have been transcribed.
+
+        Saved jobs keep their notes, so running them again only transcribes new notes.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), job_id))
+            self._prune()
+
+    def discard(self, job_id: int) -> None:
+        """Give up an interrupted job, saved jobs keep the notes which have been transcribed."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), job_id))
+            self._conn.execute("UPDATE job_notes SET state = ?, transcriptions = NULL WHERE job_id = ? AND state = ?",
+                               (OUTSTANDING, job_id, FETCHED))
+            self._conn.execute("COMMIT")
+            self._prune()
+
+    def delete(self, job_id: int) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM job_notes WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._conn.execute("COMMIT")
+
+    def _prune(self) -> None:
+        """Remove finished jobs without name whose transcriptions have all been written."""
+        self._conn.execute("BEGIN")
+        self._conn.execute(
+            "DELETE FROM job_notes WHERE job_id IN (SELECT id FROM jobs WHERE name IS NULL AND finished IS NOT NULL "
+            "AND id NOT IN (SELECT job_id FROM job_notes WHERE state = ?))", (FETCHED,)
+        )
+        self._conn.execute(
+            "DELETE FROM jobs WHERE name IS NULL AND finished IS NOT NULL "
+            "AND id NOT IN (SELECT job_id FROM job_notes)"
+        )
+        self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
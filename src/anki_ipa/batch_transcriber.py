@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Transcribe the words of many notes
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import itertools
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+
+import requests
+
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+try:
+    from . import network, parse_ipa_transcription, utils
+except ImportError:  # imported as top-level module, e.g. by the unittests
+    import network
+    import parse_ipa_transcription
+    import utils
+
+
+class NoteSnapshot(NamedTuple):
+    """ID and base field text of a note, all the batch transcription needs to know about it."""
+    note_id: int
+    field_text: str
+
+
+class BatchTranscriber:
+    """Transcribe the base field of many notes, each distinct word is looked up only once."""
+
+    def __init__(self, notes: Iterable[NoteSnapshot], languages: List[str], strip_syllable_separator: bool = True,
+                 max_workers: int = 8, chunk_size: int = 500, deadline: Optional[float] = None,
+                 page_size: int = 5000, token: Optional[network.CancelToken] = None) -> None:
+        """ Initialize BatchTranscriber.
+
+        :param notes: IDs and base field texts of the notes
+        :param languages: names of the transcription methods
+        :param strip_syllable_separator: whether syllable separators are removed
+        :param max_workers: number of groups of words that are looked up concurrently
+        :param chunk_size: number of notes whose transcriptions are handed over together
+        :param deadline: seconds after the start of run() when all lookups are aborted, None for no deadline
+        :param page_size: number of notes whose words are collected and deduplicated together
+        :param token: cancellation token of the lookups, None for a new one
+        """
+        self.notes = notes
+        self.languages = languages
+        self.strip_syllable_separator = strip_syllable_separator
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.deadline = deadline
+        self.page_size = page_size
+        self.token = token or network.CancelToken()
+        self.note_count = 0
+        self.text_count = 0
+        self.word_count = 0
+        self.distinct_word_count = 0
+        # note ID -> why the note has been skipped
+        self.skipped: Dict[int, str] = {}
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Share of word lookups saved by looking up each distinct word once."""
+        return 1 - self.distinct_word_count / self.word_count if self.word_count else 0.0
+
+    def _iter_groups(self, words: List[str]) -> Iterator[List[str]]:
+        """Split the distinct words into groups which can be looked up with about one request each."""
+        size = parse_ipa_transcription.words_per_request(self.languages[0])
+        for i in range(0, len(words), size):
+            yield words[i:i + size]
+
+    def _transcribe(self, words: List[str]) -> Dict[str, Dict[str, str]]:
+        with network.cancel_scope(self.token):
+            self.token.check()
+            return parse_ipa_transcription.transcript_variants(words, self.languages, self.strip_syllable_separator)
+
+    def cancel(self) -> None:
+        """Stop run() as soon as possible, requests in progress are aborted. Can be called from any thread."""
+        self.token.cancel()
+
+    def run(self, on_progress: Callable[[int], None], on_chunk: Callable[[Dict[int, Dict[str, str]]], None],
+            on_collected: Optional[Callable[[], None]] = None,
+            on_not_found: Optional[Callable[[List[int]], None]] = None) -> None:
+        """ Transcribe all notes.
+
+        The notes are read page by page, so only the texts of one page are kept in memory. The
+        distinct field texts and words of a page are collected, then the distinct words are looked up
+        in groups by a bounded thread pool. As soon as all words of a field text are known, the
+        transcriptions of every note of the page with this text are handed over. Words repeated on
+        later pages are looked up again, usually from the transcription cache.
+        Notes whose words couldn't be looked up, e.g. because of cancel() or the deadline, are
+        recorded in skipped. Once cancelled, no further pages are read, so the notes after the
+        current page are neither handed over nor recorded.
+
+        :param on_progress: called with the number of finished notes
+        :param on_chunk: called with note IDs and their transcriptions per language, notes without
+                         transcription are left out
+        :param on_collected: called whenever the words of another page of notes have been collected
+        :param on_not_found: called with the IDs of notes whose words have been looked up without
+                             finding a transcription
+        """
+        self.token.set_deadline(self.deadline)
+        chunk = {}
+        done = 0
+
+        def transcribe_page(executor: ThreadPoolExecutor, page: List[NoteSnapshot]) -> None:
+            nonlocal chunk, done
+            # field text -> IDs of the notes with this text
+            texts: Dict[str, List[int]] = {}
+            for note_id, field_text in page:
+                texts.setdefault(field_text, []).append(note_id)
+            self.note_count += len(page)
+            self.text_count += len(texts)
+
+            text_words = {}
+            dependent_texts: Dict[str, List[str]] = {}  # word -> field texts containing it
+            for text, note_ids in texts.items():
+                text_words[text] = utils.get_words_from_field(field_text=text)
+                self.word_count += len(text_words[text]) * len(note_ids)
+                for word in set(text_words[text]):
+                    dependent_texts.setdefault(word, []).append(text)
+            self.distinct_word_count += len(dependent_texts)
+            if on_collected:
+                on_collected()
+
+            transcriptions: Dict[str, Dict[str, str]] = {language: {} for language in self.languages}
+            skip_reasons: Dict[str, str] = {}  # word -> why it couldn't be looked up
+            missing_words = {text: len(set(words)) for text, words in text_words.items()}
+
+            def finish(text: str) -> None:
+                nonlocal chunk, done
+                note_ids = texts.pop(text)
+                words = text_words.pop(text)
+                del missing_words[text]
+                reasons = [skip_reasons[word] for word in words if word in skip_reasons]
+                if reasons:
+                    self.skipped.update(dict.fromkeys(note_ids, reasons[0]))
+                else:
+                    ipa = {language: " ".join(transcriptions[language][word] for word in words)
+                           for language in self.languages}
+                    # IPA transcription not found
+                    ipa = {language: value for language, value in ipa.items() if value.strip()}
+                    if ipa:
+                        for note_id in note_ids:
+                            chunk[note_id] = ipa
+                    elif on_not_found:
+                        on_not_found(note_ids)
+                done += len(note_ids)
+                on_progress(done)
+                if len(chunk) >= self.chunk_size:
+                    on_chunk(chunk)
+                    chunk = {}
+
+            def complete(group: List[str], reason: Optional[str] = None) -> None:
+                if reason:
+                    skip_reasons.update(dict.fromkeys(group, reason))
+                for word in group:
+                    for text in dependent_texts.pop(word):
+                        missing_words[text] -= 1
+                        if not missing_words[text]:
+                            finish(text)
+
+            for text in [text for text, count in missing_words.items() if not count]:
+                finish(text)
+
+            groups = self._iter_groups(list(dependent_texts))
+            retried = set()  # groups whose lookup has timed out once
+            pending = {}
+            if not self.token.cancelled:
+                pending = {
+                    executor.submit(self._transcribe, group): group
+                    for group in itertools.islice(groups, 2 * self.max_workers)
+                }
+            while pending:
+                # wake up at the deadline even if no lookup finishes
+                timeout = None if self.token.cancelled else self.token.remaining()
+                finished, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    group = pending.pop(future)
+                    reason = None
+                    try:
+                        for language, language_transcriptions in future.result().items():
+                            transcriptions[language].update(language_transcriptions)
+                    except (urllib.error.HTTPError, IndexError):
+                        reason = "lookup failed"
+                    except (network.Cancelled, CancelledError):
+                        reason = self.token.reason
+                    except network.SourceUnavailable:
+                        reason = "source unavailable"
+                    except requests.exceptions.Timeout:
+                        if tuple(group) not in retried and not self.token.cancelled:
+                            # a single slow answer shouldn't skip the words, they are looked up once more
+                            retried.add(tuple(group))
+                            pending[executor.submit(self._transcribe, group)] = group
+                            continue
+                        reason = "Wiktionary timed out"
+                    except requests.exceptions.HTTPError:
+                        reason = "Wiktionary answered with errors"
+                    except requests.exceptions.RequestException:
+                        reason = "Wiktionary could not be reached"
+                    except (KeyError, ValueError, TypeError):
+                        # like failed requests, a malformed answer doesn't mean that there is no transcription
+                        reason = "malformed answer"
+                    complete(group, reason)
+
+                    if not self.token.cancelled:
+                        next_group = next(groups, None)
+                        if next_group:
+                            pending[executor.submit(self._transcribe, next_group)] = next_group
+
+                if self.token.cancelled:
+                    # closes the responses which are still being received once the deadline has passed
+                    self.token.cancel()
+                    for future in pending:
+                        future.cancel()
+
+            # groups which have never been submitted
+            for group in groups:
+                complete(group, self.token.reason)
+
+        notes = iter(self.notes)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while not self.token.cancelled:
+                    page = list(itertools.islice(notes, self.page_size))
+                    if not page:
+                        break
+                    transcribe_page(executor, page)
+            except BaseException:
+                # e.g. interrupted, the executor would wait for the lookups still running
+                self.token.cancel()
+                raise
+
+        if chunk:
+            on_chunk(chunk)
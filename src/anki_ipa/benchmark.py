@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Benchmarks against a local stand-in for Wiktionary
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+
+A local server answers the MediaWiki API and article requests of all Wiktionaries from the pages in
+benchmark_fixtures/<host>.json, so the results only depend on the add-on. The pages are recorded from
+Wiktionary with --record-fixtures, fixture files without "recorded" date are small hand-written pages
+whose bytes and parse times are far from real ones. Titles without a fixture page have no page, only
+the notes of the throughput benchmark get one of the pages of their host.
+
+Run from the add-on folder, e.g.:
+
+    python -m benchmark --record-fixtures
+    python -m benchmark --out benchmark.json
+    python -m benchmark --out benchmark-new.json --compare benchmark.json
+"""
+
+import argparse
+import gzip
+import http.server
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+
+from typing import Dict, List, Optional
+
+try:
+    from . import consts, html_parsing, network, parse_ipa_transcription, transport
+    from .batch_transcriber import BatchTranscriber, NoteSnapshot
+    from .stats import stats, PARSE, REGEX
+except ImportError:  # run as a script or imported by the unittests
+    import consts
+    import html_parsing
+    import network
+    import parse_ipa_transcription
+    import transport
+    from batch_transcriber import BatchTranscriber, NoteSnapshot
+    from stats import stats, PARSE, REGEX
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures")
+FORMAT_VERSION = 1
+
+# Metrics compared by --compare, True if higher is better
+COMPARED_METRICS = {
+    "latency_ms": False,
+    "cpu_ms_per_word": False,
+    "bytes_per_word": False,
+    "notes_per_second": True,
+}
+
+
+def load_fixtures(directory: str = FIXTURES_PATH) -> Dict[str, dict]:
+    """ Load the recorded pages of all Wiktionaries.
+
+    :param directory: directory with one <host>.json file per Wiktionary
+    :return: dictionary of hosts and their wikitexts, rendered templates and articles
+    """
+    fixtures = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                fixtures[filename[:-len(".json")]] = json.load(f)
+    return fixtures
+
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    """Stand-in for all Wiktionaries, paths start with the host name (e.g. /en.wiktionary.org/w/api.php)."""
+
+    daemon_threads = True
+
+    def __init__(self, fixtures: Dict[str, dict], latency: float = 0.0, aliases: bool = False) -> None:
+        """ Initialize FixtureServer on a free local port.
+
+        :param fixtures: recorded pages by host, see load_fixtures
+        :param latency: seconds each answer is delayed to simulate the network
+        :param aliases: answer titles without fixture page with one of the pages of their host,
+                        except titles starting with "missing"
+        """
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.aliases = aliases
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def redirect(self) -> None:
+        """Send all requests to Wiktionary to this server."""
+        network.redirects.update({host: f"{self.base_url}/{host}" for host in self.fixtures})
+
+    def _fixture_title(self, host: str, title: str, kind: str) -> Optional[str]:
+        """Fixture page for a title, with aliases unknown titles get one of the pages of the host."""
+        pages = self.fixtures[host][kind]
+        if title in pages or not pages:
+            return title if title in pages else None
+        if not self.aliases or title.startswith("missing"):
+            return None
+        names = sorted(pages)
+        return names[zlib.crc32(title.encode("utf-8")) % len(names)]
+
+    def query(self, host: str, titles: List[str]) -> dict:
+        pages = []
+        for title in titles:
+            name = self._fixture_title(host, title, "wikitexts")
+            if name is None:
+                pages.append({"title": title, "missing": True})
+            else:
+                content = self.fixtures[host]["wikitexts"][name]
+                pages.append({"title": title, "revisions": [{"slots": {"main": {"content": content}}}]})
+        return {"batchcomplete": True, "query": {"pages": pages}}
+
+    def parse(self, host: str, text: str, title: str = "API") -> dict:
+        for template, html in self.fixtures[host]["rendered"].items():
+            # templates which read the page title are recorded per page
+            if isinstance(html, dict):
+                html = html.get(self._fixture_title(host, title, "wikitexts"), "")
+            text = text.replace(template, html)
+        return {"parse": {"title": title, "text": text}}
+
+    def article(self, host: str, title: str) -> Optional[str]:
+        name = self._fixture_title(host, title, "articles")
+        if name is None:
+            return None
+        return self.fixtures[host]["articles"][name]
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._answer(self.path, {})
+
+    def do_POST(self):
+        form = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        self._answer(self.path, {key: values[0] for key, values in urllib.parse.parse_qs(form).items()})
+
+    def _answer(self, request_path: str, form: Dict[str, str]) -> None:
+        time.sleep(self.server.latency)
+        parts = urllib.parse.urlsplit(request_path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(parts.query).items()}
+        query.update(form)
+        body, content_type = None, "application/json"
+        if host in self.server.fixtures and path == "w/api.php":
+            if query.get("action") == "query":
+                body = json.dumps(self.server.query(host, query["titles"].split("|")))
+            elif query.get("action") == "parse":
+                body = json.dumps(self.server.parse(host, query["text"], query.get("title", "API")))
+        elif host in self.server.fixtures and path.startswith("wiki/"):
+            body = self.server.article(host, urllib.parse.unquote(path[len("wiki/"):]))
+            content_type = "text/html; charset=utf-8"
+        if body is None:
+            self.send_error(404)
+            return
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureRecorder(transport.Transport):
+    """Passes requests on and collects the wikitexts, rendered templates and articles of the answers as fixtures."""
+
+    def __init__(self, transport: transport.Transport) -> None:
+        """ Initialize FixtureRecorder.
+
+        :param transport: transport which sends the requests, e.g. to Wiktionary
+        """
+        self.transport = transport
+        self.fixtures: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def send(self, url: str, params: Optional[dict], token=None, data: Optional[dict] = None) -> requests.Response:
+        response = self.transport.send(url, params, token, data)
+        if response.status_code == 200:
+            parts = urllib.parse.urlsplit(url)
+            fields = {**(params or {}), **(data or {})}
+            with self._lock:
+                fixture = self.fixtures.setdefault(parts.netloc, {"wikitexts": {}, "rendered": {}, "articles": {}})
+                if parts.path.startswith("/wiki/"):
+                    fixture["articles"][urllib.parse.unquote(parts.path[len("/wiki/"):])] = response.text
+                elif fields.get("action") == "query":
+                    self._record_wikitexts(fixture, response.json())
+                elif fields.get("action") == "parse":
+                    self._record_rendered(fixture, fields, response.json())
+        return response
+
+    @staticmethod
+    def _record_wikitexts(fixture: dict, data: dict) -> None:
+        query = data.get("query", {})
+        titles = {normalized["to"]: normalized["from"] for normalized in query.get("normalized", [])}
+        for page in query.get("pages", []):
+            if page.get("revisions"):
+                title = titles.get(page["title"], page["title"])
+                fixture["wikitexts"][title] = page["revisions"][0]["slots"]["main"]["content"]
+
+    @staticmethod
+    def _record_rendered(fixture: dict, fields: dict, data: dict) -> None:
+        import bs4
+        soup = bs4.BeautifulSoup(data["parse"]["text"], "html.parser")
+        # the templates of each word are sent in a div of class anki-ipa-<index of the word>
+        for index, templates in re.findall(r'<div class="anki-ipa-(\d+)">(.*?)</div>', fields["text"], re.DOTALL):
+            div = soup.find("div", {"class": f"anki-ipa-{index}"})
+            html = div.decode_contents() if div else ""
+            if "title" in fields:
+                # templates which read the page title are recorded per page
+                fixture["rendered"].setdefault(templates, {})[fields["title"]] = html
+            else:
+                fixture["rendered"][templates] = html
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+def record_fixtures(words: Dict[str, List[str]], directory: str = FIXTURES_PATH,
+                    source: Optional[transport.Transport] = None) -> Dict[str, dict]:
+    """ Record the pages the add-on requests for some words and save them as fixtures.
+
+    :param words: hosts and the words whose pages are recorded
+    :param directory: directory the <host>.json files are written to
+    :param source: transport which sends the requests, None for Wiktionary
+    :return: the recorded fixtures by host
+    """
+    recorder = FixtureRecorder(source or network.LiveTransport())
+    network.set_transport(recorder)
+    previous_cache, previous_offline = parse_ipa_transcription.cache, parse_ipa_transcription.offline
+    parse_ipa_transcription.cache, parse_ipa_transcription.offline = None, None
+    try:
+        for language in sorted(set(consts.LANGUAGES_MAP.values())):
+            host = parse_ipa_transcription.WIKIS[language]
+            if host in words:
+                parse_ipa_transcription.transcript_words(words[host], language)
+    finally:
+        parse_ipa_transcription.cache, parse_ipa_transcription.offline = previous_cache, previous_offline
+        network.set_transport(None)
+    recorded = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    for host, fixture in recorder.fixtures.items():
+        fixture["recorded"] = recorded
+        with open(os.path.join(directory, f"{host}.json"), "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+    return recorder.fixtures
+
+
+def configure_network(max_connections: int) -> None:
+    """Only the stand-in server is measured, not the rate limits meant for Wiktionary, run() restores them."""
+    network.configure(max_connections=max_connections, requests_per_second=1e6)
+
+
+def benchmark_language(language: str, words: List[str], repeats: int = 5) -> dict:
+    """ Measure a single batched lookup of all words of a language.
+
+    :param language: name of the transcription method
+    :param words: words to transcribe
+    :param repeats: number of measured lookups
+    :return: latency, CPU time, parse time, bytes and requests of the lookups
+    """
+    latencies, cpu_times, parse_times, byte_counts, request_counts = [], [], [], [], []
+    found = errors = 0
+    for _ in range(repeats):
+        stats.reset()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            transcriptions = parse_ipa_transcription.transcript_words(words, language)
+        # only with injected faults
+        except requests.exceptions.RequestException:
+            transcriptions = {}
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        cpu_times.append(time.process_time() - cpu_start)
+        snapshot = stats.snapshot()
+        parse_times.append(sum(snapshot["timings"].get(stage, {"seconds": 0})["seconds"] for stage in (PARSE, REGEX)))
+        byte_counts.append(snapshot["counters"].get("bytes", 0))
+        request_counts.append(snapshot["counters"].get("requests", 0))
+        found = sum(1 for ipa in transcriptions.values() if ipa)
+    return {
+        "words": len(words),
+        "found": found,
+        "errors": errors,
+        "latency_ms": statistics.median(latencies) * 1000,
+        "latency_ms_max": max(latencies) * 1000,
+        "cpu_ms_per_word": statistics.median(cpu_times) * 1000 / len(words),
+        "parse_ms_per_word": statistics.median(parse_times) * 1000 / len(words),
+        "bytes_per_word": statistics.median(byte_counts) / len(words),
+        "requests": statistics.median(request_counts),
+    }
+
+
+def benchmark_throughput(language: str, note_count: int, workers: int) -> dict:
+    """ Measure the batch transcription the browser dialog's Worker runs.
+
+    :param language: name of the transcription method
+    :param note_count: number of notes, each with a different word
+    :param workers: number of concurrent lookups and connections per host
+    :return: duration and notes per second
+    """
+    configure_network(max_connections=workers)
+    # aliases of the recorded pages, see FixtureServer
+    notes = (NoteSnapshot(note_id, f"word{note_id}") for note_id in range(note_count))
+    transcriber = BatchTranscriber(notes, [language], max_workers=workers)
+    transcribed = 0
+
+    def on_chunk(chunk):
+        nonlocal transcribed
+        transcribed += len(chunk)
+
+    start = time.perf_counter()
+    transcriber.run(on_progress=lambda done: None, on_chunk=on_chunk)
+    duration = time.perf_counter() - start
+    return {
+        "notes": note_count,
+        "transcribed": transcribed,
+        "skipped": len(transcriber.skipped),
+        "seconds": duration,
+        "notes_per_second": note_count / duration,
+    }
+
+
+def run(fixtures: Dict[str, dict], latency: float, repeats: int, note_count: int, workers: List[int],
+        throughput_languages: List[str], faults: Optional[dict] = None, parse_processes: int = 0) -> dict:
+    """ Run all benchmarks against a stand-in server.
+
+    :param faults: arguments of a FaultInjectingTransport between the add-on and the server, None for no faults
+    :param parse_processes: number of worker processes which parse the HTML, 0 to parse in the lookup threads
+    :return: machine-readable results, see COMPARED_METRICS for the compared values
+    """
+    server = FixtureServer(fixtures, latency, aliases=True)
+    server.start()
+    server.redirect()
+    if faults:
+        network.set_transport(transport.FaultInjectingTransport(network.LiveTransport(), **faults))
+    previous_cache, previous_offline = parse_ipa_transcription.cache, parse_ipa_transcription.offline
+    # every lookup has to reach the server
+    parse_ipa_transcription.cache, parse_ipa_transcription.offline = None, None
+    if parse_processes:
+        parse_ipa_transcription.parse_pool = html_parsing.ParsePool(parse_processes)
+    previous_connections, previous_rate = network.max_connections_per_host, network.max_requests_per_second
+    try:
+        configure_network(max_connections=network.max_connections_per_host)
+        languages = {}
+        for language in sorted(set(consts.LANGUAGES_MAP.values())):
+            host = parse_ipa_transcription.WIKIS[language]
+            words = list(fixtures[host]["wikitexts"]) + ["missing_word"]
+            languages[language] = benchmark_language(language, words, repeats)
+        throughput = {
+            language: {str(level): benchmark_throughput(language, note_count, level) for level in workers}
+            for language in throughput_languages
+        }
+    finally:
+        parse_ipa_transcription.cache, parse_ipa_transcription.offline = previous_cache, previous_offline
+        network.redirects.clear()
+        network.set_transport(None)
+        if parse_ipa_transcription.parse_pool is not None:
+            parse_ipa_transcription.parse_pool.shutdown()
+            parse_ipa_transcription.parse_pool = None
+        # also closes the sessions of the stand-in server
+        network.configure(max_connections=previous_connections, requests_per_second=previous_rate)
+        server.shutdown()
+        server.server_close()
+    return {
+        "format": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server_latency_ms": latency * 1000,
+        "faults": faults or {},
+        "parse_processes": parse_processes,
+        # when the pages have been recorded from Wiktionary
+        "fixtures": {host: fixture.get("recorded", "hand-written") for host, fixture in fixtures.items()},
+        "languages": languages,
+        "throughput": throughput,
+    }
+
+
+def compare(previous: dict, current: dict, tolerance: float = 0.2) -> List[str]:
+    """ Find the metrics which got worse by more than the tolerance.
+
+    :param previous: results of an earlier run
+    :param current: results of this run
+    :param tolerance: allowed relative change, e.g. 0.2 for 20 %
+    :return: descriptions of the regressions
+    """
+    def metrics(results: dict) -> Dict[str, float]:
+        values = {}
+        for language, result in results.get("languages", {}).items():
+            for metric in COMPARED_METRICS:
+                if metric in result:
+                    values[f"{language} {metric}"] = result[metric]
+        for language, levels in results.get("throughput", {}).items():
+            for level, result in levels.items():
+                values[f"{language} {level} workers notes_per_second"] = result["notes_per_second"]
+        return values
+
+    regressions = []
+    old_values, new_values = metrics(previous), metrics(current)
+    for name, new in new_values.items():
+        old = old_values.get(name)
+        if not old:
+            continue
+        higher_is_better = COMPARED_METRICS[name.rsplit(" ", 1)[-1]]
+        change = (new - old) / old
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{name}: {old:.3g} -> {new:.3g} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the IPA lookups against a local stand-in server.")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="results of an earlier run, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change for --compare")
+    parser.add_argument("--latency", type=float, default=20, help="simulated network latency in milliseconds")
+    parser.add_argument("--repeats", type=int, default=5, help="measured lookups per language")
+    parser.add_argument("--notes", type=int, default=1000, help="number of notes of the throughput benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrency levels")
+    parser.add_argument("--parse-processes", type=int, default=0, help="worker processes which parse the HTML")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failing with connection errors")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="share of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the injected faults")
+    parser.add_argument("--throughput-languages", nargs="+", default=["british", "russian"],
+                        choices=sorted(parse_ipa_transcription.WIKIS))
+    parser.add_argument("--record-fixtures", action="store_true",
+                        help="record the pages of the fixture words from Wiktionary instead of running the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.record_fixtures:
+        words = {host: list(fixture["wikitexts"]) for host, fixture in load_fixtures().items()}
+        for host, fixture in record_fixtures(words).items():
+            size = sum(len(json.dumps(fixture[kind], ensure_ascii=False))
+                       for kind in ("wikitexts", "rendered", "articles"))
+            print(f"{host}: {len(fixture['wikitexts'])} pages, {size / 1024:.0f} KiB", file=sys.stderr)
+        return
+    hand_written = [host for host, fixture in load_fixtures().items() if "recorded" not in fixture]
+    if hand_written:
+        print(f"warning: hand-written fixtures of {', '.join(hand_written)}, record them with --record-fixtures",
+              file=sys.stderr)
+
+    faults = None
+    if args.error_rate or args.throttle_rate:
+        faults = {"error_rate": args.error_rate, "throttle_rate": args.throttle_rate, "retry_after": 0,
+                  "seed": args.seed}
+    results = run(load_fixtures(), args.latency / 1000, args.repeats, args.notes, args.workers,
+                  args.throughput_languages, faults, args.parse_processes)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    for language, result in results["languages"].items():
+        print(f"{language}: {result['latency_ms']:.1f} ms, {result['cpu_ms_per_word']:.2f} ms CPU/word, "
+              f"{result['bytes_per_word']:.0f} bytes/word", file=sys.stderr)
+    for language, levels in results["throughput"].items():
+        print(f"{language}: " + ", ".join(f"{level} workers {result['notes_per_second']:.0f} notes/s"
+                                          for level, result in levels.items()), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
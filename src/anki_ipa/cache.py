@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Persistent cache for IPA transcriptions
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, Optional
+
+# evict least recently used entries only every few inserts
+EVICTION_INTERVAL = 500
+
+
+class TranscriptionCache:
+    """ Size-bounded LRU cache of IPA transcriptions stored in a single SQLite file.
+
+    Words without transcription are kept apart as misses, which expire after a shorter time.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000, ttl: float = 90 * 24 * 60 * 60,
+                 negative_ttl: float = 7 * 24 * 60 * 60) -> None:
+        """ Open (or create) the cache file.
+
+        :param path: path of the SQLite file
+        :param max_entries: maximum number of cached transcriptions, 0 disables the limit
+        :param ttl: time in seconds after which a cached transcription expires, 0 disables expiry
+        :param negative_ttl: time in seconds after which a cached miss expires, 0 disables caching misses
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcriptions ("
+            "language TEXT NOT NULL, word TEXT NOT NULL, strip INTEGER NOT NULL, "
+            "ipa TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, "
+            "UNIQUE (language, word, strip))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_accessed ON transcriptions (accessed)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS misses ("
+            "language TEXT NOT NULL, word TEXT NOT NULL, strip INTEGER NOT NULL, "
+            "reason TEXT NOT NULL, created REAL NOT NULL, "
+            "UNIQUE (language, word, strip))"
+        )
+
+    def _oldest_valid(self, now: float) -> float:
+        """Creation time before which an entry is considered expired."""
+        return now - self.ttl if self.ttl else float("-inf")
+
+    def get(self, language: str, word: str, strip_syllable_separator: bool) -> Optional[str]:
+        """ Get a cached transcription.
+
+        :param language: name of the transcription method (e.g. british)
+        :param word: transcribed word
+        :param strip_syllable_separator: whether syllable separators were stripped
+        :return: cached IPA transcription or None if unknown or expired
+        """
+        return self.get_many(language, [word], strip_syllable_separator).get(word)
+
+    def get_many(self, language: str, words: Iterable[str], strip_syllable_separator: bool) -> Dict[str, str]:
+        """ Get all cached transcriptions for the given words with a single query.
+
+        :param language: name of the transcription method (e.g. british)
+        :param words: transcribed words
+        :param strip_syllable_separator: whether syllable separators were stripped
+        :return: dictionary of the words found in the cache and their IPA transcriptions
+        """
+        words = list(dict.fromkeys(words))
+        if not words:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            # SQLite limits the number of host parameters per statement
+            for i in range(0, len(words), 500):
+                chunk = words[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT word, ipa FROM transcriptions WHERE language = ? AND strip = ? "
+                    f"AND created >= ? AND word IN ({placeholders})",
+                    (language, int(strip_syllable_separator), self._oldest_valid(now), *chunk),
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "UPDATE transcriptions SET accessed = ? WHERE language = ? AND word = ? AND strip = ?",
+                    [(now, language, word, int(strip_syllable_separator)) for word in found],
+                )
+                self._conn.execute("COMMIT")
+        return found
+
+    def set(self, language: str, word: str, strip_syllable_separator: bool, ipa: str) -> None:
+        """ Store a transcription.
+
+        :param language: name of the transcription method (e.g. british)
+        :param word: transcribed word
+        :param strip_syllable_separator: whether syllable separators were stripped
+        :param ipa: IPA transcription of the word
+        """
+        self.set_many(language, {word: ipa}, strip_syllable_separator)
+
+    def set_many(self, language: str, transcriptions: Dict[str, str], strip_syllable_separator: bool) -> None:
+        """ Store several transcriptions in one transaction.
+
+        :param language: name of the transcription method (e.g. british)
+        :param transcriptions: dictionary of words and their IPA transcriptions
+        :param strip_syllable_separator: whether syllable separators were stripped
+        """
+        if not transcriptions:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO transcriptions (language, word, strip, ipa, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(language, word, int(strip_syllable_separator), ipa, now, now)
+                 for word, ipa in transcriptions.items()],
+            )
+            self._conn.executemany(
+                "DELETE FROM misses WHERE language = ? AND word = ? AND strip = ?",
+                [(language, word, int(strip_syllable_separator)) for word in transcriptions],
+            )
+            self._conn.execute("COMMIT")
+            self._inserts += len(transcriptions)
+            if self._inserts >= EVICTION_INTERVAL:
+                self._inserts = 0
+                self._evict(now)
+
+    def get_misses(self, language: str, words: Iterable[str], strip_syllable_separator: bool) -> Dict[str, str]:
+        """ Get the words known to have no transcription.
+
+        :param language: name of the transcription method (e.g. british)
+        :param words: words to look up
+        :param strip_syllable_separator: whether syllable separators were stripped
+        :return: dictionary of the words with a cached miss and why they have no transcription
+        """
+        words = list(dict.fromkeys(words))
+        if not words or not self.negative_ttl:
+            return {}
+        found = {}
+        with self._lock:
+            for i in range(0, len(words), 500):
+                chunk = words[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT word, reason FROM misses WHERE language = ? AND strip = ? "
+                    f"AND created >= ? AND word IN ({placeholders})",
+                    (language, int(strip_syllable_separator), time.time() - self.negative_ttl, *chunk),
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def set_misses(self, language: str, misses: Dict[str, str], strip_syllable_separator: bool) -> None:
+        """ Remember words without transcription, only for misses which won't change soon.
+
+        :param language: name of the transcription method (e.g. british)
+        :param misses: dictionary of words and why they have no transcription (e.g. page missing)
+        :param strip_syllable_separator: whether syllable separators were stripped
+        """
+        if not misses or not self.negative_ttl:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO misses (language, word, strip, reason, created) VALUES (?, ?, ?, ?, ?)",
+                [(language, word, int(strip_syllable_separator), reason, now) for word, reason in misses.items()],
+            )
+            self._conn.execute("COMMIT")
+            self._inserts += len(misses)
+            if self._inserts >= EVICTION_INTERVAL:
+                self._inserts = 0
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Remove expired entries and the least recently used ones above the size limit."""
+        if self.ttl:
+            self._conn.execute("DELETE FROM transcriptions WHERE created < ?", (self._oldest_valid(now),))
+        self._conn.execute("DELETE FROM misses WHERE created < ?", (now - self.negative_ttl,))
+        if self.max_entries:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM transcriptions").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM transcriptions WHERE rowid IN "
+                    "(SELECT rowid FROM transcriptions ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def evict(self) -> None:
+        """Enforce size limit and TTL right away."""
+        with self._lock:
+            self._evict(time.time())
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM transcriptions").fetchone()
+        return count
+
+    def clear(self) -> None:
+        """Remove all cached transcriptions and misses."""
+        with self._lock:
+            self._conn.execute("DELETE FROM transcriptions")
+            self._conn.execute("DELETE FROM misses")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Command line transcription of word lists and CSV/TSV files without Anki
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+
+Rows are read as a stream and transcribed like the notes of the batch dialog, --window rows at a
+time. Each row is written in input order as soon as it and the rows before it are transcribed.
+
+Run from the add-on folder, e.g.:
+
+    python -m cli --language french words.txt > words_ipa.tsv
+    python -m cli --language eng_b --column Front --out notes_ipa.csv notes.csv
+    cat words.txt | python -m cli --language russian
+"""
+
+import argparse
+import collections
+import csv
+import sys
+import time
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, TypeVar
+
+try:
+    from . import consts, html_parsing, network, parse_ipa_transcription, transport
+    from .batch_transcriber import BatchTranscriber, NoteSnapshot
+    from .cache import TranscriptionCache
+except ImportError:  # run as a script or imported by the unittests
+    import consts
+    import html_parsing
+    import network
+    import parse_ipa_transcription
+    import transport
+    from batch_transcriber import BatchTranscriber, NoteSnapshot
+    from cache import TranscriptionCache
+
+Item = TypeVar("Item")
+
+# Seconds between two progress reports on stderr
+PROGRESS_INTERVAL = 1.0
+
+
+def transcribe_stream(items: Iterable[Item], text_of: Callable[[Item], str], language: str,
+                      on_result: Callable[[Item, str, Optional[str]], None], strip_syllable_separator: bool = True,
+                      max_workers: int = 8, window: int = 1000, token: Optional[network.CancelToken] = None) -> None:
+    """ Transcribe the text of each item with a BatchTranscriber, the results are handed over in input order.
+
+    The items are read and their distinct words looked up window items at a time. An item is handed
+    over as soon as it and all items before it have been transcribed.
+
+    :param items: items to transcribe, e.g. CSV rows
+    :param text_of: returns the text of an item
+    :param language: name of the transcription method
+    :param on_result: called with each item, its IPA transcription ("" if not found) and why it couldn't
+                      be looked up (or None)
+    :param strip_syllable_separator: whether syllable separators are removed
+    :param max_workers: number of groups of words that are looked up concurrently
+    :param window: maximum number of items waiting to be handed over
+    :param token: cancellation token of the lookups
+    """
+    pending = collections.deque()  # (index, item) of the items read and not handed over, in input order
+    results: Dict[int, str] = {}  # index -> IPA transcription of the pending items
+
+    def notes() -> Iterator[NoteSnapshot]:
+        for index, item in enumerate(items):
+            pending.append((index, item))
+            yield NoteSnapshot(index, text_of(item))
+
+    transcriber = BatchTranscriber(notes(), [language], strip_syllable_separator, max_workers=max_workers,
+                                   chunk_size=1, page_size=window, token=token)
+
+    def hand_over() -> None:
+        while pending:
+            index, item = pending[0]
+            if index in results:
+                on_result(item, results.pop(index), None)
+            elif index in transcriber.skipped:
+                on_result(item, "", transcriber.skipped.pop(index))
+            else:
+                return
+            pending.popleft()
+
+    def on_chunk(chunk: Dict[int, Dict[str, str]]) -> None:
+        results.update((index, transcriptions[language]) for index, transcriptions in chunk.items())
+        hand_over()
+
+    def on_not_found(indices: List[int]) -> None:
+        results.update(dict.fromkeys(indices, ""))
+        hand_over()
+
+    transcriber.run(on_progress=lambda done: hand_over(), on_chunk=on_chunk, on_not_found=on_not_found)
+
+
+class Progress:
+    """Rows per second and failures, reported on stderr."""
+
+    def __init__(self, stream: TextIO = sys.stderr) -> None:
+        self.stream = stream
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.rows = 0
+        self.found = 0
+        self.failed = 0
+
+    def update(self, found: bool, reason: Optional[str], row_number: int) -> None:
+        self.rows += 1
+        self.found += found
+        if reason:
+            self.failed += 1
+            print(f"row {row_number}: {reason}", file=self.stream)
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            print(self.summary(), file=self.stream)
+
+    def summary(self) -> str:
+        duration = max(time.monotonic() - self.start, 1e-9)
+        return (f"{self.rows} rows, {self.found} transcribed, {self.failed} failed, "
+                f"{self.rows / duration:.1f} rows/s")
+
+
+def column_index(header: List[str], column: str) -> int:
+    """Index of a column given by its name or 1-based number."""
+    if column.isdigit():
+        return int(column) - 1
+    try:
+        return header.index(column)
+    except ValueError:
+        raise SystemExit(f"Column {column!r} not found, the columns are: {', '.join(header)}")
+
+
+def run(source: TextIO, out: TextIO, language: str, input_format: str = "words", column: str = "1",
+        header: bool = False, output_column: str = "IPA", strip_syllable_separator: bool = True,
+        max_workers: int = 8, window: int = 1000, progress: Optional[Progress] = None,
+        token: Optional[network.CancelToken] = None) -> None:
+    """ Transcribe a word list or CSV/TSV file.
+
+    Word lists have one text per line, the output has the text and its transcription separated by a tab.
+    CSV/TSV rows are written with the transcription as an additional column.
+
+    :param source: input stream
+    :param out: output stream
+    :param language: name of the transcription method
+    :param input_format: "words", "csv" or "tsv"
+    :param column: name (requires a header) or 1-based number of the column with the words
+    :param header: whether the first CSV/TSV row is a header, implied by a column name
+    :param output_column: header of the added column
+    """
+    progress = progress or Progress()
+    index, first_row = column_index([], column) if column.isdigit() else 0, 1
+    if input_format == "words":
+        rows = ([line.rstrip("\r\n")] for line in source)
+        writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    else:
+        delimiter = "\t" if input_format == "tsv" else ","
+        rows = csv.reader(source, delimiter=delimiter)
+        writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+        if header or not column.isdigit():
+            header_row = next(rows, None)
+            if header_row is None:
+                return
+            index, first_row = column_index(header_row, column), 2
+            writer.writerow(header_row + [output_column])
+
+    def text_of(item: Tuple[int, List[str]]) -> str:
+        row = item[1]
+        return row[index] if index < len(row) else ""
+
+    def write(item: Tuple[int, List[str]], ipa: str, reason: Optional[str]) -> None:
+        row_number, row = item
+        writer.writerow(row + [ipa])
+        progress.update(bool(ipa), reason, row_number)
+
+    transcribe_stream(enumerate(rows, start=first_row), text_of, language, write, strip_syllable_separator,
+                      max_workers, window, token)
+    out.flush()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    languages = sorted(set(consts.LANGUAGES_MAP) | set(consts.LANGUAGES_MAP.values()))
+    parser = argparse.ArgumentParser(description="Add IPA transcriptions to word lists and CSV/TSV files.")
+    parser.add_argument("input", nargs="?", default="-", help="input file, - for stdin")
+    parser.add_argument("--language", required=True, choices=languages)
+    parser.add_argument("--format", choices=["words", "csv", "tsv"],
+                        help="input format, guessed from the file extension by default")
+    parser.add_argument("--column", default="1", help="name or number of the CSV/TSV column with the words")
+    parser.add_argument("--header", action="store_true", help="the first CSV/TSV row is a header")
+    parser.add_argument("--output-column", default="IPA", help="header of the added CSV/TSV column")
+    parser.add_argument("--out", default="-", help="output file, - for stdout")
+    parser.add_argument("--keep-syllable-separators", action="store_true")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent lookups")
+    parser.add_argument("--window", type=int, default=1000, help="maximum number of rows held in memory")
+    parser.add_argument("--requests-per-second", type=float, help="maximum requests per second to one Wiktionary")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="worker processes which parse the HTML, 0 to parse in the lookup threads")
+    parser.add_argument("--cache", help="SQLite file of the transcription cache, e.g. user_files/transcriptions.sqlite")
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument("--record", help="append all Wiktionary answers to this file")
+    recording.add_argument("--replay", help="answer requests from a recording instead of Wiktionary")
+    args = parser.parse_args(argv)
+
+    input_format = args.format
+    if input_format is None:
+        input_format = next((extension for extension in ("csv", "tsv") if args.input.endswith(f".{extension}")),
+                            "words")
+    network.configure(max_connections=args.workers, requests_per_second=args.requests_per_second)
+    if args.record:
+        network.set_transport(transport.RecordingTransport(args.record, network.LiveTransport()))
+    elif args.replay:
+        network.set_transport(transport.ReplayTransport(args.replay))
+    if args.cache:
+        parse_ipa_transcription.cache = TranscriptionCache(args.cache)
+    if args.parse_processes:
+        parse_ipa_transcription.parse_pool = html_parsing.ParsePool(args.parse_processes)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    token = network.CancelToken()
+    progress = Progress()
+    try:
+        run(source, out, consts.LANGUAGES_MAP.get(args.language, args.language), input_format, args.column,
+            args.header, args.output_column, not args.keep_syllable_separators, args.workers, args.window,
+            progress, token)
+    except KeyboardInterrupt:
+        # aborts the lookups still running
+        token.cancel()
+        print("interrupted", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        print(progress.summary(), file=sys.stderr)
+        for stream in (source, out):
+            if stream not in (sys.stdin, sys.stdout):
+                stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Fingerprints of transcribed word fields, so unchanged notes can be skipped
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import hashlib
+import itertools
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, Iterator, NamedTuple, Tuple
+
+# number of notes whose fingerprints are read with one query
+PAGE_SIZE = 500
+
+
+def fingerprint(language: str, text: str, strip_syllable_separator: bool = True, variants: Iterable[str] = ()) -> str:
+    """ Fingerprint of the text of a word field transcribed in a language with some settings.
+
+    :param language: name of the transcription method (e.g. british)
+    :param text: text of the word field
+    :param strip_syllable_separator: whether syllable separators are removed
+    :param variants: other transcription methods written in the same run (e.g. american for british)
+    :return: hex digest
+    """
+    settings = "\x1e".join([language, str(int(strip_syllable_separator))] + sorted(variants))
+    return hashlib.sha1(f"{settings}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+def target_fingerprints(text: str, targets: Dict[str, str], strip_syllable_separator: bool = True) -> Dict[str, str]:
+    """ Fingerprints of the target fields transcribed from a word field.
+
+    :param text: text of the word field
+    :param targets: languages and their target fields
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: fingerprints by target field
+    """
+    return {field: fingerprint(language, text, strip_syllable_separator,
+                               [variant for variant in targets if variant != language])
+            for language, field in targets.items()}
+
+
+class NoteFields(NamedTuple):
+    """Word field text and target field texts of a note."""
+    note_id: int
+    text: str
+    targets: Dict[str, str]  # target field -> text
+
+
+class FingerprintIndex:
+    """ Sidecar index of the word field fingerprints each target field of a note has been transcribed from.
+
+    Stored in a single SQLite file, so the notes themselves are left unchanged.
+    """
+
+    def __init__(self, path: str, negative_ttl: float = 7 * 24 * 60 * 60) -> None:
+        """ Open (or create) the index file.
+
+        :param path: path of the SQLite file
+        :param negative_ttl: time in seconds after which notes without transcription are looked up again,
+                             0 to look them up every time
+        """
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "note_id INTEGER NOT NULL, field TEXT NOT NULL, fingerprint TEXT NOT NULL, found INTEGER NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (note_id, field))"
+        )
+
+    def get_many(self, note_ids: Iterable[int]) -> Dict[Tuple[int, str], Tuple[str, bool, float]]:
+        """ Get the fingerprints of some notes.
+
+        :param note_ids: IDs of the notes
+        :return: dictionary of (note ID, target field) and (fingerprint, whether a transcription was found,
+                 time it was stored)
+        """
+        note_ids = list(note_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(note_ids), PAGE_SIZE):
+                chunk = note_ids[i:i + PAGE_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for note_id, field, value, transcribed, created in self._conn.execute(
+                        f"SELECT note_id, field, fingerprint, found, created FROM fingerprints "
+                        f"WHERE note_id IN ({placeholders})", chunk):
+                    found[(note_id, field)] = (value, bool(transcribed), created)
+        return found
+
+    def set_many(self, fingerprints: Dict[int, Dict[str, str]], found: bool = True) -> None:
+        """ Store the fingerprints of transcribed notes.
+
+        :param fingerprints: note IDs and the fingerprints by target field
+        :param found: whether transcriptions were found and written to the target fields
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (note_id, field, fingerprint, found, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(note_id, field, value, int(found), now)
+                 for note_id, fields in fingerprints.items() for field, value in fields.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    def changed(self, notes: Iterable[NoteFields], targets: Dict[str, str], strip_syllable_separator: bool = True,
+                on_unchanged=None) -> Iterator[Tuple[NoteFields, Dict[str, str]]]:
+        """ Filter out the notes whose transcriptions are current.
+
+        A target field is current if its fingerprint matches the word field and the settings, and it
+        either still has a transcription or none was found for the word field within negative_ttl.
+
+        :param notes: word and target field texts of the notes, read page by page
+        :param targets: languages and their target fields
+        :param strip_syllable_separator: whether syllable separators are removed
+        :param on_unchanged: called with the IDs of the notes skipped per page
+        :return: notes to transcribe and their fingerprints by target field
+        """
+        notes = iter(notes)
+        while True:
+            page = list(itertools.islice(notes, PAGE_SIZE))
+            if not page:
+                return
+            stored = self.get_many(note.note_id for note in page)
+            oldest_miss = time.time() - self.negative_ttl
+            unchanged = []
+            for note in page:
+                fingerprints = target_fingerprints(note.text, targets, strip_syllable_separator)
+                if all(self._is_current(stored.get((note.note_id, field)), value, note.targets.get(field, ""),
+                                        oldest_miss)
+                       for field, value in fingerprints.items()):
+                    unchanged.append(note.note_id)
+                else:
+                    yield note, fingerprints
+            if on_unchanged and unchanged:
+                on_unchanged(unchanged)
+
+    @staticmethod
+    def _is_current(stored, value: str, target_text: str, oldest_miss: float) -> bool:
+        if stored is None:
+            return False
+        stored_value, found, created = stored
+        if stored_value != value:
+            return False
+        if target_text.strip():
+            return True
+        # an emptied field is transcribed again, a miss once Wiktionary may have a transcription by now
+        return not found and created > oldest_miss
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM fingerprints")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
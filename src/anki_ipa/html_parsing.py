@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Extraction of IPA transcriptions from HTML, optionally in a pool of worker processes
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+
+This module only depends on bs4, so worker processes load it from its file without the add-on
+package (and Anki). They only receive the raw HTML and return the extracted strings.
+"""
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from typing import Any, List, Optional
+
+# Name of this module in the processes of a ParsePool
+POOL_MODULE_NAME = "anki_ipa_html_parsing"
+
+# Run by each worker process before its first task, it can't import the add-on package
+_LOAD_MODULE = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location({name!r}, {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules[{name!r}] = module
+spec.loader.exec_module(module)
+"""
+
+
+def clean_transcription(text: str, strip_syllable_separator: bool) -> str:
+    text = text.replace("/", "").replace("]", "").replace("[", "").replace("\\", "").strip()
+    if strip_syllable_separator:
+        text = text.replace(".", "")
+    return text
+
+
+def extract_spans(content: bytes, encoding: Optional[str], css_code: dict, strip_syllable_separator: bool) -> List[str]:
+    """ Get the IPA transcriptions of a Wiktionary article.
+
+    :param content: HTML of the article as received
+    :param encoding: encoding of the HTML, None to detect it
+    :param css_code: attributes of the span elements which contain the IPA transcription
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: sorted distinct cleaned transcriptions
+    """
+    import bs4
+    soup = bs4.BeautifulSoup(content, "html.parser", from_encoding=encoding)
+    results = soup.find_all('span', css_code)
+    return sorted({clean_transcription(result.getText(), strip_syllable_separator) for result in results})
+
+
+def extract_rendered(html: str, count: int, css_code: dict) -> List[List[str]]:
+    """ Get the texts of the IPA span elements of rendered pronunciation templates.
+
+    :param html: HTML with the templates of each word in a div of class anki-ipa-<index of the word>
+    :param count: number of words
+    :param css_code: attributes of the span elements which contain the IPA transcription
+    :return: texts of the span elements of each word
+    """
+    import bs4
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    rendered = []
+    for i in range(count):
+        div = soup.find('div', {'class': f'anki-ipa-{i}'})
+        rendered.append([span.getText() for span in div.find_all('span', css_code)] if div else [])
+    return rendered
+
+
+def python_interpreter() -> Optional[str]:
+    """ Python interpreter the worker processes of a ParsePool are started with.
+
+    The packaged Anki runs from its own binary, which can't start them (spawn would start Anki).
+
+    :return: path of the interpreter, None if this process doesn't run in one
+    """
+    executable = sys.executable
+    if getattr(sys, "frozen", False) or not executable or not os.path.basename(executable).lower().startswith("python"):
+        return None
+    return executable
+
+
+class ParsePool:
+    """Pool of worker processes which run the extraction functions of this module."""
+
+    def __init__(self, processes: int) -> None:
+        """ Start the pool, the processes are started on first use.
+
+        :param processes: number of worker processes
+        :raises RuntimeError: if there is no Python interpreter to start the processes with
+        """
+        interpreter = python_interpreter()
+        if interpreter is None:
+            raise RuntimeError(f"{sys.executable} is not a Python interpreter, it can't run worker processes")
+        loader = _LOAD_MODULE.format(name=POOL_MODULE_NAME, path=__file__)
+        # the submitted functions are pickled by module name, so this process needs the module under
+        # the same name as the worker processes
+        if POOL_MODULE_NAME not in sys.modules:
+            exec(loader, {})
+        self.module = sys.modules[POOL_MODULE_NAME]
+        self.processes = processes
+        # spawned processes don't inherit the threads and Qt state of Anki
+        self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=exec, initargs=(loader,))
+
+    def run(self, function: str, *args) -> Any:
+        """ Run an extraction function in a worker process and wait for its result.
+
+        :param function: name of the function (e.g. extract_spans)
+        :param args: arguments of the function
+        :return: result of the function
+        :raises concurrent.futures.process.BrokenProcessPool: if the worker processes can't be started
+        """
+        return self.executor.submit(getattr(self.module, function), *args).result()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
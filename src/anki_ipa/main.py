@@ -2,7 +2,7 @@
 
 """
 This file is part of the Anki IPA add-on for Anki.
-Main Module, hooks add-on methods into Anki.
+Transcription in the editor, imported on first use.
 Copyright: (c) m-rtin <https://github.com/m-rtin>
 License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
 """
@@ -10,36 +10,38 @@ License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
 import os
 import urllib
 import logging
+from concurrent.futures import Future
 
+import requests
 
-from anki.hooks import addHook, wrap
 from aqt import mw
 from aqt.editor import Editor
 from aqt.utils import showInfo
 
-from . import consts, parse_ipa_transcription, utils, batch_adding
-from .config import setup_synced_config
-from typing import List, Callable
+from . import html_parsing, network, parse_ipa_transcription, transport, utils, batch_adding
+from .cache import TranscriptionCache
+from .offline_index import OfflineIndexes
 
-filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "app.log")
-logging.basicConfig(filename=filename, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 ADDON_PATH = os.path.dirname(__file__)
-ICON_PATH = os.path.join(ADDON_PATH, "icons", "button.png")
+USER_FILES_PATH = os.path.join(ADDON_PATH, "user_files")  # kept by Anki on add-on updates
 CONFIG = mw.addonManager.getConfig(__name__)
 
-select_elm = ("""<select onchange='pycmd("IPALang:" +"""
-              """ this.selectedOptions[0].text)' """
-              """style='vertical-align: top;'>{}</select>""")
-
 
 def paste_ipa(editor: Editor) -> None:
     """ Paste IPA transcription into the IPA field of the Anki editor.
 
+    The transcription is fetched in the background, so the editor stays responsive. It is dropped
+    if the editor shows a different note by the time it arrives.
+
     :param editor: Anki editor window
     """
     lang_alias = editor.ipa_lang_alias
     note = editor.note
+    # the words are looked up right now, a scheduled prefetch would only duplicate the requests
+    if editor.ipa_prefetcher:
+        editor.ipa_prefetcher.cancel()
 
     # Get content of text field
     try:
@@ -47,146 +49,103 @@ def paste_ipa(editor: Editor) -> None:
     except KeyError:
         showInfo(f"Field '{CONFIG['WORD_FIELD']}' doesn't exist.")
         return
-    logging.debug(f"Field text: {field_text}")
+    if CONFIG["IPA_FIELD"] not in note:
+        showInfo(f"Field '{CONFIG['IPA_FIELD']}' doesn't exist.")
+        return
+    logger.debug(f"Field text: {field_text}")
 
     field_text = field_text.lower()
 
     # get word list from text field
     words = utils.get_words_from_field(field_text)
-    logging.debug(f"Word list: {words}")
-
-    # parse IPA transcription for every word in word list
-    try:
-        ipa = parse_ipa_transcription.transcript(words=words, language=lang_alias)
-    except (urllib.error.HTTPError, IndexError):
-        showInfo("IPA not found.")
-        return
-    logging.debug(f"IPA transcription string: {ipa}")
-
-    # paste IPA transcription of every word in IPA transcription field
-    try:
+    logger.debug(f"Word list: {words}")
+
+    def on_done(future: Future) -> None:
+        if editor.note is not note:
+            logger.debug(f"Editor moved to another note, dropping IPA transcription of {words}")
+            return
+        try:
+            ipa = future.result()
+        except (urllib.error.HTTPError, IndexError):
+            showInfo("IPA not found.")
+            return
+        except network.SourceUnavailable as e:
+            showInfo(f"{e}, it is skipped for {network.cooldown:.0f} seconds after repeated failures.")
+            return
+        except requests.exceptions.RequestException:
+            showInfo("Wiktionary could not be reached.")
+            return
+        logger.debug(f"IPA transcription string: {ipa}")
+        if not ipa.strip():
+            showInfo("IPA not found.")
+            return
+
+        # paste IPA transcription of every word in IPA transcription field
         note[CONFIG["IPA_FIELD"]] = ipa
-    except KeyError:
-        showInfo(f"Field '{CONFIG['IPA_FIELD']}' doesn't exist.")
-        return
-
-    # update editor
-    editor.loadNote()
-    editor.web.setFocus()
-
-
-def get_deck_name(main_window: mw) -> str:
-    """ Get the name of the current deck.
-
-    :param main_window: main window of Anki
-    :return: name of selected deck
-    """
-    try:
-        deck_name = main_window.col.decks.current()['name']
-    except AttributeError:
-        # No deck opened?
-        deck_name = None
-    return deck_name
-
-
-def get_default_lang(main_window: mw) -> str:
-    """ Get the IPA default language.
-
-    :param main_window: main window of Anki
-    :return: default IPA language for Anki or Anki deck
-    """
-    config = mw.col.conf['anki_ipa_conf']
-    lang = config['lang']
-    if config['defaultlangperdeck']:
-        deck_name = get_deck_name(main_window)
-        if deck_name and deck_name in config['deckdefaultlang']:
-            lang = config['deckdefaultlang'][deck_name]
-    return lang
-
-
-def on_setup_buttons(buttons: List[str], editor: Editor) -> List[str]:
-    """ Add Addon button and Addon combobox to card editor.
 
-    :param buttons: HTML codes of the editor buttons (e.g. for bold, italic, ...)
-    :param editor: card editor object
-    :return: updated list of buttons
-    """
-    # add HTML button
-    button = editor.addButton(ICON_PATH, "IPA", paste_ipa)
-    buttons.append(button)
-
-    # create list of language options
-    previous_lang = get_default_lang(mw)
-    options = [f"""<option>{previous_lang}</option>"""]  # first entry is the last selection
-
-    options += [
-        f"""<option>{language}</option>"""
-        for language in sorted(consts.LANGUAGES_MAP.keys(), key=str.lower)
-        if language != previous_lang
-    ]
-
-    # add HTML combobox
-    combo = select_elm.format("".join(options))
-    buttons.append(combo)
-
-    return buttons
-
-
-def set_default_lang(main_window: mw, lang: str) -> None:
-    """ Set new IPA default language.
-
-    :param main_window: main window of Anki
-    :param lang: new default language
-    """
-    config = mw.col.conf['anki_ipa_conf']
-    config['lang'] = lang  # Always update the overall default
-    if config['defaultlangperdeck']:
-        deck_name = get_deck_name(main_window)
-        if deck_name:
-            config['deckdefaultlang'][deck_name] = lang
-
-
-def on_ipa_language_select(editor: Editor, lang: str) -> None:
-    """ Set new default IPA language.
-
-    :param editor: Anki editor window
-    :param lang: name of selected language
-    """
-    alias = consts.LANGUAGES_MAP[lang]
-    set_default_lang(mw, lang)
-    editor.ipa_lang_alias = alias
-
-
-def init_ipa(editor: Editor, *args, **kwargs) -> None:
-    """ Get the last selected/default IPA language.
-
-    :param editor: Anki editor window
-    """
-    previous_lang = get_default_lang(mw)
-    editor.ipa_lang_alias = consts.LANGUAGES_MAP.get(previous_lang, "")
-
-
-def on_bridge_cmd(editor: Editor, command: str, _old: Callable) -> None:
-    """ React when new combobox selection is made.
-
-    :param editor: Anki editor window
-    :param command: editor command (e.g. own IPALang or focus, blur, key, ...)
-    :param _old: old editor.onBridgeCmd method
-    """
-    # old commands are executed like before
-    if not command.startswith("IPALang"):
-        _old(editor, command)
-    # new language gets selected in the combobox
-    else:
-        _, lang = command.split(":")
-        on_ipa_language_select(editor, lang)
-
-
-addHook("profileLoaded", setup_synced_config)
-# Overwrite Editor methods
-addHook("setupEditorButtons", on_setup_buttons)
-Editor.onBridgeCmd = wrap(Editor.onBridgeCmd, on_bridge_cmd, "around")
-Editor.__init__ = wrap(Editor.__init__, init_ipa)
-
-# Batch editing
-addHook("browser.setupMenus", batch_adding.setup_menu)
+        # update editor
+        editor.loadNote()
+        editor.web.setFocus()
+
+    # parse IPA transcription for every word in word list, all words are looked up together
+    mw.taskman.run_in_background(
+        lambda: parse_ipa_transcription.transcript(
+            words=words, language=lang_alias, strip_syllable_separator=CONFIG["STRIP_SYLLABLE_SEPARATOR"]),
+        on_done,
+    )
+
+
+def setup_cache() -> None:
+    """Open the persistent transcription cache in the add-on folder."""
+    os.makedirs(USER_FILES_PATH, exist_ok=True)
+    parse_ipa_transcription.cache = TranscriptionCache(
+        os.path.join(USER_FILES_PATH, "transcriptions.sqlite"),
+        max_entries=CONFIG.get("CACHE_MAX_ENTRIES", 200000),
+        ttl=CONFIG.get("CACHE_TTL_DAYS", 90) * 24 * 60 * 60,
+        negative_ttl=CONFIG.get("NEGATIVE_CACHE_TTL_DAYS", 7) * 24 * 60 * 60,
+    )
+
+
+def setup_offline_index() -> None:
+    """Use offline index files as primary source if they have been built."""
+    directory = CONFIG.get("OFFLINE_INDEX_DIR") or os.path.join(USER_FILES_PATH, "offline_index")
+    if os.path.isdir(directory):
+        parse_ipa_transcription.offline = OfflineIndexes(directory)
+
+
+def setup_network() -> None:
+    """Apply timeouts, connection and rate limits to the shared HTTP sessions."""
+    network.configure(
+        connect_timeout=CONFIG.get("CONNECT_TIMEOUT"),
+        read_timeout=CONFIG.get("READ_TIMEOUT"),
+        max_connections=CONFIG.get("MAX_CONNECTIONS_PER_HOST"),
+        requests_per_second=CONFIG.get("MAX_REQUESTS_PER_SECOND"),
+        retries=CONFIG.get("MAX_RETRIES"),
+        breaker_threshold=CONFIG.get("SOURCE_FAILURE_THRESHOLD"),
+        breaker_cooldown=CONFIG.get("SOURCE_COOLDOWN_SECONDS"),
+    )
+    mode = CONFIG.get("TRANSPORT", "live")
+    if mode in ("record", "replay"):
+        path = CONFIG.get("TRANSPORT_RECORDING") or os.path.join(USER_FILES_PATH, "recording.jsonl")
+        if mode == "record":
+            network.set_transport(transport.RecordingTransport(path, network.LiveTransport()))
+        elif os.path.isfile(path):
+            network.set_transport(transport.ReplayTransport(path))
+        else:
+            logger.warning(f"No recording at {path}, requests are sent to Wiktionary")
+
+
+def setup_parse_pool() -> None:
+    """Parse the HTML in worker processes if configured."""
+    processes = CONFIG.get("PARSE_PROCESSES", 0)
+    if processes:
+        try:
+            parse_ipa_transcription.parse_pool = html_parsing.ParsePool(processes)
+        except RuntimeError as e:
+            logger.warning(f"HTML is parsed in the lookup threads: {e}")
+
+
+setup_cache()
+setup_offline_index()
+setup_network()
+setup_parse_pool()
@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Shared HTTP sessions for all Wiktionary requests
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import contextlib
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    from .stats import stats
+    from .transport import Transport
+except ImportError:  # imported as top-level module, e.g. by the unittests
+    from stats import stats
+    from transport import Transport
+
+USER_AGENT = "AnkiIPA (https://github.com/m-rtin/anki-ipa)"
+
+# (connect timeout, read timeout) in seconds
+timeout: Tuple[float, float] = (3.05, 10)
+# Maximum number of open connections to a single Wiktionary host
+max_connections_per_host = 4
+# Requests per second to a single host, the rate drops when the host answers with errors
+max_requests_per_second = 10.0
+min_requests_per_second = 0.5
+# Retries of requests answered with one of RETRY_STATUS_CODES
+max_retries = 4
+# Backoff before the n-th retry is about BACKOFF_BASE * 2 ** n seconds, at most BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Too many requests and temporary server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Consecutive failed requests after which a host is considered unavailable
+failure_threshold = 5
+# Seconds during which requests to an unavailable host fail right away
+cooldown = 60.0
+
+# host -> base URL of a stand-in server which answers instead (e.g. http://127.0.0.1:8000/en.wiktionary.org),
+# used by the benchmarks
+redirects: Dict[str, str] = {}
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_limiters: Dict[str, "RateLimiter"] = {}
+_breakers: Dict[str, "CircuitBreaker"] = {}
+# cancellation token of the requests sent by the current thread
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """A request was aborted because its token was cancelled or its deadline has passed."""
+
+
+class SourceUnavailable(requests.exceptions.ConnectionError):
+    """Requests to a host fail right away because its last requests have failed."""
+
+
+class CancelToken:
+    """Cooperative cancellation of the requests sent in a cancel_scope, shared by many threads."""
+
+    def __init__(self, deadline: Optional[float] = None) -> None:
+        """ Initialize CancelToken.
+
+        :param deadline: seconds from now after which all requests are aborted, None for no deadline
+        """
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._deadline = None
+        self._responses = set()
+        self._lock = threading.Lock()
+        self.set_deadline(deadline)
+
+    def set_deadline(self, seconds: Optional[float]) -> None:
+        """ Abort all requests after some time.
+
+        :param seconds: seconds from now, None for no deadline
+        """
+        self._deadline = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline or None if there is none."""
+        return max(self._deadline - time.monotonic(), 0) if self._deadline else None
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self._deadline and time.monotonic() >= self._deadline:
+            self.reason = "deadline exceeded"
+        return self.reason is not None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """ Cancel all requests, responses which are still being received are closed.
+
+        :param reason: why the requests are cancelled, reported by the Cancelled exceptions
+        """
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            responses = list(self._responses)
+        self._event.set()
+        for response in responses:
+            _abort(response)
+
+    def check(self) -> None:
+        """Raise Cancelled if the token has been cancelled."""
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep, but raise Cancelled as soon as the token is cancelled or the deadline has passed."""
+        remaining = self.remaining()
+        self._event.wait(seconds if remaining is None else min(seconds, remaining))
+        self.check()
+
+    def timeout(self) -> Tuple[float, float]:
+        """Timeouts of the next request, they don't reach beyond the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return tuple(min(seconds, remaining) for seconds in timeout)
+
+    @contextlib.contextmanager
+    def track(self, response: requests.Response) -> Iterator[None]:
+        """Let cancel() close a response while its body is received."""
+        with self._lock:
+            self._responses.add(response)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._responses.discard(response)
+
+
+class RateLimiter:
+    """ Token bucket of a host whose rate adapts to the answers of the host.
+
+    Every throttled or failed request halves the rate, every successful one raises it a bit until
+    max_requests_per_second is reached again (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self) -> None:
+        self.rate = max_requests_per_second
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        # no requests before this time, set by Retry-After
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, token: Optional[CancelToken] = None) -> None:
+        """ Wait until a request may be sent.
+
+        :param token: cancellation token of the waiting request
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # bursts of up to one second worth of requests
+                self._tokens = min(self._tokens + (now - self._updated) * self.rate, max(self.rate, 1.0))
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            _sleep(delay, token)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + 0.1 * max_requests_per_second, max_requests_per_second)
+
+    def on_error(self, retry_after: Optional[float] = None) -> None:
+        """ Slow down after a throttled or failed request.
+
+        :param retry_after: seconds the host asked us to wait before the next request
+        """
+        with self._lock:
+            self.rate = max(self.rate / 2, min_requests_per_second)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+def get_limiter(host: str) -> RateLimiter:
+    """ Get the rate limiter of a host, it is shared by all transcription methods.
+
+    :param host: host name (e.g. en.wiktionary.org)
+    :return: rate limiter of the host
+    """
+    with _sessions_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = RateLimiter()
+        return limiter
+
+
+class CircuitBreaker:
+    """ Stops sending requests to a host which keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens and requests fail right away.
+    Once the cool-down has passed, a single request is let through as a probe (half-open): if it
+    succeeds the breaker closes, otherwise it opens for another cool-down.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        """ Let a request through or fail fast.
+
+        :raises SourceUnavailable: if the breaker is open or another request is probing the host
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened >= cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise SourceUnavailable(f"{self.host} is unavailable")
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= failure_threshold:
+                self.state = self.OPEN
+                self._opened = time.monotonic()
+            self._probing = False
+
+    def on_cancel(self) -> None:
+        """A cancelled request says nothing about the host, the next request probes instead."""
+        with self._lock:
+            self._probing = False
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """ Get the circuit breaker of a host.
+
+    :param host: host name (e.g. fr.wiktionary.org)
+    :return: circuit breaker of the host
+    """
+    with _sessions_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def _sleep(seconds: float, token: Optional[CancelToken]) -> None:
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """ Read the Retry-After header of a response.
+
+    :param response: response of the server
+    :return: seconds to wait, at most BACKOFF_MAX, or None if the header is missing or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.strip().isdigit():
+        seconds = float(value)
+    else:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = max(date.timestamp() - time.time(), 0.0)
+    # a server asking for hours of silence would otherwise block the lookups that long
+    return min(seconds, BACKOFF_MAX)
+
+
+def backoff(attempt: int) -> float:
+    """Jittered exponential backoff before a retry, attempt counts from 0."""
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.5)
+
+
+def _abort(response: requests.Response) -> None:
+    """Close a response while another thread is receiving its body."""
+    # closing the response alone doesn't wake up a thread blocked on the socket, shutdown does
+    # (urllib3 2.3 and later, with older versions the read only ends with its timeout)
+    shutdown = getattr(response.raw, "shutdown", None)
+    if shutdown is not None:
+        try:
+            shutdown()
+        except (RuntimeError, ValueError, OSError):
+            # the body has been received and the connection released already
+            pass
+    response.close()
+
+
+def current_token() -> Optional[CancelToken]:
+    """Cancellation token of the requests sent by the current thread, e.g. to pass it on to other threads."""
+    return getattr(_local, "token", None)
+
+
+@contextlib.contextmanager
+def cancel_scope(token: Optional[CancelToken]) -> Iterator[None]:
+    """ Send all requests of the current thread with a cancellation token.
+
+    :param token: cancellation token, None for requests which can't be cancelled
+    """
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield
+    finally:
+        _local.token = previous
+
+
+def configure(connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+              max_connections: Optional[int] = None, requests_per_second: Optional[float] = None,
+              retries: Optional[int] = None, breaker_threshold: Optional[int] = None,
+              breaker_cooldown: Optional[float] = None) -> None:
+    """ Change timeouts, connection and rate limits, existing sessions are recreated.
+
+    :param connect_timeout: seconds to wait for a connection to be established
+    :param read_timeout: seconds to wait for the server to send data
+    :param max_connections: maximum number of open connections per host
+    :param requests_per_second: maximum number of requests per second to a single host
+    :param retries: number of retries of throttled requests and temporary server errors
+    :param breaker_threshold: consecutive failed requests after which a host is considered unavailable
+    :param breaker_cooldown: seconds before an unavailable host is tried again
+    """
+    global timeout, max_connections_per_host, max_requests_per_second, max_retries, failure_threshold, cooldown
+    connect, read = timeout
+    timeout = (connect_timeout or connect, read_timeout or read)
+    if max_connections:
+        max_connections_per_host = max_connections
+    if requests_per_second:
+        max_requests_per_second = requests_per_second
+    if retries is not None:
+        max_retries = retries
+    if breaker_threshold:
+        failure_threshold = breaker_threshold
+    if breaker_cooldown:
+        cooldown = breaker_cooldown
+    close_sessions()
+
+
+def _create_session() -> requests.Session:
+    """Create a keep-alive session with a bounded connection pool."""
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"})
+    # pool_block makes additional threads wait for a free connection instead of opening new ones
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections_per_host, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(host: str) -> requests.Session:
+    """ Get the pooled session of a host, it is created on first use.
+
+    :param host: host name (e.g. en.wiktionary.org)
+    :return: session shared by all requests to this host
+    """
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _create_session()
+        return session
+
+
+def get(url: str, params: Optional[dict] = None) -> requests.Response:
+    """ Send a GET request through the pooled session of the URL's host.
+
+    Requests to a host are rate limited. Throttled requests and temporary server errors are retried
+    after the time given by Retry-After or a jittered exponential backoff.
+    Hosts whose requests keep failing are skipped for a while by their circuit breaker.
+    Inside a cancel_scope the request is aborted as soon as the token is cancelled.
+
+    :param url: requested URL
+    :param params: query parameters
+    :return: response of the server
+    :raises requests.HTTPError: if the request still fails after max_retries retries
+    :raises SourceUnavailable: if the circuit breaker of the host is open
+    """
+    return _request(url, params, None)
+
+
+def post(url: str, data: dict) -> requests.Response:
+    """ Send a POST request with a form body, e.g. for query parameters too long for a URL.
+
+    Like get, the request is rate limited, retried and aborted by the token of a cancel_scope.
+
+    :param url: requested URL
+    :param data: form fields
+    :return: response of the server
+    :raises requests.HTTPError: if the request still fails after max_retries retries
+    :raises SourceUnavailable: if the circuit breaker of the host is open
+    """
+    return _request(url, None, data)
+
+
+def _request(url: str, params: Optional[dict], data: Optional[dict]) -> requests.Response:
+    host = urllib.parse.urlsplit(url).netloc
+    breaker = get_breaker(host)
+    breaker.before_request()
+    try:
+        response = _send_with_retries(host, url, params, data)
+    except requests.exceptions.RequestException:
+        breaker.on_failure()
+        raise
+    except Cancelled:
+        breaker.on_cancel()
+        raise
+    breaker.on_success()
+    return response
+
+
+def _send_with_retries(host: str, url: str, params: Optional[dict], data: Optional[dict]) -> requests.Response:
+    """Send a rate limited request and retry it while the host is throttling or failing."""
+    token = current_token()
+    limiter = get_limiter(host)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(token)
+        start = time.perf_counter()
+        response = transport.send(url, params, token, data)
+        stats.add_latency(host, time.perf_counter() - start)
+        stats.count("requests")
+        # compressed size if the server sent it
+        stats.count("bytes", int(response.headers.get("Content-Length") or len(response.content)))
+        if response.status_code not in RETRY_STATUS_CODES:
+            limiter.on_success()
+            return response
+        wait = retry_after(response)
+        limiter.on_error(wait)
+        if attempt < max_retries:
+            _sleep(wait if wait is not None else backoff(attempt), token)
+    response.raise_for_status()
+
+
+class LiveTransport(Transport):
+    """Sends requests to Wiktionary (or the stand-in server given in redirects) through the pooled sessions."""
+
+    def send(self, url: str, params: Optional[dict], token: Optional[CancelToken] = None,
+             data: Optional[dict] = None) -> requests.Response:
+        parts = urllib.parse.urlsplit(url)
+        host = parts.netloc
+        if host in redirects:
+            url = redirects[host] + parts.path + (f"?{parts.query}" if parts.query else "")
+        method = "GET" if data is None else "POST"
+        if token is None:
+            return get_session(host).request(method, url, params=params, data=data, timeout=timeout)
+
+        token.check()
+        try:
+            response = get_session(host).request(method, url, params=params, data=data, timeout=token.timeout(),
+                                                 stream=True)
+            with token.track(response):
+                # reading the body fails once cancel() has closed the response
+                response.content
+        except (requests.exceptions.RequestException, AttributeError, ValueError):
+            token.check()
+            raise
+        token.check()
+        return response
+
+
+# Transport of all requests, replaced to record, replay or inject faults
+transport: Transport = LiveTransport()
+
+
+def set_transport(new_transport: Optional[Transport]) -> None:
+    """ Send all requests through another transport.
+
+    :param new_transport: transport to use, None for the live transport
+    """
+    global transport
+    previous, transport = transport, new_transport or LiveTransport()
+    if previous is not transport:
+        previous.close()
+
+
+def close_sessions() -> None:
+    """Close all pooled sessions and their connections."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _limiters.clear()
+        _breakers.clear()
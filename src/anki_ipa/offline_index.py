@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Offline word index built from Wiktionary dumps
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+
+An index file maps the words of one language to their IPA transcriptions:
+
+    magic | number of words n | n + 1 record offsets (uint32) | records sorted by word
+
+Each record is the UTF-8 encoded word, a NUL byte and the UTF-8 encoded transcription. The file is
+memory-mapped and searched with a binary search, so opening it reads nothing but the header.
+
+Build the index files from the add-on folder with e.g.:
+
+    python -m offline_index --dump enwiktionary-latest-pages-articles.xml.bz2 --languages british american
+    python -m offline_index --wiktextract raw-wiktextract-data.jsonl.gz --languages russian
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from . import parse_ipa_transcription
+except ImportError:  # run as a script or imported by the unittests
+    import parse_ipa_transcription
+
+MAGIC = b"ANKIIPA1"
+HEADER = struct.Struct("<8sI")
+OFFSET = struct.Struct("<I")
+
+# Language codes of the entries in a wiktextract export
+WIKTEXTRACT_LANG_CODES = {
+    'british': 'en',
+    'american': 'en',
+    'french': 'fr',
+    'russian': 'ru',
+    'spanish': 'es',
+    'german': 'de',
+    'polish': 'pl',
+    'dutch': 'nl',
+}
+# Tags of the preferred pronunciation of a variant in a wiktextract export
+WIKTEXTRACT_PREFERRED_TAGS = {
+    'british': {'UK', 'Received-Pronunciation'},
+    'american': {'US', 'General-American'},
+}
+
+
+def index_path(directory: str, language: str) -> str:
+    """Path of the index file of a language."""
+    return os.path.join(directory, f"{language}.idx")
+
+
+def write_index(path: str, transcriptions: Dict[str, str]) -> None:
+    """ Write an index file.
+
+    :param path: path of the index file
+    :param transcriptions: dictionary of words and their IPA transcriptions
+    """
+    records = sorted(
+        (word.encode("utf-8"), ipa.encode("utf-8"))
+        for word, ipa in transcriptions.items() if ipa and "\0" not in word
+    )
+    offsets = [0]
+    for word, ipa in records:
+        offsets.append(offsets[-1] + len(word) + 1 + len(ipa))
+    if offsets[-1] >= 2 ** 32:
+        raise ValueError("Index too large")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        for word, ipa in records:
+            f.write(word + b"\0" + ipa)
+    os.replace(tmp_path, path)
+
+
+class OfflineIndex:
+    """Read-only, memory-mapped word index of one language."""
+
+    def __init__(self, path: str) -> None:
+        """ Open an index file.
+
+        :param path: path of the index file
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not an IPA index file")
+        self._data_start = HEADER.size + OFFSET.size * (self._count + 1)
+
+    def _offset(self, i: int) -> int:
+        return self._data_start + OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * i)[0]
+
+    def get(self, word: str) -> Optional[str]:
+        """ Look up a word.
+
+        :param word: word to look up
+        :return: IPA transcription or None if the word isn't in the index
+        """
+        key = word.encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._offset(middle)
+            separator = self._mmap.find(b"\0", start)
+            candidate = self._mmap[start:separator]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return self._mmap[separator + 1:self._offset(middle + 1)].decode("utf-8")
+        return None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class OfflineIndexes:
+    """Index files of all languages in a directory, each one is opened on first use."""
+
+    def __init__(self, directory: str) -> None:
+        """ Initialize OfflineIndexes.
+
+        :param directory: directory containing the <language>.idx files
+        """
+        self.directory = directory
+        self._indexes: Dict[str, Optional[OfflineIndex]] = {}
+        self._lock = threading.Lock()
+
+    def index(self, language: str) -> Optional[OfflineIndex]:
+        """ Get the index of a language.
+
+        :param language: name of the transcription method
+        :return: index or None if there is no index file for the language
+        """
+        with self._lock:
+            if language not in self._indexes:
+                path = index_path(self.directory, language)
+                self._indexes[language] = OfflineIndex(path) if os.path.exists(path) else None
+            return self._indexes[language]
+
+    def get_many(self, language: str, words: Iterable[str], strip_syllable_separator: bool) -> Dict[str, str]:
+        """ Look up several words.
+
+        :param language: name of the transcription method
+        :param words: words to look up
+        :param strip_syllable_separator: whether syllable separators are removed
+        :return: dictionary of the words found in the index and their IPA transcriptions
+        """
+        index = self.index(language)
+        if index is None:
+            return {}
+        found = {}
+        for word in words:
+            ipa = index.get(word)
+            if ipa is not None:
+                # the index keeps syllable separators
+                found[word] = ipa.replace(".", "") if strip_syllable_separator else ipa
+        return found
+
+    def close(self) -> None:
+        with self._lock:
+            for index in self._indexes.values():
+                if index:
+                    index.close()
+            self._indexes.clear()
+
+
+def _open(path: str):
+    """Open a plain, bzip2 or gzip compressed file for reading."""
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_dump_pages(path: str) -> Iterator[Tuple[str, str]]:
+    """ Stream the articles of a MediaWiki XML dump.
+
+    :param path: path of the (compressed) dump, e.g. enwiktionary-latest-pages-articles.xml.bz2
+    :return: iterator over the titles and wikitexts of all pages in the main namespace
+    """
+    with _open(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        title, namespace, text = None, None, None
+        for event, element in context:
+            if event != "end":
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag == "title":
+                title = element.text
+            elif tag == "ns":
+                namespace = element.text
+            elif tag == "text":
+                text = element.text
+            elif tag == "page":
+                if namespace == "0" and title and text:
+                    yield title, text
+                title, namespace, text = None, None, None
+                # drop parsed pages, the dump doesn't fit into memory
+                root.clear()
+
+
+def transcriptions_from_dump(path: str, languages: List[str]) -> Dict[str, Dict[str, str]]:
+    """ Extract transcriptions from a Wiktionary dump with the same rules as the online lookup.
+
+    Templates which generate the transcription (e.g. {{transcription-ru}}) can't be read from a dump,
+    use a wiktextract export for these languages.
+
+    :param path: path of the dump
+    :param languages: names of the transcription methods whose Wiktionary the dump is from
+    :return: dictionary of languages, each with words and their IPA transcriptions
+    """
+    transcriptions = {language: {} for language in languages}
+    for title, wikitext in iter_dump_pages(path):
+        for language in languages:
+            ipa = parse_ipa_transcription.wikitext_extractors[language](wikitext, False)
+            if ipa:
+                transcriptions[language][title] = ipa
+    return transcriptions
+
+
+def _wiktextract_transcription(language: str, sounds: List[dict]) -> str:
+    """Choose the transcription of a wiktextract entry the way the online lookup does."""
+    ipas = [sound["ipa"] for sound in sounds if sound.get("ipa")]
+    if not ipas:
+        return ""
+    if language in WIKTEXTRACT_PREFERRED_TAGS:
+        preferred = WIKTEXTRACT_PREFERRED_TAGS[language]
+        ipa = next((sound["ipa"] for sound in sounds if sound.get("ipa") and preferred & set(sound.get("tags", []))),
+                   ipas[0])
+        return parse_ipa_transcription.remove_special_chars(word=ipa, strip_syllable_separator=False)
+    if language == 'german':
+        return parse_ipa_transcription.clean_transcription(ipas[0], False)
+    return parse_ipa_transcription.join_transcriptions(ipas, False)
+
+
+def transcriptions_from_wiktextract(path: str, languages: List[str]) -> Dict[str, Dict[str, str]]:
+    """ Extract transcriptions from a wiktextract JSONL export.
+
+    :param path: path of the (compressed) export
+    :param languages: names of the transcription methods
+    :return: dictionary of languages, each with words and their IPA transcriptions
+    """
+    transcriptions = {language: {} for language in languages}
+    with _open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            word, sounds = entry.get("word"), entry.get("sounds")
+            if not word or not sounds:
+                continue
+            for language in languages:
+                if entry.get("lang_code") != WIKTEXTRACT_LANG_CODES[language] or word in transcriptions[language]:
+                    continue
+                ipa = _wiktextract_transcription(language, sounds)
+                if ipa:
+                    transcriptions[language][word] = ipa
+    return transcriptions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build offline IPA index files.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dump", help="MediaWiki XML dump of the Wiktionary of the languages")
+    source.add_argument("--wiktextract", help="wiktextract JSONL export")
+    parser.add_argument("--languages", nargs="+", required=True,
+                        choices=sorted(parse_ipa_transcription.wikitext_extractors))
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      "user_files", "offline_index"),
+                        help="directory of the index files")
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        transcriptions = transcriptions_from_dump(args.dump, args.languages)
+    else:
+        transcriptions = transcriptions_from_wiktextract(args.wiktextract, args.languages)
+    os.makedirs(args.out, exist_ok=True)
+    for language, language_transcriptions in transcriptions.items():
+        path = index_path(args.out, language)
+        write_index(path, language_transcriptions)
+        print(f"{language}: {len(language_transcriptions)} words -> {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
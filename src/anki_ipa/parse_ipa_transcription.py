@@ -8,130 +8,459 @@ License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
 """
 
 import urllib
-import bs4
 import re
 import requests
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from . import html_parsing, network
+    from .html_parsing import clean_transcription
+    from .stats import stats, PARSE, REGEX
+except ImportError:  # imported as top-level module, e.g. by the unittests
+    import html_parsing
+    import network
+    from html_parsing import clean_transcription
+    from stats import stats, PARSE, REGEX
 
 # Create a dictionary for all transcription methods
 transcription_methods = {}
 transcription = lambda f: transcription_methods.setdefault(f.__name__, f)
 
+# Persistent transcription cache (cache.TranscriptionCache), set up by the add-on
+cache = None
+
+# Offline word index (offline_index.OfflineIndexes), set up by the add-on if index files exist
+offline = None
+
+# Worker processes for the HTML parsing (html_parsing.ParsePool), None to parse in the calling thread
+parse_pool = None
+
+# Wiktionary the transcriptions of each language are read from
+WIKIS = {
+    'british': 'en.wiktionary.org',
+    'american': 'en.wiktionary.org',
+    'french': 'fr.wiktionary.org',
+    'russian': 'ru.wiktionary.org',
+    'spanish': 'es.wiktionary.org',
+    'german': 'de.wiktionary.org',
+    'polish': 'pl.wiktionary.org',
+    'dutch': 'nl.wiktionary.org',
+}
+
+EN_API_URL = f"https://{WIKIS['british']}/w/api.php"
+DE_API_URL = f"https://{WIKIS['german']}/w/api.php"
+
+# Maximum number of pages the MediaWiki API returns per query
+MAX_TITLES_PER_REQUEST = 50
+
+# Requests which can't be batched (title-dependent templates, rendered articles) sent concurrently,
+# the connections per host are still limited by network
+MAX_WORD_REQUESTS = 4
+
+# Why a word has no transcription, both are remembered by the cache for a shorter time.
+# Batch methods return None for words without page and "" for pages without IPA transcription,
+# failed requests raise instead.
+PAGE_MISSING = "page missing"
+NO_IPA = "no IPA"
+
+
+def query_api(api_url: str, payload: dict, post: bool = False) -> dict:
+    """ Send a request to the MediaWiki API.
+
+    :param api_url: URL of the MediaWiki API
+    :param payload: query parameters
+    :param post: send the parameters as form body, for long texts which don't fit into a URL
+    :return: decoded JSON answer
+    :raises requests.HTTPError: if the API answers with an error, e.g. because of rate limiting
+    """
+    response = network.post(api_url, payload) if post else network.get(api_url, params=payload)
+    data = response.json()
+    if 'error' in data:
+        raise requests.HTTPError(f"{data['error'].get('code')}: {data['error'].get('info')}")
+    return data
+
+
+def map_words(function: Callable[[str], Any], words: Iterable[str]) -> Dict[str, Any]:
+    """ Call a function which sends a request for each word, up to MAX_WORD_REQUESTS words at a time.
+
+    The requests are cancelled with the token of the calling thread.
+
+    :param function: called with a word
+    :param words: words
+    :return: dictionary of words and the results of the function
+    :raises Exception: the first exception raised by the function, the calls not started yet are dropped
+    """
+    words = list(words)
+    if len(words) < 2:
+        return {word: function(word) for word in words}
+    token = network.current_token()
+
+    def call(word: str) -> Any:
+        with network.cancel_scope(token):
+            return function(word)
+
+    executor = ThreadPoolExecutor(max_workers=min(MAX_WORD_REQUESTS, len(words)))
+    try:
+        return dict(zip(words, executor.map(call, words)))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def fetch_wikitexts(api_url: str, words: Iterable[str]) -> Dict[str, str]:
+    """ Get the wikitext of many Wiktionary pages with as few requests as possible.
+
+    :param api_url: URL of the MediaWiki API (e.g. https://en.wiktionary.org/w/api.php)
+    :param words: titles of the requested pages
+    :return: dictionary of the words whose page exists and their wikitext
+    """
+    words = list(dict.fromkeys(words))
+    wikitexts = {}
+    for i in range(0, len(words), MAX_TITLES_PER_REQUEST):
+        chunk = words[i:i + MAX_TITLES_PER_REQUEST]
+        payload = {'action': 'query', 'prop': 'revisions', 'rvprop': 'content', 'rvslots': 'main',
+                   'titles': "|".join(chunk), 'format': 'json', 'formatversion': '2'}
+        titles = {word: word for word in chunk}
+        while True:
+            data = query_api(api_url, payload)
+            query = data.get('query', {})
+            # the API returns normalized titles (e.g. underscores replaced by spaces)
+            for normalized in query.get('normalized', []):
+                titles[normalized['to']] = titles.pop(normalized['from'], normalized['from'])
+            for page in query.get('pages', []):
+                revisions = page.get('revisions')
+                if page['title'] in titles and revisions:
+                    wikitexts[titles[page['title']]] = revisions[0]['slots']['main']['content']
+            # very large pages are spread over several responses
+            if 'continue' not in data:
+                break
+            payload = {**payload, **data['continue']}
+    return wikitexts
+
+
+def fetch_wikitext(api_url: str, word: str) -> Optional[str]:
+    """ Get the wikitext of a single Wiktionary page.
+
+    :param api_url: URL of the MediaWiki API
+    :param word: title of the requested page
+    :return: wikitext or None if the page doesn't exist
+    """
+    return fetch_wikitexts(api_url, [word]).get(word)
+
+
+# Tokens of the English pronunciation section: accent label, IPA template or line break
+# * {{a|UK}} {{IPA|en|/bɜːst/}}
+# * {{a|GA}} {{IPA|en|/ˈt͡ʃɑɹ.koʊl/}}
+EN_PRONUNCIATION_TOKEN = re.compile(r"{{a\|(UK|RP|US|GA|GenAm)}}( )?|{{IPA\|en\|([^}]+)}}|\n")
+
+
+def english_from_wikitext(wikitext: Optional[str], strip_syllable_separator: bool) -> Dict[str, str]:
+    """ Get the British and the American transcription from an English Wiktionary page in a single pass.
+
+    British: first IPA directly preceded by {{a|UK}}, else by {{a|RP}}, else the first IPA of the page.
+    American: first IPA directly preceded by {{a|US}}, else the first one after {{a|GA}} or
+    {{a|GenAm}} on the same line, else the first IPA of the page.
+
+    :param wikitext: wikitext of the page or None if the page doesn't exist
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: dictionary with the transcriptions for british and american
+    """
+    first_ipa = None
+    adjacent = {}  # label directly in front of the IPA template -> first IPA
+    same_line = {}  # label somewhere before the IPA template on the same line -> first IPA
+    line_labels = []
+    previous_label, previous_label_end = None, -1
+    for m in EN_PRONUNCIATION_TOKEN.finditer(wikitext or ""):
+        label, space, ipa = m.groups()
+        if label:
+            line_labels.append(label)
+            previous_label, previous_label_end = label, (m.end() if space else -1)
+        elif ipa:
+            if m.start() == previous_label_end:
+                adjacent.setdefault(previous_label, ipa)
+            for line_label in line_labels:
+                same_line.setdefault(line_label, ipa)
+            if first_ipa is None:
+                first_ipa = ipa
+        else:
+            line_labels = []
+
+    british = adjacent.get('UK') or adjacent.get('RP') or first_ipa
+    american = adjacent.get('US') or same_line.get('GA') or same_line.get('GenAm') or first_ipa
+    return {
+        language: remove_special_chars(word=ipa, strip_syllable_separator=strip_syllable_separator) if ipa else ""
+        for language, ipa in (('british', british), ('american', american))
+    }
+
+
+def transcript_english(words: List[str], strip_syllable_separator: bool) -> Dict[str, Dict[str, Optional[str]]]:
+    """ Get British and American transcriptions with one request per MAX_TITLES_PER_REQUEST words.
+
+    :param words: words to transcribe
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: dictionary of british and american, each with words and their IPA transcriptions
+             (None if there is no page)
+    """
+    wikitexts = fetch_wikitexts(EN_API_URL, words)
+    transcriptions = {'british': {}, 'american': {}}
+    with stats.timer(REGEX):
+        for word in words:
+            if word not in wikitexts:
+                for language in transcriptions:
+                    transcriptions[language][word] = None
+                continue
+            for language, ipa in english_from_wikitext(wikitexts[word], strip_syllable_separator).items():
+                transcriptions[language][word] = ipa
+    return transcriptions
+
 
 @transcription
 def british(word: str, strip_syllable_separator: bool) -> str:
-    payload = {'action': 'parse', 'page': word, 'format': 'json', 'prop': 'wikitext'}
-    r = requests.get('https://en.wiktionary.org/w/api.php', params=payload)
-    try:
-        wikitext = r.json()['parse']['wikitext']['*']
-        p = re.compile("{{a\|UK}} {{IPA\|en\|([^}]+)}}")
-        m = p.search(wikitext)
-        if m is None:
-            p = re.compile("{{a\|RP}} {{IPA\|en\|([^}]+)}}")
-            m = p.search(wikitext)
-        if m is None: 
-            p = re.compile("{{IPA\|en\|([^}]+)}}")
-            m = p.search(wikitext)
-        if m is None: 
-            p = re.compile("{{IPA\|en\|([^}]+)\|([^}]+)}}")
-            m = p.search(wikitext)
-            
-        ipa = m.group(1)
-        return remove_special_chars(word=ipa, strip_syllable_separator=strip_syllable_separator)
-    except (KeyError, AttributeError):
-        return ""
+    return british_from_wikitext(fetch_wikitext(EN_API_URL, word), strip_syllable_separator)
+
+
+def british_from_wikitext(wikitext: Optional[str], strip_syllable_separator: bool) -> str:
+    return english_from_wikitext(wikitext, strip_syllable_separator)['british']
+
 
 @transcription
 def american(word: str, strip_syllable_separator: bool) -> str:
-    payload = {'action': 'parse', 'page': word, 'format': 'json', 'prop': 'wikitext'}
-    r = requests.get('https://en.wiktionary.org/w/api.php', params=payload)
-    try:
-        wikitext = r.json()['parse']['wikitext']['*']
-        p = re.compile("{{a\|US}} {{IPA\|en\|([^}]+)}}")
-        m = p.search(wikitext)
-        if m is None: 
-            p = re.compile("{{a\|GA}}.*?{{IPA\|en\|([^}]+)}}")
-            m = p.search(wikitext)
-        if m is None: 
-            p = re.compile("{{a\|GenAm}}.*?{{IPA\|en\|([^}]+)}}")
-            m = p.search(wikitext)
-        if m is None:
-            p = re.compile("{{IPA\|en\|([^}]+)}}")
-            m = p.search(wikitext)
-        if m is None:
-            p = re.compile("{{IPA\|en\|([^}]+)\|([^}]+)}}")
-            m = p.search(wikitext)
+    return american_from_wikitext(fetch_wikitext(EN_API_URL, word), strip_syllable_separator)
+
+
+def american_from_wikitext(wikitext: Optional[str], strip_syllable_separator: bool) -> str:
+    return english_from_wikitext(wikitext, strip_syllable_separator)['american']
 
-        ipa = m.group(1)
-        return remove_special_chars(word=ipa, strip_syllable_separator=strip_syllable_separator)
-    except (KeyError, AttributeError):
-        return ""
 
 @transcription
 def french(word: str, strip_syllable_separator: bool) -> str:
-    link = f"https://fr.wiktionary.org/wiki/{word}"
-    return ", ".join(parse_website(link, {'title': 'Prononciation API'}, strip_syllable_separator))
+    return transcript_french([word], strip_syllable_separator)[word] or ""
 
 
 @transcription
 def russian(word: str, strip_syllable_separator: bool) -> str:
-    link = f"https://ru.wiktionary.org/wiki/{word}"
-    return ", ".join(parse_website(link, {'class': 'IPA'}, strip_syllable_separator))
+    return transcript_russian([word], strip_syllable_separator)[word] or ""
 
 
 @transcription
 def spanish(word: str, strip_syllable_separator: bool) -> str:
-    link = f"https://es.wiktionary.org/wiki/{word}"
-    return ", ".join(parse_website(link, {'class': 'ipa'}, strip_syllable_separator))
+    return transcript_spanish([word], strip_syllable_separator)[word] or ""
 
 
 @transcription
 def german(word: str, strip_syllable_separator: bool) -> str:
-    payload = {'action': 'parse', 'page': word, 'format': 'json', 'prop': 'wikitext'}
-    r = requests.get('https://de.wiktionary.org/w/api.php', params=payload)
+    return german_from_wikitext(fetch_wikitext(DE_API_URL, word), strip_syllable_separator)
+
+
+def german_from_wikitext(wikitext: Optional[str], strip_syllable_separator: bool) -> str:
+    if wikitext is None:
+        return ""
     try:
-        wikitext = r.json()['parse']['wikitext']['*']
         p = re.compile("{{IPA}}.*?{{Lautschrift\|([^}]+)")
         m = p.search(wikitext)
         ipa = m.group(1)
         return ipa
-    except (KeyError, AttributeError):
+    except AttributeError:
         return ""
 
 @transcription
 def polish(word: str, strip_syllable_separator: bool) -> str:
-    link = f"https://pl.wiktionary.org/wiki/{word}"
-    return ", ".join(parse_website(
-        link, {'title': 'To jest wymowa w zapisie IPA; zobacz hasło IPA w Wikipedii'}, strip_syllable_separator))
+    return transcript_polish([word], strip_syllable_separator)[word] or ""
 
 
 @transcription
 def dutch(word: str, strip_syllable_separator: bool) -> str:
-    link = f"https://nl.wiktionary.org/wiki/{word}"
-    return ", ".join(parse_website(link, {"class": "IPAtekst"}, strip_syllable_separator))
+    return transcript_dutch([word], strip_syllable_separator)[word] or ""
+
+
+def french_templates(wikitext: str) -> Tuple[List[str], List[str]]:
+    # '''occasion''' {{pron|ɔ.ka.zjɔ̃|fr}}
+    return re.findall(r"{{pron\|([^|}]+)", wikitext), []
+
+
+def russian_templates(wikitext: str) -> Tuple[List[str], List[str]]:
+    # {{transcription-ru|спаси́бо}}, the IPA transcription is generated by the template
+    return [], re.findall(r"{{transcriptions?(?:-ru)?\|[^{}]*}}", wikitext)
+
+
+def spanish_templates(wikitext: str) -> Tuple[List[str], List[str]]:
+    # {{pron-graf|fone=eteɾniˈðað}}, without fone the transcription is generated by the template
+    # from the title of the page
+    transcriptions, templates = [], []
+    for template in re.findall(r"{{pron-graf(?:\|[^{}]*)?}}", wikitext):
+        fone = re.findall(r"\|\s*fone\d*\s*=\s*([^|}]+)", template)
+        if fone:
+            transcriptions += fone
+        else:
+            templates.append(template)
+    return transcriptions, templates
+
+
+def polish_templates(wikitext: str) -> Tuple[List[str], List[str]]:
+    # {{wymowa}} {{IPA3|ˌastɛˈrɔjda}}
+    return re.findall(r"{{IPA\d?\|([^|}]+)", wikitext), []
+
+
+def dutch_templates(wikitext: str) -> Tuple[List[str], List[str]]:
+    # *{{WikiW|IPA}}: {{IPA|/ʋɪt/|nl}}
+    return re.findall(r"{{IPA\|([^|}]+)", wikitext), []
+
+
+def render_templates(api_url: str, templates: Dict[str, List[str]], css_code: dict,
+                     title: Optional[str] = None) -> Dict[str, List[str]]:
+    """ Let MediaWiki expand the pronunciation templates of many words with a single request.
+
+    Only the templates are rendered, not the whole article.
+
+    :param api_url: URL of the MediaWiki API
+    :param templates: dictionary of words and the wikitext of their pronunciation templates
+    :param css_code: attributes of the span elements which contain the IPA transcription
+    :param title: title of the page the templates are rendered on, for templates which read it
+    :return: dictionary of words and the texts of their IPA span elements
+    """
+    words = list(templates)
+    text = "\n".join(
+        f'<div class="anki-ipa-{i}">{" ".join(templates[word])}</div>' for i, word in enumerate(words)
+    )
+    payload = {'action': 'parse', 'text': text, 'contentmodel': 'wikitext', 'prop': 'text',
+               'disablelimitreport': 1, 'disableeditsection': 1, 'format': 'json', 'formatversion': '2'}
+    if title is not None:
+        payload['title'] = title
+    # the templates of MAX_TITLES_PER_REQUEST words are too long for a URL
+    html = query_api(api_url, payload, post=True)['parse']['text']
+    with stats.timer(PARSE):
+        rendered = extract("extract_rendered", html, len(words), css_code)
+    return dict(zip(words, rendered))
+
+
+def transcript_from_templates(words: List[str], strip_syllable_separator: bool, wiki: str,
+                              find_templates: Callable[[str], Tuple[List[str], List[str]]],
+                              css_code: dict, title_dependent: bool = False) -> Dict[str, Optional[str]]:
+    """ Get IPA transcriptions from the pronunciation templates in the wikitext of Wiktionary pages.
+
+    Transcriptions written into the templates are read directly, templates which generate the
+    transcription are expanded by the API. If the wikitext of an existing page contains no known
+    template, the rendered article is parsed instead.
+
+    :param words: words to transcribe
+    :param strip_syllable_separator: whether syllable separators are removed
+    :param wiki: host name of the Wiktionary (e.g. fr.wiktionary.org)
+    :param find_templates: returns the transcriptions found in a wikitext and the templates to expand
+    :param css_code: attributes of the span elements which contain the IPA transcription
+    :param title_dependent: whether the templates read the page title, they are then expanded with
+                            one request per word, see map_words
+    :return: dictionary of words and their IPA transcriptions (None if there is no page)
+    """
+    api_url = f"https://{wiki}/w/api.php"
+    wikitexts = fetch_wikitexts(api_url, words)
+    found, to_render = {}, {}
+    with stats.timer(REGEX):
+        for word, wikitext in wikitexts.items():
+            found[word], templates = find_templates(wikitext)
+            if templates:
+                to_render[word] = templates
+    if to_render and title_dependent:
+        rendered = map_words(lambda word: render_templates(api_url, {word: to_render[word]}, css_code, title=word),
+                             to_render)
+        for word in to_render:
+            found[word] += rendered[word][word]
+    elif to_render:
+        for word, rendered in render_templates(api_url, to_render, css_code).items():
+            found[word] += rendered
+
+    # pages without known template, their rendered articles are parsed
+    articles = map_words(lambda word: parse_website(f"https://{wiki}/wiki/{word}", css_code, strip_syllable_separator),
+                         [word for word in words if word in wikitexts and not found[word]])
+    transcriptions = {}
+    for word in words:
+        if word not in wikitexts:
+            transcriptions[word] = None
+        elif found[word]:
+            transcriptions[word] = join_transcriptions(found[word], strip_syllable_separator)
+        else:
+            transcriptions[word] = ", ".join(articles[word])
+    return transcriptions
+
+
+def join_transcriptions(texts: Iterable[str], strip_syllable_separator: bool) -> str:
+    """Join the distinct cleaned transcriptions of a word."""
+    cleaned = {clean_transcription(text, strip_syllable_separator) for text in texts}
+    return ", ".join(sorted(cleaned - {""}))
+
+
+def templates_from_wikitext(find_templates: Callable[[str], Tuple[List[str], List[str]]]) -> Callable:
+    """Extraction of the transcriptions written into the templates, templates to expand are ignored."""
+    def from_wikitext(wikitext: Optional[str], strip_syllable_separator: bool) -> str:
+        if wikitext is None:
+            return ""
+        transcriptions, _ = find_templates(wikitext)
+        return join_transcriptions(transcriptions, strip_syllable_separator)
+    return from_wikitext
+
+
+def transcript_french(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+    return transcript_from_templates(words, strip_syllable_separator, WIKIS['french'], french_templates,
+                                     {'title': 'Prononciation API'})
+
+
+def transcript_russian(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+    return transcript_from_templates(words, strip_syllable_separator, WIKIS['russian'], russian_templates,
+                                     {'class': 'IPA'})
+
+
+def transcript_spanish(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+    return transcript_from_templates(words, strip_syllable_separator, WIKIS['spanish'], spanish_templates,
+                                     {'class': 'ipa'}, title_dependent=True)
+
+
+def transcript_polish(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+    return transcript_from_templates(words, strip_syllable_separator, WIKIS['polish'], polish_templates,
+                                     {'title': 'To jest wymowa w zapisie IPA; zobacz hasło IPA w Wikipedii'})
+
+
+def transcript_dutch(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+    return transcript_from_templates(words, strip_syllable_separator, WIKIS['dutch'], dutch_templates,
+                                     {"class": "IPAtekst"})
+
+
+# Extraction of the transcription from the wikitext of a page without any request (e.g. from a dump)
+wikitext_extractors = {
+    'british': british_from_wikitext,
+    'american': american_from_wikitext,
+    'german': german_from_wikitext,
+    'french': templates_from_wikitext(french_templates),
+    'russian': templates_from_wikitext(russian_templates),
+    'spanish': templates_from_wikitext(spanish_templates),
+    'polish': templates_from_wikitext(polish_templates),
+    'dutch': templates_from_wikitext(dutch_templates),
+}
+
 
 def parse_website(link: str, css_code: dict, strip_syllable_separator: bool=True) -> List[str]:
-    try:
-        website = requests.get(link)
-    except requests.exceptions.RequestException as e:
-        return [""]
-    soup = bs4.BeautifulSoup(website.text, "html.parser")
-    results = soup.find_all('span', css_code) 
-    if strip_syllable_separator:
-        transcriptions = map(lambda result: result.getText()
-            .replace("/", "")
-            .replace("]", "")
-            .replace("[", "")
-            .replace(".", "")
-            .replace("\\", ""), results)
-    else:
-        transcriptions = map(lambda result: result.getText()
-            .replace("/", "")
-            .replace("]", "")
-            .replace("[", "")
-            .replace("\\", ""), results)
-    _transcriptions = sorted(list(set(transcriptions))[0])
-    return _transcriptions
+    # failed requests are raised, an empty result only means that there is no transcription
+    website = network.get(link)
+    with stats.timer(PARSE):
+        return extract("extract_spans", website.content, website.encoding, css_code, strip_syllable_separator)
+
+
+def extract(function: str, *args):
+    """ Run an extraction function of html_parsing in the parse pool or, without pool, in this thread.
+
+    :param function: name of the function (e.g. extract_spans)
+    :param args: arguments of the function
+    :return: result of the function
+    """
+    global parse_pool
+    pool = parse_pool
+    if pool is not None:
+        try:
+            return pool.run(function, *args)
+        # e.g. the interpreter can't start worker processes, parse in the threads instead
+        except BrokenProcessPool:
+            parse_pool = None
+            pool.shutdown()
+    return getattr(html_parsing, function)(*args)
 
 
 def remove_special_chars(word: str, strip_syllable_separator: bool) -> str:
@@ -141,7 +470,134 @@ def remove_special_chars(word: str, strip_syllable_separator: bool) -> str:
     return word
 
 
-def transcript(words: List[str], language: str, strip_syllable_separator: bool=True) -> str:
+def wikitext_method(api_url: str, from_wikitext: Callable[[Optional[str], bool], str]) -> Callable:
+    """Batch transcription method which extracts the transcription of each word from its wikitext."""
+    def method(words: List[str], strip_syllable_separator: bool) -> Dict[str, Optional[str]]:
+        wikitexts = fetch_wikitexts(api_url, words)
+        with stats.timer(REGEX):
+            return {word: from_wikitext(wikitexts[word], strip_syllable_separator) if word in wikitexts else None
+                    for word in words}
+    return method
+
+
+# Transcription methods which look up many words per request
+batch_methods = {
+    'british': lambda words, strip_syllable_separator: transcript_english(words, strip_syllable_separator)['british'],
+    'american': lambda words, strip_syllable_separator: transcript_english(words, strip_syllable_separator)['american'],
+    'german': wikitext_method(DE_API_URL, german_from_wikitext),
+    'french': transcript_french,
+    'russian': transcript_russian,
+    'spanish': transcript_spanish,
+    'polish': transcript_polish,
+    'dutch': transcript_dutch,
+}
+
+# Transcription methods which read the same page, all of them are extracted from a single request
+shared_page_methods = {
+    ('british', 'american'): transcript_english,
+}
+
+
+def variants_of(language: str) -> List[str]:
+    """ Other transcription methods which read the same Wiktionary page.
+
+    :param language: name of the transcription method
+    :return: names of the other transcription methods, e.g. american for british
+    """
+    for languages in shared_page_methods:
+        if language in languages:
+            return [variant for variant in languages if variant != language]
+    return []
+
+
+def words_per_request(language: str) -> int:
+    """ Number of words a transcription method can look up with a single request.
+
+    :param language: name of the transcription method
+    :return: maximum number of words per request
+    """
+    return MAX_TITLES_PER_REQUEST if language in batch_methods else 1
+
+
+def _fetch_transcriptions(words: List[str], languages: List[str],
+                          strip_syllable_separator: bool) -> Dict[str, Dict[str, str]]:
+    """Fetch transcriptions of languages which read the same page."""
+    for shared_languages, method in shared_page_methods.items():
+        if set(languages) <= set(shared_languages):
+            # all variants come with the page anyway
+            return method(words, strip_syllable_separator)
+    (language,) = languages
+    if language in batch_methods:
+        return {language: batch_methods[language](words, strip_syllable_separator)}
     transcription_method = transcription_methods[language]
-    transcribed_words = [transcription_method(word, strip_syllable_separator) for word in words]
-    return " ".join(transcribed_words)
+    return {language: {word: transcription_method(word, strip_syllable_separator) for word in words}}
+
+
+def transcript_variants(words: Iterable[str], languages: Iterable[str],
+                        strip_syllable_separator: bool=True) -> Dict[str, Dict[str, str]]:
+    """ Get the IPA transcriptions of each distinct word for several transcription methods.
+
+    Transcriptions from the offline index and the cache are reused, languages in batch_methods fetch
+    up to MAX_TITLES_PER_REQUEST words per request and languages reading the same page (e.g. british
+    and american) share it. Words without page or without transcription are remembered by the cache
+    as misses, words whose request failed are not.
+
+    :param words: words to transcribe
+    :param languages: names of the transcription methods
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: dictionary of languages, each with words and their IPA transcriptions
+    """
+    words = list(dict.fromkeys(words))
+    languages = list(dict.fromkeys(languages))
+    groups = {}
+    for language in languages:
+        shared_languages = next((group for group in shared_page_methods if language in group), (language,))
+        groups.setdefault(shared_languages, []).append(language)
+
+    result = {}
+    for group_languages in groups.values():
+        transcriptions = {}
+        for language in group_languages:
+            transcriptions[language] = (offline.get_many(language, words, strip_syllable_separator)
+                                        if offline is not None else {})
+            stats.count("lookups", len(words))
+            stats.count("offline hits", len(transcriptions[language]))
+            unknown = [word for word in words if word not in transcriptions[language]]
+            if cache is not None and unknown:
+                cached = cache.get_many(language, unknown, strip_syllable_separator)
+                transcriptions[language].update(cached)
+                unknown = [word for word in unknown if word not in transcriptions[language]]
+                misses = cache.get_misses(language, unknown, strip_syllable_separator)
+                for word in misses:
+                    transcriptions[language][word] = ""
+                stats.count("cache hits", len(cached))
+                stats.count("negative hits", len(misses))
+        missing = [word for word in words if any(word not in transcriptions[language] for language in group_languages)]
+        fetched = _fetch_transcriptions(missing, group_languages, strip_syllable_separator) if missing else {}
+        for language, language_transcriptions in fetched.items():
+            if cache is not None:
+                cache.set_many(language, {word: ipa for word, ipa in language_transcriptions.items() if ipa},
+                               strip_syllable_separator)
+                cache.set_misses(language, {word: PAGE_MISSING if ipa is None else NO_IPA
+                                            for word, ipa in language_transcriptions.items() if not ipa},
+                                 strip_syllable_separator)
+            fetched[language] = {word: ipa or "" for word, ipa in language_transcriptions.items()}
+        for language in group_languages:
+            result[language] = {**fetched.get(language, {}), **transcriptions[language]}
+    return result
+
+
+def transcript_words(words: Iterable[str], language: str, strip_syllable_separator: bool=True) -> Dict[str, str]:
+    """ Get the IPA transcription of each distinct word.
+
+    :param words: words to transcribe
+    :param language: name of the transcription method
+    :param strip_syllable_separator: whether syllable separators are removed
+    :return: dictionary of words and their IPA transcriptions
+    """
+    return transcript_variants(words, [language], strip_syllable_separator)[language]
+
+
+def transcript(words: List[str], language: str, strip_syllable_separator: bool=True) -> str:
+    transcriptions = transcript_words(words, language, strip_syllable_separator)
+    return " ".join(transcriptions[word] for word in words)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Prefetch IPA transcriptions while the user is typing
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import logging
+from concurrent.futures import Future
+
+from typing import Optional
+
+import aqt.qt as qt
+from aqt import mw
+from aqt.editor import Editor
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Warm the transcription cache for the word field of an editor in the background."""
+
+    def __init__(self, editor: Editor, word_field: str, strip_syllable_separator: bool, delay: int = 800) -> None:
+        """ Initialize Prefetcher.
+
+        :param editor: Anki editor window
+        :param word_field: field which contains the words to transcribe
+        :param strip_syllable_separator: whether syllable separators are removed
+        :param delay: milliseconds without typing before the words are looked up
+        """
+        self.editor = editor
+        self.word_field = word_field
+        self.strip_syllable_separator = strip_syllable_separator
+        self.delay = delay
+        self._timer = qt.QTimer(editor.widget)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._start)
+        self._text: Optional[str] = None
+        self._note = None
+        self._generation = 0
+        self._running = False
+        # network.CancelToken of the running prefetch
+        self._token = None
+
+    def on_bridge_cmd(self, command: str) -> None:
+        """ Schedule a prefetch when the word field has been edited or left.
+
+        :param command: editor command, e.g. key:<field ord>:<note id>:<field html>
+        """
+        if not command.startswith(("key:", "blur:")) or self.editor.note is None:
+            return
+        kind, field_ord, _, text = command.split(":", 3)
+        field_names = self.editor.note.keys()
+        if self.word_field not in field_names or int(field_ord) != field_names.index(self.word_field):
+            return
+        self._text = text
+        self._note = self.editor.note
+        self._supersede()
+        # debounce typing, leaving the field starts right away
+        self._timer.start(0 if kind == "blur" else self.delay)
+
+    def cancel(self) -> None:
+        """Drop the scheduled prefetch and abort the requests of a running one."""
+        self._timer.stop()
+        self._text = None
+        self._supersede()
+
+    def _supersede(self) -> None:
+        """Newer input or another note make the running prefetch useless, its requests are aborted."""
+        self._generation += 1
+        if self._token is not None:
+            self._token.cancel()
+
+    def _start(self) -> None:
+        """Look up the words of the latest field text unless a prefetch is running already."""
+        if self._running or self._text is None:
+            return
+        if self.editor.note is not self._note:
+            self._text = None
+            return
+        words = utils.get_words_from_field(self._text.lower())
+        language = self.editor.ipa_lang_alias
+        generation = self._generation
+        self._text = None
+        if not words or not language:
+            return
+        # the first prefetch sets up the transcription modules, which needs the main thread
+        from .main import network, parse_ipa_transcription
+        token = self._token = network.CancelToken()
+
+        def prefetch() -> None:
+            # superseded by newer input before it could start
+            if generation != self._generation:
+                return
+            with network.cancel_scope(token):
+                parse_ipa_transcription.transcript_words(words, language, self.strip_syllable_separator)
+
+        self._running = True
+        mw.taskman.run_in_background(prefetch, self._on_done)
+
+    def _on_done(self, future: Future) -> None:
+        self._running = False
+        self._token = None
+        try:
+            future.result()
+        # prefetching is only speculative, the IPA button reports errors
+        except Exception as e:
+            logger.debug(f"IPA prefetch failed: {e}")
+        # only one prefetch per editor at a time, continue with text typed in the meantime
+        if self._text is not None:
+            self._timer.start(0)
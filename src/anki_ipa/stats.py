@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Timings and counters of the transcription hot path
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from typing import Dict, Iterator, List
+
+# Upper bounds of the request latency histogram buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stages whose time is measured
+HTTP_WAIT = "http wait"
+PARSE = "html parse"
+REGEX = "regex extraction"
+WRITE_BACK = "write-back"
+BATCH = "batch"
+
+
+class Stats:
+    """Thread-safe collection of stage timings, counters and per-host latency histograms."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self.timings: Dict[str, List[float]] = {}  # stage -> [total seconds, count]
+            self.counters: Dict[str, int] = {}
+            self.latencies: Dict[str, List[int]] = {}  # host -> count per bucket
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            timing = self.timings.setdefault(stage, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure the time spent in a block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_latency(self, host: str, seconds: float) -> None:
+        """ Record the time until a host answered a request.
+
+        :param host: host name (e.g. en.wiktionary.org)
+        :param seconds: time between sending the request and receiving the whole response
+        """
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            histogram = self.latencies.setdefault(host, [0] * (len(LATENCY_BUCKETS) + 1))
+            histogram[bucket] += 1
+        self.add_time(HTTP_WAIT, seconds)
+
+    def hit_rate(self, source: str) -> float:
+        """Share of the word lookups answered by a source (offline index, cache or negative cache)."""
+        lookups = self.counters.get("lookups", 0)
+        return self.counters.get(f"{source} hits", 0) / lookups if lookups else 0.0
+
+    def snapshot(self) -> dict:
+        """Machine-readable copy of all values."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "timings": {stage: {"seconds": total, "count": count} for stage, (total, count) in self.timings.items()},
+                "counters": dict(self.counters),
+                "latency_buckets": list(LATENCY_BUCKETS) + ["inf"],
+                "latencies": {host: list(histogram) for host, histogram in self.latencies.items()},
+            }
+
+    def summary(self) -> str:
+        """Human-readable summary for the end of a batch."""
+        data = self.snapshot()
+        lines = [f"{stage}: {timing['seconds']:.2f} s ({timing['count']}x)" for stage, timing in data["timings"].items()]
+        counters = data["counters"]
+        if counters.get("lookups"):
+            lines.append(f"word lookups: {counters['lookups']} (offline {self.hit_rate('offline'):.0%}, "
+                         f"cache {self.hit_rate('cache'):.0%}, known misses {self.hit_rate('negative'):.0%})")
+        if counters.get("requests"):
+            lines.append(f"requests: {counters['requests']}, {counters.get('bytes', 0) / 1024:.0f} KiB received")
+        for host, histogram in data["latencies"].items():
+            median = _percentile(histogram, 0.5)
+            lines.append(f"{host}: {sum(histogram)} requests, median latency <= {median}")
+        return "\n".join(lines)
+
+    def write(self, path: str) -> None:
+        """Write the values as JSON file, the file is replaced atomically."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def _percentile(histogram: List[int], share: float) -> str:
+    """Upper bound of the bucket containing the percentile."""
+    total, seen = sum(histogram), 0
+    for bound, count in zip(list(LATENCY_BUCKETS) + [float("inf")], histogram):
+        seen += count
+        if seen >= share * total:
+            return f"{bound:g} s"
+    return "inf"
+
+
+# Statistics of the running add-on, reset at the start of each batch
+stats = Stats()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test the journal of batch jobs
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import os
+import tempfile
+import unittest
+
+from batch_jobs import JobJournal
+
+
+class TestJobJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "batch_jobs.sqlite")
+        self.journal = JobJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp_dir.cleanup()
+
+    def reopen(self):
+        self.journal.close()
+        self.journal = JobJournal(self.path)
+
+    def test_resume(self):
+        job = self.journal.create("Front", {"french": "IPA"})
+        self.assertEqual(self.journal.start(job.id, [3, 1, 2, 4]), [3, 1, 2, 4])
+        self.journal.record(job.id, {1: {"IPA": "paʁ.le"}, 2: {"IPA": "mɑ̃.ʒe"}})
+        self.journal.mark_done(job.id, [1, 4])
+
+        # Anki crashed before note 2 was written
+        self.reopen()
+        interrupted = self.journal.unfinished()
+        self.assertEqual((interrupted.id, interrupted.targets), (job.id, {"french": "IPA"}))
+        self.assertEqual(self.journal.progress(job.id), (3, 4))
+        self.assertEqual(self.journal.outstanding(job.id, [4, 3, 2, 1]), [3])
+        self.assertEqual(self.journal.unwritten(job.id), {2: {"IPA": "mɑ̃.ʒe"}})
+        self.assertEqual(self.journal.start(job.id, self.journal.notes(job.id)), [3])
+
+        self.journal.mark_done(job.id, [2, 3])
+        self.journal.finish(job.id)
+        self.assertIsNone(self.journal.unfinished())
+        # finished jobs without name are removed
+        self.assertEqual(self.journal.notes(job.id), [])
+
+    def test_finish_before_written(self):
+        job = self.journal.create("Front", {"french": "IPA"})
+        self.journal.start(job.id, [1])
+        self.journal.record(job.id, {1: {"IPA": "paʁ.le"}})
+        self.journal.finish(job.id)
+        self.assertEqual(self.journal.unfinished().id, job.id)
+
+    def test_saved_job(self):
+        job = self.journal.create("Front", {"british": "IPA"}, name="nightly", search="deck:English")
+        self.journal.start(job.id, [1, 2])
+        self.journal.mark_done(job.id, [1, 2])
+        self.journal.finish(job.id)
+        self.assertIsNone(self.journal.unfinished())
+
+        # the search finds a new note when the job runs again
+        same_job = self.journal.create("Front", {"british": "IPA"}, name="nightly", search="deck:English")
+        self.assertEqual(same_job.id, job.id)
+        self.assertEqual([saved.name for saved in self.journal.saved()], ["nightly"])
+        self.assertEqual(self.journal.start(job.id, [1, 2, 3]), [3])
+
+    def test_discard(self):
+        job = self.journal.create("Front", {"french": "IPA"})
+        self.journal.start(job.id, [1, 2])
+        self.journal.record(job.id, {1: {"IPA": "paʁ.le"}})
+        self.journal.discard(job.id)
+        self.assertIsNone(self.journal.unfinished())
+        self.assertEqual(self.journal.notes(job.id), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test batch transcription
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import unittest
+from unittest import mock
+
+import batch_transcriber
+from batch_transcriber import NoteSnapshot
+
+
+def fake_transcript_variants(words, languages, strip_syllable_separator=True):
+    return {language: {word: word.upper() for word in words if word != "unknown"} | {"unknown": ""}
+            for language in languages}
+
+
+class TestBatchTranscriber(unittest.TestCase):
+
+    def test_dedup(self):
+        notes = [
+            NoteSnapshot(1, "la casa"),
+            NoteSnapshot(2, "la <b>casa</b>"),
+            NoteSnapshot(3, "la casa"),
+            NoteSnapshot(4, "unknown"),
+            NoteSnapshot(5, ""),
+        ]
+        transcriber = batch_transcriber.BatchTranscriber(notes, ["spanish"], chunk_size=2)
+        progress, chunks, not_found = [], [], []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants",
+                               side_effect=fake_transcript_variants) as transcript_variants:
+            transcriber.run(on_progress=progress.append, on_chunk=chunks.append, on_not_found=not_found.extend)
+
+        self.assertEqual(transcript_variants.call_count, 1)
+        self.assertEqual(sorted(transcript_variants.call_args[0][0]), ["casa", "la", "unknown"])
+        self.assertEqual((transcriber.word_count, transcriber.distinct_word_count), (7, 3))
+        self.assertAlmostEqual(transcriber.dedup_ratio, 4 / 7)
+        self.assertEqual(progress[-1], 5)
+        self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+        result = {note_id: ipa for chunk in chunks for note_id, ipa in chunk.items()}
+        self.assertEqual(result, {1: {"spanish": "LA CASA"}, 2: {"spanish": "LA CASA"}, 3: {"spanish": "LA CASA"}})
+        self.assertEqual(sorted(not_found), [4, 5])
+
+    def test_pages(self):
+        notes = [NoteSnapshot(1, "la casa"), NoteSnapshot(2, "la casa"), NoteSnapshot(3, "la mesa")]
+        transcriber = batch_transcriber.BatchTranscriber(notes, ["spanish"], page_size=2)
+        chunks = []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants",
+                               side_effect=fake_transcript_variants) as transcript_variants:
+            transcriber.run(on_progress=lambda done: None, on_chunk=chunks.append)
+
+        # words are only deduplicated within a page
+        self.assertEqual([sorted(call[0][0]) for call in transcript_variants.call_args_list],
+                         [["casa", "la"], ["la", "mesa"]])
+        self.assertEqual((transcriber.note_count, transcriber.word_count, transcriber.distinct_word_count), (3, 6, 4))
+        result = {note_id: ipa for chunk in chunks for note_id, ipa in chunk.items()}
+        self.assertEqual(result[3], {"spanish": "LA MESA"})
+
+    def test_malformed_answer(self):
+        notes = [NoteSnapshot(1, "a"), NoteSnapshot(2, "b")]
+        transcriber = batch_transcriber.BatchTranscriber(notes, ["fake"], max_workers=1)
+
+        def malformed_a(words, languages, strip_syllable_separator=True):
+            if words == ["a"]:
+                raise KeyError("parse")
+            return fake_transcript_variants(words, languages)
+
+        chunks, not_found = [], []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants",
+                               side_effect=malformed_a):
+            transcriber.run(on_progress=lambda done: None, on_chunk=chunks.append, on_not_found=not_found.extend)
+
+        # the note is skipped, not remembered as not found
+        self.assertEqual(chunks, [{2: {"fake": "B"}}])
+        self.assertEqual(not_found, [])
+        self.assertEqual(transcriber.skipped, {1: "malformed answer"})
+
+    def test_timeout(self):
+        notes = [NoteSnapshot(1, "a"), NoteSnapshot(2, "b"), NoteSnapshot(3, "c")]
+        transcriber = batch_transcriber.BatchTranscriber(notes, ["fake"], max_workers=1)
+        timeouts = {"a": 1, "b": 2}
+
+        def slow(words, languages, strip_syllable_separator=True):
+            if timeouts.get(words[0]):
+                timeouts[words[0]] -= 1
+                raise batch_transcriber.requests.exceptions.ReadTimeout()
+            return fake_transcript_variants(words, languages)
+
+        chunks = []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants", side_effect=slow):
+            transcriber.run(on_progress=lambda done: None, on_chunk=chunks.append)
+
+        # a is looked up again, b times out twice and is skipped, the batch goes on with c
+        result = {note_id: ipa for chunk in chunks for note_id, ipa in chunk.items()}
+        self.assertEqual(result, {1: {"fake": "A"}, 3: {"fake": "C"}})
+        self.assertEqual(transcriber.skipped, {2: "Wiktionary timed out"})
+
+    def test_cancel(self):
+        notes = [NoteSnapshot(1, "a"), NoteSnapshot(2, "b"), NoteSnapshot(3, "c")]
+        # one word per lookup, one lookup at a time
+        transcriber = batch_transcriber.BatchTranscriber(notes, ["fake"], max_workers=1)
+
+        def cancel_after_first(words, languages, strip_syllable_separator=True):
+            transcriber.cancel()
+            return fake_transcript_variants(words, languages)
+
+        chunks = []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants",
+                               side_effect=cancel_after_first) as transcript_variants:
+            transcriber.run(on_progress=lambda done: None, on_chunk=chunks.append)
+
+        self.assertEqual(transcript_variants.call_count, 1)
+        self.assertEqual(chunks, [{1: {"fake": "A"}}])
+        self.assertEqual(transcriber.skipped, {2: "cancelled", 3: "cancelled"})
+
+    def test_cancel_stops_paging(self):
+        read = []
+
+        def notes():
+            for note_id, text in enumerate(["a", "b", "c", "d"], start=1):
+                read.append(note_id)
+                yield NoteSnapshot(note_id, text)
+
+        transcriber = batch_transcriber.BatchTranscriber(notes(), ["fake"], max_workers=1, page_size=2)
+
+        def cancel_after_first(words, languages, strip_syllable_separator=True):
+            transcriber.cancel()
+            return fake_transcript_variants(words, languages)
+
+        chunks = []
+        with mock.patch.object(batch_transcriber.parse_ipa_transcription, "transcript_variants",
+                               side_effect=cancel_after_first):
+            transcriber.run(on_progress=lambda done: None, on_chunk=chunks.append)
+
+        # the rest of the first page is skipped, the second page isn't read
+        self.assertEqual(read, [1, 2])
+        self.assertEqual(chunks, [{1: {"fake": "A"}}])
+        self.assertEqual(transcriber.skipped, {2: "cancelled"})
+
+
+if __name__ == "__main__":
+    unittest.main()
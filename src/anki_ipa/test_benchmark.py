@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test the offline benchmarks
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import benchmark
+import consts
+import network
+import parse_ipa_transcription
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        limits = network.max_connections_per_host, network.max_requests_per_second
+        results = benchmark.run(benchmark.load_fixtures(), latency=0, repeats=1, note_count=20, workers=[2],
+                                throughput_languages=["british"])
+        # the limits meant for Wiktionary are back in place
+        self.assertEqual((network.max_connections_per_host, network.max_requests_per_second), limits)
+        self.assertEqual(set(results["languages"]), set(consts.LANGUAGES_MAP.values()))
+        for language, result in results["languages"].items():
+            # all fixture words are found, only the missing word is not
+            self.assertEqual(result["found"], result["words"] - 1, language)
+        self.assertEqual(results["throughput"]["british"]["2"]["transcribed"], 20)
+
+    @mock.patch.object(parse_ipa_transcription, "cache", None)
+    @mock.patch.object(parse_ipa_transcription, "offline", None)
+    def test_record_fixtures(self):
+        fixtures = benchmark.load_fixtures()
+        words = {host: list(fixture["wikitexts"]) + ["missing_word"] for host, fixture in fixtures.items()}
+        server = benchmark.FixtureServer(fixtures)
+        server.start()
+        server.redirect()
+        try:
+            expected = {language: parse_ipa_transcription.transcript_words(words[host], language)
+                        for language, host in parse_ipa_transcription.WIKIS.items()}
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # recorded from the stand-in server instead of Wiktionary
+                benchmark.record_fixtures(words, tmp_dir, network.LiveTransport())
+                recorded = benchmark.load_fixtures(tmp_dir)
+        finally:
+            network.redirects.clear()
+            network.close_sessions()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(set(recorded), set(fixtures))
+        self.assertTrue(all("recorded" in fixture for fixture in recorded.values()))
+        self.assertEqual(set(recorded["fr.wiktionary.org"]["wikitexts"]),
+                         set(fixtures["fr.wiktionary.org"]["wikitexts"]))
+
+        # the recorded pages give the same transcriptions
+        server = benchmark.FixtureServer(recorded)
+        server.start()
+        server.redirect()
+        try:
+            for language, host in parse_ipa_transcription.WIKIS.items():
+                self.assertEqual(parse_ipa_transcription.transcript_words(words[host], language), expected[language],
+                                 language)
+        finally:
+            network.redirects.clear()
+            network.close_sessions()
+            server.shutdown()
+            server.server_close()
+
+    def test_compare(self):
+        previous = {"languages": {"french": {"latency_ms": 50, "bytes_per_word": 100}},
+                    "throughput": {"british": {"4": {"notes_per_second": 1000}}}}
+        current = {"languages": {"french": {"latency_ms": 80, "bytes_per_word": 105}},
+                   "throughput": {"british": {"4": {"notes_per_second": 500}}}}
+        regressions = benchmark.compare(previous, current)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("french latency_ms"))
+        self.assertEqual(benchmark.compare(previous, previous), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test transcription cache
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import cache
+import parse_ipa_transcription
+
+
+class TestTranscriptionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "transcriptions.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_set(self):
+        transcription_cache = cache.TranscriptionCache(self.path)
+        transcription_cache.set("british", "dog", True, "dɒɡ")
+        self.assertEqual(transcription_cache.get("british", "dog", True), "dɒɡ")
+        self.assertIsNone(transcription_cache.get("british", "dog", False))
+        self.assertIsNone(transcription_cache.get("american", "dog", True))
+        transcription_cache.close()
+
+        # cache survives reopening
+        transcription_cache = cache.TranscriptionCache(self.path)
+        self.assertEqual(transcription_cache.get_many("british", ["dog", "cat"], True), {"dog": "dɒɡ"})
+        transcription_cache.close()
+
+    def test_ttl(self):
+        transcription_cache = cache.TranscriptionCache(self.path, ttl=0.05)
+        transcription_cache.set("german", "rot", True, "ʁoːt")
+        self.assertEqual(transcription_cache.get("german", "rot", True), "ʁoːt")
+        time.sleep(0.1)
+        self.assertIsNone(transcription_cache.get("german", "rot", True))
+        transcription_cache.close()
+
+    def test_lru_eviction(self):
+        transcription_cache = cache.TranscriptionCache(self.path, max_entries=2)
+        transcription_cache.set_many("german", {"rot": "ʁoːt", "blau": "blaʊ̯"}, True)
+        time.sleep(0.01)
+        transcription_cache.get("german", "rot", True)
+        transcription_cache.set("german", "gelb", True, "ɡɛlp")
+        transcription_cache.evict()
+        self.assertEqual(len(transcription_cache), 2)
+        self.assertIsNone(transcription_cache.get("german", "blau", True))
+        self.assertEqual(transcription_cache.get("german", "rot", True), "ʁoːt")
+        transcription_cache.close()
+
+    def test_misses(self):
+        transcription_cache = cache.TranscriptionCache(self.path, negative_ttl=0.05)
+        transcription_cache.set_misses("german", {"xyz": "page missing", "Bonn": "no IPA"}, True)
+        self.assertEqual(transcription_cache.get_misses("german", ["xyz", "Bonn", "rot"], True),
+                         {"xyz": "page missing", "Bonn": "no IPA"})
+        self.assertEqual(transcription_cache.get_misses("german", ["xyz"], False), {})
+        # a transcription found later replaces the miss
+        transcription_cache.set("german", "Bonn", True, "bɔn")
+        self.assertEqual(transcription_cache.get_misses("german", ["xyz", "Bonn"], True), {"xyz": "page missing"})
+        time.sleep(0.1)
+        self.assertEqual(transcription_cache.get_misses("german", ["xyz"], True), {})
+        transcription_cache.close()
+
+
+class TestTranscriptCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = cache.TranscriptionCache(os.path.join(self.tmp_dir.name, "transcriptions.sqlite"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_transcript(self):
+        requested = []
+
+        def lookup(word, strip_syllable_separator):
+            requested.append(word)
+            return "dɒɡ"
+
+        with mock.patch.dict(parse_ipa_transcription.transcription_methods, {"lookup": lookup}), \
+                mock.patch.object(parse_ipa_transcription, "cache", self.cache):
+            # the cache is still empty (and falsy) on the first lookup
+            self.assertEqual(parse_ipa_transcription.transcript(["dog"], "lookup"), "dɒɡ")
+            self.assertEqual(parse_ipa_transcription.transcript(["dog"], "lookup"), "dɒɡ")
+        self.assertEqual(requested, ["dog"])
+        self.assertEqual(self.cache.get("lookup", "dog", True), "dɒɡ")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test the command line transcription
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import io
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+import benchmark
+import cli
+import network
+import parse_ipa_transcription
+
+
+@mock.patch.object(parse_ipa_transcription, "cache", None)
+@mock.patch.object(parse_ipa_transcription, "offline", None)
+class TestCli(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = benchmark.FixtureServer(benchmark.load_fixtures(), aliases=True)
+        cls.server.start()
+        cls.server.redirect()
+
+    @classmethod
+    def tearDownClass(cls):
+        network.redirects.clear()
+        network.close_sessions()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def transcribe(self, text, **kwargs):
+        out = io.StringIO()
+        progress = cli.Progress(io.StringIO())
+        cli.run(io.StringIO(text), out, progress=progress, **kwargs)
+        return out.getvalue().splitlines(), progress
+
+    def test_words(self):
+        words = [f"word{i}" for i in range(50)] + ["missing_word", "", "word1 word2"]
+        lines, progress = self.transcribe("\n".join(words) + "\n", language="british", max_workers=4, window=7)
+        # input order is kept although only a few rows are read ahead
+        self.assertEqual([line.split("\t")[0] for line in lines], words)
+        self.assertTrue(all(line.split("\t")[1] for line in lines[:50]))
+        self.assertEqual(lines[50], "missing_word\t")
+        self.assertEqual(len(lines[-1].split("\t")[1].split()), 2)
+        self.assertEqual((progress.rows, progress.found, progress.failed), (53, 51, 0))
+
+    def test_csv(self):
+        lines, _ = self.transcribe("id,Front\n1,parler\n2,missing_word\n", language="french", input_format="csv",
+                                   column="Front")
+        self.assertEqual(lines[0], "id,Front,IPA")
+        self.assertTrue(lines[1].startswith("1,parler,") and len(lines[1]) > len("1,parler,"))
+        self.assertEqual(lines[2], "2,missing_word,")
+
+    def test_malformed_answer(self):
+        transcript_variants = parse_ipa_transcription.transcript_variants
+
+        def malformed(words, languages, strip_syllable_separator=True):
+            if "parler" in words:
+                raise KeyError("query")
+            return transcript_variants(words, languages, strip_syllable_separator)
+
+        with mock.patch.object(parse_ipa_transcription, "transcript_variants", side_effect=malformed):
+            lines, progress = self.transcribe("manger\nparler\nmanger\n", language="french", window=1)
+        # one row per page and lookup, the row is reported like in the batch dialog, the others are written
+        self.assertEqual([line.split("\t")[0] for line in lines], ["manger", "parler", "manger"])
+        self.assertEqual(lines[1], "parler\t")
+        self.assertTrue(lines[0].split("\t")[1])
+        self.assertEqual((progress.rows, progress.failed), (3, 1))
+        self.assertIn("malformed answer", progress.stream.getvalue())
+
+    def test_no_anki(self):
+        code = "import sys, cli; sys.exit('aqt' in sys.modules or 'anki' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", code]).returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test the fingerprints of transcribed notes
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fingerprints import FingerprintIndex, NoteFields, fingerprint
+
+
+class TestFingerprintIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index = FingerprintIndex(os.path.join(self.tmp_dir.name, "fingerprints.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp_dir.cleanup()
+
+    def test_changed(self):
+        targets = {"british": "IPA"}
+        self.index.set_many({1: {"IPA": fingerprint("british", "house")},
+                             2: {"IPA": fingerprint("british", "mouse")},
+                             3: {"IPA": fingerprint("british", "home")}})
+        self.index.set_many({4: {"IPA": fingerprint("british", "xyzzy")}}, found=False)
+        notes = [
+            NoteFields(1, "house", {"IPA": "haʊs"}),
+            NoteFields(2, "mice", {"IPA": "maʊs"}),  # word field edited
+            NoteFields(3, "home", {"IPA": ""}),  # IPA field emptied
+            NoteFields(4, "xyzzy", {"IPA": ""}),  # nothing found last time
+            NoteFields(5, "new", {"IPA": ""}),
+        ]
+        unchanged = []
+        changed = list(self.index.changed(notes, targets, on_unchanged=unchanged.append))
+        self.assertEqual([note.note_id for note, _ in changed], [2, 3, 5])
+        self.assertEqual(changed[0][1], {"IPA": fingerprint("british", "mice")})
+        self.assertEqual(unchanged, [[1, 4]])
+
+        # another language is another fingerprint
+        changed = list(self.index.changed(notes, {"american": "IPA"}))
+        self.assertEqual(len(changed), 5)
+
+        # so are other settings
+        changed = list(self.index.changed(notes, targets, strip_syllable_separator=False))
+        self.assertEqual(len(changed), 5)
+        changed = list(self.index.changed(notes, {"british": "IPA", "american": "American IPA"}))
+        self.assertEqual(len(changed), 5)
+
+    def test_expired_misses(self):
+        index = FingerprintIndex(os.path.join(self.tmp_dir.name, "misses.sqlite"), negative_ttl=60)
+        self.addCleanup(index.close)
+        index.set_many({1: {"IPA": fingerprint("british", "xyzzy")}}, found=False)
+        notes = [NoteFields(1, "xyzzy", {"IPA": ""})]
+        self.assertEqual(list(index.changed(notes, {"british": "IPA"})), [])
+        # Wiktionary is asked again once the miss has expired
+        with mock.patch.object(time, "time", return_value=time.time() + 61):
+            self.assertEqual(len(list(index.changed(notes, {"british": "IPA"}))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test the HTML extraction and the parse pool
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import unittest
+from unittest import mock
+
+import benchmark
+import html_parsing
+import network
+import parse_ipa_transcription
+
+FRENCH = {'title': 'Prononciation API'}
+
+
+class TestHtmlParsing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.article = benchmark.load_fixtures()["fr.wiktionary.org"]["articles"]["parler"].encode("utf-8")
+
+    def test_extract_spans(self):
+        transcriptions = html_parsing.extract_spans(self.article, "utf-8", FRENCH, True)
+        self.assertIn("paʁle", transcriptions)
+        self.assertEqual(transcriptions, sorted(set(transcriptions)))
+
+    def test_extract_rendered(self):
+        html = '<div class="anki-ipa-0"><span class="IPA">[a]</span></div><div class="anki-ipa-2"></div>'
+        self.assertEqual(html_parsing.extract_rendered(html, 3, {'class': 'IPA'}), [["[a]"], [], []])
+
+    def test_pool(self):
+        pool = html_parsing.ParsePool(2)
+        try:
+            self.assertEqual(pool.run("extract_spans", self.article, "utf-8", FRENCH, True),
+                             html_parsing.extract_spans(self.article, "utf-8", FRENCH, True))
+        finally:
+            pool.shutdown()
+
+    def test_pool_needs_interpreter(self):
+        with mock.patch.object(html_parsing.sys, "executable", "/Applications/Anki.app/Contents/MacOS/anki"):
+            self.assertIsNone(html_parsing.python_interpreter())
+            with self.assertRaises(RuntimeError):
+                html_parsing.ParsePool(2)
+
+    @mock.patch.object(parse_ipa_transcription, "cache", None)
+    @mock.patch.object(parse_ipa_transcription, "offline", None)
+    def test_parse_website(self):
+        server = benchmark.FixtureServer(benchmark.load_fixtures(), aliases=True)
+        server.start()
+        server.redirect()
+        try:
+            words = ["parler", "manger"]
+            expected = parse_ipa_transcription.transcript_words(words, "french")
+            with mock.patch.object(parse_ipa_transcription, "parse_pool", html_parsing.ParsePool(2)) as pool:
+                self.assertEqual(parse_ipa_transcription.transcript_words(words, "french"), expected)
+                pool.shutdown()
+        finally:
+            network.redirects.clear()
+            network.close_sessions()
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test shared HTTP sessions
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import http.server
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import network
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """Answers with the client port, which shows whether a connection has been reused."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = str(self.client_address[1]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessions(unittest.TestCase):
+
+    def tearDown(self):
+        network.close_sessions()
+
+    def test_shared_session(self):
+        session = network.get_session("en.wiktionary.org")
+        self.assertIs(network.get_session("en.wiktionary.org"), session)
+        self.assertIsNot(network.get_session("fr.wiktionary.org"), session)
+
+    def test_bounded_pool(self):
+        adapter = network.get_session("en.wiktionary.org").get_adapter("https://en.wiktionary.org/")
+        # threads wait for a free connection instead of opening more than max_connections_per_host
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter._pool_maxsize, network.max_connections_per_host)
+
+    def test_keep_alive(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/"
+            ports = {network.get(url).text for _ in range(3)}
+            self.assertEqual(len(ports), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class StalledHandler(http.server.BaseHTTPRequestHandler):
+    """Sends the headers and the first byte of the body, then stalls."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "100")
+        self.end_headers()
+        self.wfile.write(b"x")
+        self.wfile.flush()
+        time.sleep(2)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCancellation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StalledHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        network.close_sessions()
+
+    def get(self, token):
+        start = time.monotonic()
+        with self.assertRaises(network.Cancelled) as context:
+            with network.cancel_scope(token):
+                network.get(self.url)
+        self.assertLess(time.monotonic() - start, 1)
+        return str(context.exception)
+
+    def test_cancel(self):
+        token = network.CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        self.assertEqual(self.get(token), "cancelled")
+
+    def test_deadline(self):
+        self.assertEqual(self.get(network.CancelToken(deadline=0.2)), "deadline exceeded")
+
+    def test_cancelled_before(self):
+        token = network.CancelToken()
+        token.cancel()
+        self.assertEqual(self.get(token), "cancelled")
+
+
+class ThrottlingHandler(http.server.BaseHTTPRequestHandler):
+    """Answers with the next status code of the server's list, 200 once the list is empty."""
+
+    def do_GET(self):
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@mock.patch.object(network, "BACKOFF_BASE", 0.01)
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        network.close_sessions()
+
+    def test_retry(self):
+        self.server.statuses = [429, 503]
+        response = network.get(self.url)
+        self.assertEqual((response.status_code, response.text), (200, "ok"))
+        limiter = network.get_limiter(f"127.0.0.1:{self.server.server_port}")
+        self.assertLess(limiter.rate, network.max_requests_per_second)
+
+    def test_give_up(self):
+        self.server.statuses = [503] * (network.max_retries + 1)
+        with self.assertRaises(requests.HTTPError):
+            network.get(self.url)
+        self.assertEqual(self.server.statuses, [])
+
+    def test_retry_after(self):
+        response = requests.Response()
+        response.headers["Retry-After"] = "30"
+        self.assertEqual(network.retry_after(response), 30)
+        # the wait is capped at the maximum backoff
+        response.headers["Retry-After"] = "3600"
+        self.assertEqual(network.retry_after(response), network.BACKOFF_MAX)
+        response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.assertEqual(network.retry_after(response), 0)
+        response.headers["Retry-After"] = "soon"
+        self.assertIsNone(network.retry_after(response))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_states(self):
+        breaker = network.CircuitBreaker("fr.wiktionary.org")
+        with mock.patch.object(network, "failure_threshold", 2), mock.patch.object(network, "cooldown", 0.1):
+            for _ in range(2):
+                breaker.before_request()
+                breaker.on_failure()
+            self.assertEqual(breaker.state, breaker.OPEN)
+            with self.assertRaises(network.SourceUnavailable):
+                breaker.before_request()
+
+            time.sleep(0.1)
+            # a single probe is let through
+            breaker.before_request()
+            self.assertEqual(breaker.state, breaker.HALF_OPEN)
+            with self.assertRaises(network.SourceUnavailable):
+                breaker.before_request()
+            breaker.on_failure()
+            self.assertEqual(breaker.state, breaker.OPEN)
+
+            time.sleep(0.1)
+            breaker.before_request()
+            breaker.on_success()
+            self.assertEqual(breaker.state, breaker.CLOSED)
+            breaker.before_request()
+
+    def test_unreachable_host(self):
+        # nothing listens on the discard port
+        url = "http://127.0.0.1:9/"
+        with mock.patch.object(network, "failure_threshold", 2):
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    network.get(url)
+            with self.assertRaises(network.SourceUnavailable):
+                network.get(url)
+        network.close_sessions()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test offline word index
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import offline_index
+
+DUMP = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">
+  <page>
+    <title>charcoal</title>
+    <ns>0</ns>
+    <revision><text>* {{a|RP}} {{IPA|en|/ˈtʃɑː.kəʊl/}}
+* {{a|GA}} {{IPA|en|/ˈt͡ʃɑɹ.koʊl/}}</text></revision>
+  </page>
+  <page>
+    <title>Template:IPA</title>
+    <ns>10</ns>
+    <revision><text>{{IPA|en|/x/}}</text></revision>
+  </page>
+</mediawiki>
+"""
+
+
+class TestOfflineIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        words = {f"word{i}": f"ipa{i}" for i in range(1000)}
+        words.update({"grün": "ɡʁyːn", "spät": "ʃpɛːt", "Kind": "kɪnt", "kre.entsa": "kɾe.entsa"})
+        path = offline_index.index_path(self.tmp_dir.name, "german")
+        offline_index.write_index(path, words)
+
+        index = offline_index.OfflineIndex(path)
+        self.assertEqual(len(index), len(words))
+        for word, ipa in words.items():
+            self.assertEqual(index.get(word), ipa)
+        self.assertIsNone(index.get("kind"))
+        self.assertIsNone(index.get(""))
+        index.close()
+
+        indexes = offline_index.OfflineIndexes(self.tmp_dir.name)
+        self.assertEqual(indexes.get_many("german", ["kre.entsa", "rot"], True), {"kre.entsa": "kɾeentsa"})
+        self.assertEqual(indexes.get_many("french", ["rot"], True), {})
+        indexes.close()
+
+    def test_dump(self):
+        path = os.path.join(self.tmp_dir.name, "dump.xml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(DUMP)
+        transcriptions = offline_index.transcriptions_from_dump(path, ["british", "american"])
+        self.assertEqual(transcriptions, {"british": {"charcoal": "ˈtʃɑːkəʊl"}, "american": {"charcoal": "ˈt͡ʃɑɹkoʊl"}})
+
+    def test_wiktextract(self):
+        path = os.path.join(self.tmp_dir.name, "wiktextract.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"word": "спасибо", "lang_code": "ru", "sounds": [{"ipa": "[spɐˈsʲibə]"}]}) + "\n")
+            f.write(json.dumps({"word": "burst", "lang_code": "en", "sounds": [
+                {"ipa": "/bɝst/", "tags": ["US"]}, {"ipa": "/bɜːst/", "tags": ["UK"]}]}) + "\n")
+        transcriptions = offline_index.transcriptions_from_wiktextract(path, ["russian", "british", "american"])
+        self.assertEqual(transcriptions, {
+            "russian": {"спасибо": "spɐˈsʲibə"},
+            "british": {"burst": "bɜːst"},
+            "american": {"burst": "bɝst"},
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,8 +7,16 @@ Copyright: (c) 2019 m-rtin <https://github.com/m-rtin>
 License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
 """
 
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import benchmark
+import network
 import parse_ipa_transcription as parse_ipa
+from cache import TranscriptionCache
 
 
 class TestParseIpa(unittest.TestCase):
@@ -91,5 +99,113 @@ class TestParseIpa(unittest.TestCase):
         self.assertEqual(parse_ipa.dutch("wit"), "wit, wɪt, ʋɪt")
         self.assertEqual(parse_ipa.dutch("lucht"), "lʏxt")
 
+
+class TestWikitextBatching(unittest.TestCase):
+
+    def test_extraction(self):
+        wikitext = "* {{a|RP}} {{IPA|en|/ˈtʃɑː.kəʊl/}}\n* {{a|GA}} {{IPA|en|/ˈt͡ʃɑɹ.koʊl/}}"
+        self.assertEqual(parse_ipa.british_from_wikitext(wikitext, True), "ˈtʃɑːkəʊl")
+        self.assertEqual(parse_ipa.american_from_wikitext(wikitext, True), "ˈt͡ʃɑɹkoʊl")
+        self.assertEqual(parse_ipa.german_from_wikitext(":{{IPA}} {{Lautschrift|ʁoːt}}", True), "ʁoːt")
+        self.assertEqual(parse_ipa.british_from_wikitext(None, True), "")
+
+    def test_fetch_wikitexts(self):
+        words = [f"word{i}" for i in range(120)] + ["a_b"]
+
+        def get(url, params=None):
+            titles = params["titles"].split("|")
+            self.assertLessEqual(len(titles), parse_ipa.MAX_TITLES_PER_REQUEST)
+            data = {"query": {
+                "normalized": [{"from": t, "to": t.replace("_", " ")} for t in titles if "_" in t],
+                "pages": [
+                    {"title": t.replace("_", " "), "revisions": [{"slots": {"main": {"content": t.upper()}}}]}
+                    if t != "word3" else {"title": t, "missing": True}
+                    for t in titles
+                ],
+            }}
+            return mock.Mock(json=mock.Mock(return_value=data))
+
+        with mock.patch.object(parse_ipa.network, "get", side_effect=get) as network_get:
+            wikitexts = parse_ipa.fetch_wikitexts(parse_ipa.EN_API_URL, words)
+        self.assertEqual(network_get.call_count, 3)
+        self.assertEqual(wikitexts["word0"], "WORD0")
+        self.assertEqual(wikitexts["a_b"], "A_B")
+        self.assertNotIn("word3", wikitexts)
+
+    def test_english_variants(self):
+        wikitexts = {"charcoal": "* {{a|RP}} {{IPA|en|/ˈtʃɑː.kəʊl/}}\n* {{a|GA}} {{IPA|en|/ˈt͡ʃɑɹ.koʊl/}}"}
+        with mock.patch.object(parse_ipa, "fetch_wikitexts", return_value=wikitexts) as fetch_wikitexts:
+            transcriptions = parse_ipa.transcript_variants(["charcoal"], ["british", "american"])
+        self.assertEqual(fetch_wikitexts.call_count, 1)
+        self.assertEqual(transcriptions, {"british": {"charcoal": "ˈtʃɑːkəʊl"}, "american": {"charcoal": "ˈt͡ʃɑɹkoʊl"}})
+
+    def test_templates(self):
+        self.assertEqual(parse_ipa.french_templates("'''occasion''' {{pron|ɔ.ka.zjɔ̃|fr}}")[0], ["ɔ.ka.zjɔ̃"])
+        self.assertEqual(parse_ipa.polish_templates("{{wymowa}} {{IPA3|ˌastɛˈrɔjda}}")[0], ["ˌastɛˈrɔjda"])
+        self.assertEqual(parse_ipa.spanish_templates("{{pron-graf|fone=eteɾniˈðað}}"), (["eteɾniˈðað"], []))
+        self.assertEqual(parse_ipa.spanish_templates("{{pron-graf}}"), ([], ["{{pron-graf}}"]))
+
+    def test_transcript_from_templates(self):
+        wikitexts = {"спасибо": "=== Произношение ===\n{{transcription-ru|спаси́бо}}"}
+        html = '<div class="anki-ipa-0"><span class="IPA">[spɐˈsʲibə]</span></div>'
+        with mock.patch.object(parse_ipa, "fetch_wikitexts", return_value=wikitexts), \
+                mock.patch.object(parse_ipa.network, "post") as network_post:
+            network_post.return_value.json.return_value = {"parse": {"text": html}}
+            transcriptions = parse_ipa.transcript_russian(["спасибо", "нет"], True)
+        # no page for нет
+        self.assertEqual(transcriptions, {"спасибо": "spɐˈsʲibə", "нет": None})
+        self.assertIn("{{transcription-ru|спаси́бо}}", network_post.call_args[0][1]["text"])
+
+    @mock.patch.object(parse_ipa, "cache", None)
+    @mock.patch.object(parse_ipa, "offline", None)
+    def test_title_dependent_templates(self):
+        server = benchmark.FixtureServer(benchmark.load_fixtures())
+        server.start()
+        server.redirect()
+        try:
+            # {{pron-graf}} without fone is generated from the page title
+            self.assertEqual(parse_ipa.transcript_words(["agua", "hablar", "casa"], "spanish"),
+                             {"agua": "ˈaɣwa", "hablar": "aˈβlaɾ", "casa": "ˈkasa"})
+        finally:
+            network.redirects.clear()
+            network.close_sessions()
+            server.shutdown()
+            server.server_close()
+
+    def test_map_words(self):
+        token = network.CancelToken()
+        # all four calls have to run at the same time to pass the barrier
+        barrier = threading.Barrier(4, timeout=5)
+
+        def lookup(word):
+            barrier.wait()
+            self.assertIs(network.current_token(), token)
+            return word.upper()
+
+        with network.cancel_scope(token):
+            self.assertEqual(parse_ipa.map_words(lookup, ["a", "b", "c", "d"]), {"a": "A", "b": "B", "c": "C", "d": "D"})
+
+    def test_negative_cache(self):
+        wikitexts = {"Bonn": "== Bonn ==\n{{Aussprache}}", "rot": "{{IPA}} {{Lautschrift|ʁoːt}}"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transcription_cache = TranscriptionCache(os.path.join(tmp_dir, "transcriptions.sqlite"))
+            with mock.patch.object(parse_ipa, "cache", transcription_cache), \
+                    mock.patch.object(parse_ipa, "fetch_wikitexts", return_value=wikitexts) as fetch_wikitexts:
+                words = ["rot", "Bonn", "xyz"]
+                self.assertEqual(parse_ipa.transcript_words(words, "german"), {"rot": "ʁoːt", "Bonn": "", "xyz": ""})
+                self.assertEqual(transcription_cache.get_misses("german", words, True),
+                                 {"Bonn": parse_ipa.NO_IPA, "xyz": parse_ipa.PAGE_MISSING})
+                # misses and transcriptions are both served from the cache
+                self.assertEqual(parse_ipa.transcript_words(words, "german"), {"rot": "ʁoːt", "Bonn": "", "xyz": ""})
+                self.assertEqual(fetch_wikitexts.call_count, 1)
+
+                # failed requests are not remembered
+                fetch_wikitexts.side_effect = parse_ipa.requests.ConnectionError
+                with self.assertRaises(parse_ipa.requests.ConnectionError):
+                    parse_ipa.transcript_words(["blau"], "german")
+                self.assertEqual(transcription_cache.get_misses("german", ["blau"], True), {})
+            transcription_cache.close()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test that starting Anki doesn't load the transcription modules
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import ast
+import os
+import subprocess
+import sys
+import unittest
+
+ADDON_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the add-on may import when Anki starts, everything else is imported on first use
+STARTUP_IMPORTS = {"os", "time", "logging", "typing", "anki.hooks", "aqt", "aqt.browser", "aqt.editor",
+                   ".consts", ".config"}
+# Modules imported at the top of modules which are loaded before the first transcription
+HEAVY_IMPORTS = {"requests", "bs4", "sqlite3", ".parse_ipa_transcription", ".network", ".cache", ".main",
+                 ".batch_adding"}
+
+
+# Imports the add-on package with stand-ins for Anki, prints its import time, its budget and whether
+# heavy modules have been loaded
+STUBBED_IMPORT = """
+import importlib, json, sys, time, types
+
+def module(name, **attributes):
+    stub = types.ModuleType(name)
+    stub.__dict__.update(attributes)
+    sys.modules[name] = stub
+
+class Editor:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def onBridgeCmd(self, *args):
+        pass
+
+with open({config!r}, encoding="utf-8") as f:
+    config = json.load(f)
+module("anki")
+module("anki.hooks", addHook=lambda *args: None, wrap=lambda old, new, pos="after": old)
+module("aqt", mw=types.SimpleNamespace(addonManager=types.SimpleNamespace(getConfig=lambda name: config)))
+module("aqt.browser", Browser=type("Browser", (), {{}}))
+module("aqt.editor", Editor=Editor)
+sys.path.insert(0, {parent!r})
+start = time.perf_counter()
+addon = importlib.import_module({package!r})
+print(time.perf_counter() - start, addon.IMPORT_TIME_BUDGET)
+print(any(m in sys.modules for m in ("requests", "bs4", "sqlite3")))
+"""
+
+
+def top_level_imports(filename: str) -> set:
+    """Names of the modules imported at the top level of a module of the add-on."""
+    with open(os.path.join(ADDON_PATH, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    imports = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = "." * node.level + (node.module or "")
+            if module == ".":
+                imports.update(f".{alias.name}" for alias in node.names)
+            else:
+                imports.add(module)
+    return imports
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_init_imports(self):
+        self.assertLessEqual(top_level_imports("__init__.py"), STARTUP_IMPORTS)
+
+    def test_prefetch_imports(self):
+        self.assertFalse(top_level_imports("prefetch.py") & HEAVY_IMPORTS)
+
+    def test_light_modules_import_time(self):
+        # the add-on's own module imported by __init__ which can be imported without Anki
+        code = ("import sys, time; start = time.perf_counter(); import consts; "
+                "print(time.perf_counter() - start); "
+                "print(any(m in sys.modules for m in ('requests', 'bs4', 'sqlite3')))")
+        output = subprocess.run([sys.executable, "-c", code], cwd=ADDON_PATH, capture_output=True, text=True,
+                                check=True).stdout.split()
+        self.assertLess(float(output[0]), 0.05)
+        self.assertEqual(output[1], "False")
+
+    def test_addon_import_time(self):
+        code = STUBBED_IMPORT.format(config=os.path.join(ADDON_PATH, "config.json"),
+                                     parent=os.path.dirname(ADDON_PATH), package=os.path.basename(ADDON_PATH))
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                check=True).stdout.split()
+        import_time, budget = float(output[0]), float(output[1])
+        self.assertLess(import_time, budget)
+        self.assertEqual(output[2], "False")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test statistics
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_collect(self):
+        collected = stats.Stats()
+        with collected.timer(stats.PARSE):
+            pass
+        collected.add_latency("en.wiktionary.org", 0.07)
+        collected.add_latency("en.wiktionary.org", 0.2)
+        collected.add_latency("en.wiktionary.org", 30)
+        collected.count("lookups", 4)
+        collected.count("cache hits", 3)
+
+        snapshot = collected.snapshot()
+        self.assertEqual(snapshot["timings"][stats.PARSE]["count"], 1)
+        self.assertEqual(snapshot["timings"][stats.HTTP_WAIT]["count"], 3)
+        self.assertEqual(snapshot["latencies"]["en.wiktionary.org"], [0, 1, 1, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(collected.hit_rate("cache"), 0.75)
+        self.assertIn("cache 75%", collected.summary())
+        self.assertIn("median latency <= 0.25 s", collected.summary())
+
+        collected.reset()
+        self.assertEqual(collected.snapshot()["counters"], {})
+
+    def test_write(self):
+        collected = stats.Stats()
+        collected.count("requests")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "stats.json")
+            collected.write(path)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["counters"], {"requests": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Test recording, replaying and fault injection
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+import benchmark
+import network
+import parse_ipa_transcription
+import transport
+
+WORDS = ["parler", "manger", "missing_word"]
+
+
+@mock.patch.object(parse_ipa_transcription, "cache", None)
+@mock.patch.object(parse_ipa_transcription, "offline", None)
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "recording.jsonl")
+
+    def tearDown(self):
+        network.set_transport(None)
+        network.close_sessions()
+        self.tmp_dir.cleanup()
+
+    def record(self):
+        server = benchmark.FixtureServer(benchmark.load_fixtures(), aliases=True)
+        server.start()
+        server.redirect()
+        network.set_transport(transport.RecordingTransport(self.path, network.LiveTransport()))
+        try:
+            return parse_ipa_transcription.transcript_words(WORDS, "french")
+        finally:
+            network.redirects.clear()
+            server.shutdown()
+            server.server_close()
+
+    def test_record_replay(self):
+        recorded = self.record()
+        self.assertTrue(recorded["parler"])
+        self.assertEqual(recorded["missing_word"], "")
+
+        # nothing answers the requests anymore
+        network.set_transport(transport.ReplayTransport(self.path))
+        self.assertEqual(parse_ipa_transcription.transcript_words(WORDS, "french"), recorded)
+        with self.assertRaises(requests.ConnectionError):
+            network.get("https://fr.wiktionary.org/wiki/unknown")
+
+    @mock.patch.object(network, "BACKOFF_BASE", 0.01)
+    def test_faults(self):
+        self.record()
+        replay = transport.ReplayTransport(self.path)
+
+        network.set_transport(transport.FaultInjectingTransport(replay, error_rate=1))
+        with self.assertRaises(requests.ConnectionError):
+            parse_ipa_transcription.transcript_words(WORDS, "french")
+        network.close_sessions()
+
+        network.set_transport(transport.FaultInjectingTransport(replay, throttle_rate=1, retry_after=0))
+        with self.assertRaises(requests.HTTPError):
+            parse_ipa_transcription.transcript_words(WORDS, "french")
+        network.close_sessions()
+
+        # retried until the requests get through
+        network.set_transport(transport.FaultInjectingTransport(replay, latency=0.01, throttle_rate=0.3,
+                                                                retry_after=0, seed=1))
+        self.assertTrue(parse_ipa_transcription.transcript_words(WORDS, "french")["parler"])
+
+    def test_incomplete_transport(self):
+        class Incomplete(transport.Transport):
+            pass
+
+        # fails when it is created, not on its first request
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Anki IPA add-on for Anki.
+Transports which send the requests of network.get and network.post, e.g. to record and replay Wiktionary answers
+Copyright: (c) m-rtin <https://github.com/m-rtin>
+License: GNU AGPLv3 <https://www.gnu.org/licenses/agpl.html>
+"""
+
+import abc
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from typing import Dict, List, Optional
+
+# Headers which are kept in recordings
+RECORDED_HEADERS = ("Content-Type", "Content-Length", "Content-Encoding", "Retry-After")
+
+
+class Transport(abc.ABC):
+    """Sends a single request, rate limits, retries and circuit breakers are handled by network."""
+
+    @abc.abstractmethod
+    def send(self, url: str, params: Optional[dict], token=None, data: Optional[dict] = None) -> requests.Response:
+        """ Send a GET request, or a POST request if there is a form body.
+
+        :param url: requested URL
+        :param params: query parameters
+        :param token: network.CancelToken of the request or None
+        :param data: form fields of a POST request
+        :return: response of the server
+        """
+
+    def close(self) -> None:
+        pass
+
+
+def request_key(url: str, params: Optional[dict], data: Optional[dict] = None) -> str:
+    """URL with sorted query parameters (and form fields) which identifies a request in recordings."""
+    query = urllib.parse.urlencode(sorted({**(params or {}), **(data or {})}.items()))
+    return f"{url}?{query}" if query else url
+
+
+def make_response(url: str, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """Build a response as if it had been received from a server."""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers or {})
+    response.headers.setdefault("Content-Length", str(len(body)))
+    response._content = body
+    response.encoding = "utf-8"
+    return response
+
+
+class RecordingTransport(Transport):
+    """Passes requests on and appends the responses to a JSON lines file, which ReplayTransport reads."""
+
+    def __init__(self, path: str, transport: Transport) -> None:
+        """ Initialize RecordingTransport.
+
+        :param path: file the responses are appended to
+        :param transport: transport which sends the requests
+        """
+        self.path = path
+        self.transport = transport
+        self._lock = threading.Lock()
+
+    def send(self, url: str, params: Optional[dict], token=None, data: Optional[dict] = None) -> requests.Response:
+        start = time.perf_counter()
+        response = self.transport.send(url, params, token, data)
+        record = {
+            "request": request_key(url, params, data),
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            "seconds": round(time.perf_counter() - start, 4),
+            # the body is stored decoded, Content-Length is the size on the wire
+            "body": response.content.decode("utf-8", "surrogateescape"),
+        }
+        record["headers"].pop("Content-Encoding", None)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8", errors="surrogateescape") as f:
+            f.write(line + "\n")
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """Answers requests from a recording without any network access."""
+
+    def __init__(self, path: str, replay_latency: bool = False) -> None:
+        """ Initialize ReplayTransport.
+
+        Responses recorded several times for the same request are replayed in the recorded order,
+        the last one is repeated.
+
+        :param path: file written by RecordingTransport
+        :param replay_latency: wait as long as the recorded request took
+        """
+        self.replay_latency = replay_latency
+        self._records: Dict[str, List[dict]] = {}
+        self._lock = threading.Lock()
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._records.setdefault(record["request"], []).append(record)
+
+    def send(self, url: str, params: Optional[dict], token=None, data: Optional[dict] = None) -> requests.Response:
+        key = request_key(url, params, data)
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}")
+            record = records.pop(0) if len(records) > 1 else records[0]
+        if self.replay_latency:
+            _wait(record.get("seconds", 0), token)
+        return make_response(key, record["status"], record["body"].encode("utf-8", "surrogateescape"),
+                             record["headers"])
+
+
+class FaultInjectingTransport(Transport):
+    """Adds latency, connection errors and throttling to the requests of another transport."""
+
+    def __init__(self, transport: Transport, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: Optional[float] = None, seed: Optional[int] = None) -> None:
+        """ Initialize FaultInjectingTransport.
+
+        :param transport: transport which sends the requests that don't fail
+        :param latency: seconds added to every request
+        :param jitter: maximum number of seconds randomly added to the latency
+        :param error_rate: share of requests which fail with a connection error
+        :param throttle_rate: share of requests answered with 429 Too Many Requests
+        :param retry_after: Retry-After seconds of the 429 answers, None to leave out the header
+        :param seed: seed of the random faults, for reproducible runs
+        """
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, url: str, params: Optional[dict], token=None, data: Optional[dict] = None) -> requests.Response:
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fault = self._random.random()
+        _wait(delay, token)
+        if fault < self.error_rate:
+            raise requests.exceptions.ConnectionError(f"Injected connection error for {url}")
+        if fault < self.error_rate + self.throttle_rate:
+            headers = {} if self.retry_after is None else {"Retry-After": str(int(self.retry_after))}
+            return make_response(request_key(url, params, data), 429, b"Too Many Requests", headers)
+        return self.transport.send(url, params, token, data)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+def _wait(seconds: float, token) -> None:
+    if seconds <= 0:
+        return
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)